@@ -5,11 +5,104 @@
 #
 # It analyses all the sources of inconsistencies found in trimming the dataset with the purpose of filtering wrong data as to improve sense embedding while
 # solving some inconsistencies as to augment the training corpus.
+# All the statistics are computed together in a single pass by analyze_inconsistencies, which returns them as an InconsistencyReport.
+# The WordNet lemmas of the BabelNet ids are read from a table built once with NLTK and saved on disk.
 # -----------------------------------------------------------------------------------------------------------------------------------------------------------
 
-from langdetect import detect_langs
-from nltk.corpus import wordnet as wn
-import nltk
+import os
+import math
+import atexit
+import sqlite3
+import functools
+import collections
+import multiprocessing
+import importlib.metadata
+import numpy as np
+from langdetect import detect_langs, DetectorFactory
+from utils import wordnet_id
+from cache_utils import mapping_version
+from profiling import instrument, result_length
+
+LEMMA_TABLE_PATH = '../resources/bn2lemma.tsv'     # persisted table of the WordNet lemmas of the BabelNet ids
+
+LANGUAGE_CACHE_PATH = '../resources/languages.sqlite'  # persistent cache of the languages detected for the anchors
+
+_lemma_tables = dict()     # version of the mapping -> lemma table, so that each table is loaded once per process
+_language_db = None        # connection to the persistent cache of the languages, opened at the first use
+_pending_languages = 0     # nr. of detections of which_language not yet committed
+
+LANGUAGE_SEED = 0          # seed of langdetect, that makes the detection deterministic so that the cached results do not depend on the run
+LANGUAGE_BATCH = 1000      # nr. of detections committed together to the persistent cache
+DetectorFactory.seed = LANGUAGE_SEED
+
+# --- Function that returns the version of the WordNet corpus of NLTK. ---
+# :return version: version of WordNet, e.g. '3.0'
+
+@functools.lru_cache(maxsize=None)
+def wordnet_version():
+
+    from nltk.corpus import wordnet as wn
+
+    return wn.get_version()
+
+
+# --- Function that returns the key of the saved lemma table: the lemmas depend on both the mapping and the WordNet version of NLTK. ---
+# :param bnId2wnId: dictionary that maps the BabelNet ids to WordNet ones
+# :return key: version of the mapping and version of WordNet
+
+def lemma_table_key(bnId2wnId):
+
+    return mapping_version(bnId2wnId) + ' wordnet-' + wordnet_version()
+
+
+# --- Function that builds the table of the WordNet lemmas of all the BabelNet ids of a mapping and saves it. ---
+# Together with wordnet_version it is the only function that needs the WordNet corpus of NLTK.
+# :param bnId2wnId: dictionary that maps the BabelNet ids to WordNet ones
+# :param path: path of the file where the table is saved
+# :return table: dictionary whose keys are the BabelNet ids and the values are the lemmas of the corr. synsets
+
+def build_lemma_table(bnId2wnId, path=LEMMA_TABLE_PATH):
+
+    from nltk.corpus import wordnet as wn
+
+    table = dict()
+    for bnId in bnId2wnId:
+        pos, offset = wordnet_id(bnId2wnId, bnId)
+        try:
+            synset = wn.synset_from_pos_and_offset(pos, offset)     # get the synset
+        except Exception:                                           # the id is not in the WordNet version of NLTK
+            continue
+        table[bnId] = str(synset)[8:-7]                             # extract the sense from the synset
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write('# ' + lemma_table_key(bnId2wnId) + '\n')            # first line: versions of the mapping and of WordNet the table was built from
+        for bnId, lemma in table.items():
+            f.write(bnId + '\t' + lemma + '\n')
+    os.replace(tmp, path)
+    return table
+
+
+# --- Function that returns the table of the WordNet lemmas of the BabelNet ids, building it only if the saved one is missing or out of date. ---
+# The saved table is out of date when it was built from another mapping or another WordNet version (see lemma_table_key).
+# :param bnId2wnId: dictionary that maps the BabelNet ids to WordNet ones
+# :param path: path of the file where the table is saved
+# :return table: dictionary whose keys are the BabelNet ids and the values are the lemmas of the corr. synsets
+
+def lemma_table(bnId2wnId, path=LEMMA_TABLE_PATH):
+
+    version = mapping_version(bnId2wnId)
+    if version in _lemma_tables:
+        return _lemma_tables[version]
+    table = None
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            if f.readline().strip() == '# ' + lemma_table_key(bnId2wnId):
+                table = dict(line.rstrip('\n').split('\t') for line in f)
+    if table is None:
+        table = build_lemma_table(bnId2wnId, path)
+    _lemma_tables[version] = table
+    return table
+
 
 # --- Function that detects the percentage of annotations whose anchors are not in the corresponding sentences. ---
 # :param sentences: a 1D numpy array of all the English sentences collected from the dataset
@@ -76,38 +169,114 @@ def not_in_low_up(sentences, annotations):
     return 100*positives/tot                            # compute the percentage
 
 
+# --- Function that detects the language of a string without any cache. ---
+# :param anchor: a string
+# :return xx: abbreviation of the language ('en' if it is not possible to estimate it, like for numbers, acronymus etc.)
+
+def detect_language(anchor):
+
+    try:
+        langs = detect_langs(anchor)        # returns a list of elems with format xx:prob where xx is the abbreviation of the language and probs is the probability that belongs to that lang.
+        return str(langs[0])[:2]
+    except:                                 # if not possible to estimate language
+        return 'en'                         # suppose it's English
+
+
+# --- Function that returns the name of the table of the persistent cache that holds the languages detected by this version of langdetect. ---
+# The results of another version or seed are kept in their own table, so they are never mixed with these ones.
+# :return name: name of the table
+
+@functools.lru_cache(maxsize=None)
+def language_table():
+
+    try:
+        version = importlib.metadata.version('langdetect')
+    except importlib.metadata.PackageNotFoundError:
+        version = 'unknown'
+    return 'languages_{}_seed{}'.format(''.join(c if c.isalnum() else '_' for c in version), LANGUAGE_SEED)
+
+
+# --- Function that opens (once per process) the persistent cache of the detected languages. ---
+# :return db: sqlite3 connection to the database with the table language_table()(anchor, lang)
+
+def language_db():
+
+    global _language_db
+    if _language_db is None:
+        _language_db = sqlite3.connect(LANGUAGE_CACHE_PATH)
+        _language_db.execute('CREATE TABLE IF NOT EXISTS {} (anchor TEXT PRIMARY KEY, lang TEXT NOT NULL)'.format(language_table()))
+        atexit.register(_language_db.commit)            # the detections of the last batch are committed at exit
+    return _language_db
+
+
+# --- Function that detects the languages of many strings, each distinct string only once. ---
+# The strings already in the persistent cache are not detected again, the others are detected in parallel and added to the cache in batches, so
+# that an interrupted run keeps the detections of the batches already done.
+# :param anchors: iterable of strings
+# :param workers: number of worker processes for the detection
+# :return langs: dictionary whose keys are the distinct strings and the values are the abbreviations of their languages
+
+@instrument(result_length)
+def detect_languages(anchors, workers=1):
+
+    unique = list(dict.fromkeys(anchors))               # distinct strings, in order of first occurrence
+    db = language_db()
+    table = language_table()
+    langs = dict()
+    for i in range(0, len(unique), 500):                # looks up the persistent cache (500 parameters per query)
+        chunk = unique[i:i+500]
+        langs.update(db.execute('SELECT anchor, lang FROM {} WHERE anchor IN ({})'.format(table, ','.join('?'*len(chunk))), chunk))
+    missing = [anchor for anchor in unique if anchor not in langs]
+    if missing:
+        pool = multiprocessing.Pool(workers) if workers > 1 else None
+        try:
+            for i in range(0, len(missing), LANGUAGE_BATCH):
+                chunk = missing[i:i+LANGUAGE_BATCH]
+                if pool is not None:
+                    detected = pool.map(detect_language, chunk, chunksize=max(1, len(chunk)//(4*workers)))
+                else:
+                    detected = [detect_language(anchor) for anchor in chunk]
+                new = list(zip(chunk, detected))
+                langs.update(new)
+                db.executemany('INSERT OR REPLACE INTO {} VALUES (?, ?)'.format(table), new)
+                db.commit()                             # one transaction per batch
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    return langs
+
+
 # --- Function that detects whether the language of the anchor is English ---
 # :param anchor: a string
 # :return boolean: True if the language detected is English, False otherwise
 
 def isEnglish(anchor):
 
-    try:
-        langs = detect_langs(anchor)        # returns a list of elems with format xx:prob where xx is the abbreviation of the language and probs is the probability that belongs to that lang.
-        return str(langs[0])[:2] == 'en'    # returns whether is English or not
-    except:                                 # if not possible to estimate language (like numbers, acronymus etc.)
-        return True                         # suppose it's English
+    return which_language(anchor) == 'en'   # if not possible to estimate language (like numbers, acronymus etc.) suppose it's English
 
 
 # --- Function that detects the percentage of annotations whose anchors are not in the corr. sentence and belong to another language. ---
 # :param sentences: a 1D numpy array of all the English sentences collected from the dataset
 # :param annotations: a 3D numpy array with nr. of rows the nr. of sentences, nr. of cols the nr. of annotations for each sentence and as 3rd dim. a 3-element vector (anchor, lemma, id_synset)
+# :param workers: number of worker processes for the language detection
 # :return p: percentage of annotations whose anchors are not in the corr. sentence and belong to another language
 
-def not_in_other_lang(sentences, annotations):
+def not_in_other_lang(sentences, annotations, workers=1):
 
     tot = 0
-    positives = 0
+    anchors = collections.Counter()         # occurrences of the anchors of the inconsistent annotations
 
     for i, annotation in enumerate(annotations):
         sentence = sentences[i]             # get the corresponding sentence
         for a in annotation:                # a = (anchor,lemma,id)
             string = ' '+a[0]+' '           # pad the anchor with spaces to detect if it is in the sentence as a single word
             if string not in sentence:      # if inconsitent
-                if not isEnglish(a[0]):     # if not in English
-                    positives += 1          # increment the counter
+                anchors[a[0]] += 1
                 tot+=1
 
+    langs = detect_languages(anchors, workers)                                  # detects each distinct anchor once
+    positives = sum(n for anchor, n in anchors.items() if langs[anchor] != 'en')  # nr. of annotations not in English
     return 100*positives/tot                # compute the percentage
 
 
@@ -121,6 +290,7 @@ def in_but_wrong_annot(sentences, annotations, bnId2wnId):
 
     tot = 0
     positives = 0
+    bn2lemma = lemma_table(bnId2wnId)   # BabelNet id -> lemma of the WordNet synset
 
     for i, annotation in enumerate(annotations):
         sentence = sentences[i]             # get the corresponding sentence
@@ -128,9 +298,7 @@ def in_but_wrong_annot(sentences, annotations, bnId2wnId):
             string = ' '+a[0]+' '           # pad the anchor with spaces to detect if it is in the sentence as a single word
             if string in sentence:          # if consistent
                 tot += 1
-                offset = bnId2wnId[a[2]]    # get the corr. WordNet id
-                synset = wn.synset_from_pos_and_offset( offset[-1], int(offset[:-1]))   # get the synset
-                lemma = str(synset)[8:-7]   # extract the sense from the synset
+                lemma = bn2lemma[a[2]]     # get the lemma of the corr. WordNet synset
                 if lemma != a[1]:           # if it is different from the corr. lemma
                     positives += 1          # increment the counter
 
@@ -147,6 +315,7 @@ def in_but_up_low_mismatch(sentences, annotations, bnId2wnId):
 
     tot = 0
     positives = 0
+    bn2lemma = lemma_table(bnId2wnId)   # BabelNet id -> lemma of the WordNet synset
 
     for i, annotation in enumerate(annotations):
         sentence = sentences[i]
@@ -154,9 +323,7 @@ def in_but_up_low_mismatch(sentences, annotations, bnId2wnId):
             string = ' '+a[0]+' '
             if string in sentence:   # if consistent
                 tot += 1
-                offset = bnId2wnId[a[2]]
-                synset = wn.synset_from_pos_and_offset( offset[-1], int(offset[:-1]))
-                lemma = str(synset)[8:-7]
+                lemma = bn2lemma[a[2]]
                 if lemma != a[1]:                       # if wrong-associated 
                     if lemma.lower() == a[1].lower():   # but with a lower reduction equivalent
                         positives += 1
@@ -183,6 +350,7 @@ def in_but_underscore_mismatch(sentences, annotations, bnId2wnId):
 
     tot = 0
     positives = 0
+    bn2lemma = lemma_table(bnId2wnId)   # BabelNet id -> lemma of the WordNet synset
 
     for i, annotation in enumerate(annotations):
         sentence = sentences[i]
@@ -190,9 +358,7 @@ def in_but_underscore_mismatch(sentences, annotations, bnId2wnId):
             string = ' '+a[0]+' '
             if string in sentence:      # if consistent
                 tot += 1
-                offset = bnId2wnId[a[2]]
-                synset = wn.synset_from_pos_and_offset( offset[-1], int(offset[:-1]))
-                lemma = str(synset)[8:-7]
+                lemma = bn2lemma[a[2]]
                 if lemma != a[1]:      # if wrong-associated
                     if lemma.lower() == edit_string(a[1].lower()): # if equivalent with underscored version
                         positives += 1
@@ -222,6 +388,7 @@ def in_wrong_but_shifted(sentences, annotations, bnId2wnId):
 
     tot = 0
     positives = 0
+    bn2lemma = lemma_table(bnId2wnId)   # BabelNet id -> lemma of the WordNet synset
 
     for i, annotation in enumerate(annotations):
         sentence = sentences[i]
@@ -229,9 +396,7 @@ def in_wrong_but_shifted(sentences, annotations, bnId2wnId):
             string = ' '+a[0]+' '
             if string in sentence:   # if consistent
                 tot += 1
-                offset = bnId2wnId[a[2]]
-                synset = wn.synset_from_pos_and_offset( offset[-1], int(offset[:-1]))
-                lemma = str(synset)[8:-7]
+                lemma = bn2lemma[a[2]]
                 if lemma.lower() != a[1].lower():   # if wrong-associated
                     if lemma.lower() in get_lemmas(annotation):  # if lemma in other synsets of the same sentence
                         positives += 1
@@ -242,64 +407,264 @@ def in_wrong_but_shifted(sentences, annotations, bnId2wnId):
 # Functions that allow a more deep analysis of the language incongruencies
 
 # --- Function that returns the abbreviation of the language of the input word ---
+# The most recent results are kept in memory, the others are looked up in the persistent cache before being detected; the new detections are
+# committed every LANGUAGE_BATCH.
 # :param anchor: string whose language has to be detected
 # :return xx: abbreviation of the language
 
+@functools.lru_cache(maxsize=1 << 16)
 def which_language(anchor):
 
-    try:
-        langs = detect_langs(anchor)
-        return str(langs[0])[:2]
-    except:     # if not possible to estimate language (like numbers, acronymus etc.) suppose English
-        return 'en'
+    global _pending_languages
+    db = language_db()
+    table = language_table()
+    row = db.execute('SELECT lang FROM {} WHERE anchor = ?'.format(table), (anchor,)).fetchone()
+    if row is not None:
+        return row[0]
+    lang = detect_language(anchor)
+    db.execute('INSERT OR REPLACE INTO {} VALUES (?, ?)'.format(table), (anchor, lang))
+    _pending_languages += 1
+    if _pending_languages >= LANGUAGE_BATCH:
+        db.commit()
+        _pending_languages = 0
+    return lang
 
 
 # --- Function that collects the list of all the anchors' languages of the annotations. ---
 # :param annotations: a 3D numpy array with nr. of rows the nr. of sentences, nr. of cols the nr. of annotations for each sentence and as 3rd dim. a 3-element vector (anchor, lemma, id_synset)
+# :param workers: number of worker processes for the language detection
 # :return langs: list of all the anchors' languages
 
-def collect_languages(annotations):
+def collect_languages(annotations, workers=1):
+
+    detected = detect_languages((a[0] for annotation in annotations for a in annotation), workers)  # detects each distinct anchor once
 
     langs = []
 
     for annotation in annotations:
         l = []  # collects all the 
         for a in annotation:     # a = (anchor,lemma,id)
-            l.append(which_language(a[0])) 
+            l.append(detected[a[0]])
         langs.append(l)
 
     return langs
 
  # -------------------------------------------------------------------------------
 
-# --- Main function that executes all the functions descibed above and prints the results. ---
-
-def inconsistency_analysis(sentences, annotations, bnId2wnId):
+# --- Class that collects the results of the analysis of the inconsistencies. ---
+# For each category it keeps the number of positive annotations and the number of annotations it is computed over (all the annotations, the
+# not-consistent ones or the consistent ones). When a sample of sentences is analysed it also keeps the counts of each sampled sentence, since the
+# sentence, not the annotation, is the sampling unit.
+
+class InconsistencyReport(object):
+
+    # (name, population, description) of each category, in the order they are reported
+    CATEGORIES = [
+        ('not_in_sentence', 'all', 'of the annotations whose anchors are not in the corresponding sentence'),
+        ('not_in_but_partial', 'inconsistent', 'of the not-consistent annotations whose anchors are anyway part of the corresponding sentence'),
+        ('not_in_low_up', 'inconsistent', 'of the not-consistent annotations whose not-validity is due to an upper-lower format mismatch'),
+        ('not_in_other_lang', 'inconsistent', 'of the not-consistent annotations whose anchors belong to other languages'),
+        ('in_but_wrong_annot', 'consistent', 'of the consistent annotations whose synsets do not match with the corresponding lemma'),
+        ('in_but_up_low_mismatch', 'consistent', 'of the consistent annotations whose mismatch between synsets and corresponding lemma is due an upper-lower format mismatch'),
+        ('in_but_underscore_mismatch', 'consistent', 'of the consistent annotations whose mismatch is due a missing underscore among multiple-words lemmas'),
+        ('in_wrong_but_shifted', 'consistent', 'of the consistent annotations whose mismatch is due to a shift of annotations into the same sentence'),
+    ]
+
+    def __init__(self, population=None):
+
+        self.sentences = 0                  # nr. of sentences analysed
+        self.population = population        # nr. of sentences of the corpus when the analysed ones are a sample of it, None otherwise
+        self.totals = {'all': 0, 'inconsistent': 0, 'consistent': 0}     # size of each population
+        self.counts = dict((name, 0) for name, _, _ in self.CATEGORIES)  # nr. of positives of each category
+        self.columns = list(self.totals) + list(self.counts)             # order of the counts of each sampled sentence
+        self.clusters = []                  # counts of each sampled sentence, in the order of self.columns
+
+    # --- Method that returns the current counts, in the order of self.columns. ---
+    # :return counts: list of the sizes of the populations followed by the nr. of positives of the categories
+
+    def snapshot(self):
+
+        return [self.totals[name] for name in self.totals] + [self.counts[name] for name in self.counts]
+
+    # --- Method that records the counts of a sampled sentence. ---
+    # :param before: snapshot taken before the annotations of the sentence were counted
+
+    def add_cluster(self, before):
+
+        self.clusters.append([after-b for after, b in zip(self.snapshot(), before)])
+
+    # --- Method that returns the number of annotations a category is computed over. ---
+    # :param name: name of the category
+    # :return n: size of the population of the category
+
+    def total(self, name):
+
+        for category, population, _ in self.CATEGORIES:
+            if category == name:
+                return self.totals[population]
+        raise KeyError(name)
+
+    # --- Method that returns the percentage of a category (nan if its population is empty). ---
+    # :param name: name of the category
+    # :return p: percentage of positives over the population of the category
+
+    def percentage(self, name):
+
+        tot = self.total(name)
+        return 100*self.counts[name]/tot if tot else float('nan')
+
+    # --- Method that returns the confidence interval of the percentage of a category. ---
+    # The percentage is a ratio estimator over a sample of sentences, whose annotations are not independent: its variance is computed from the
+    # residuals of the sampled sentences, with the finite population correction. When the whole corpus is analysed the percentage is exact.
+    # :param name: name of the category
+    # :param z: quantile of the normal distribution of the confidence level (1.96 for 95%)
+    # :return low, high: bounds of the interval, as percentages (nan if the population of the category is empty or less than 2 sentences are sampled)
+
+    def confidence_interval(self, name, z=1.96):
+
+        n = self.total(name)
+        if n == 0:
+            return float('nan'), float('nan')
+        p = self.counts[name]/n
+        if self.population is None:
+            return 100*p, 100*p
+        m = len(self.clusters)
+        if m < 2:
+            return float('nan'), float('nan')
+        group = next(population for category, population, _ in self.CATEGORIES if category == name)
+        clusters = np.asarray(self.clusters, dtype=np.float64)
+        y = clusters[:, self.columns.index(name)]               # positives of each sentence
+        x = clusters[:, self.columns.index(group)]              # annotations of each sentence in the population of the category
+        fpc = 1 - m/self.population                             # finite population correction
+        se = math.sqrt(fpc * m/(m-1) * np.sum((y - p*x)**2)) / n
+        return 100*max(0.0, p-z*se), 100*min(1.0, p+z*se)
+
+    # --- Method that returns the report as a dictionary. ---
+    # :return d: dictionary with the sizes of the populations and, for each category, its count, population, percentage and confidence interval
+
+    def as_dict(self):
+
+        d = {'sentences': self.sentences, 'population': self.population, 'totals': dict(self.totals)}
+        for name, population, _ in self.CATEGORIES:
+            d[name] = {'count': self.counts[name], 'total': self.total(name), 'percentage': self.percentage(name), 'interval': self.confidence_interval(name)}
+        return d
+
+    def __str__(self):
+
+        lines = []
+        if self.population is not None:
+            lines.append('Sample of {} sentences out of {} (95% confidence intervals).'.format(self.sentences, self.population))
+        for name, _, description in self.CATEGORIES:
+            line = 'There is a {} \%\ {}.'.format(self.percentage(name), description)
+            if self.population is not None:
+                line += ' [{:.2f}, {:.2f}]'.format(*self.confidence_interval(name))
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+# --- Function that draws a reproducible random sample of sentences. ---
+# :param n: nr. of sentences of the corpus
+# :param sample: fraction of the sentences (float in (0, 1]) or nr. of sentences (int) to draw
+# :param seed: seed of the random generator
+# :return indices: sorted array of the indices of the sampled sentences
 
-    print('Starting analysis...')
+def sample_sentences(n, sample, seed=0):
 
-    result = not_in_sentence(sentences, annotations)
-    print('There is a {} \%\ of the annotations whose anchors are not in the corresponding sentence.'.format(result))
-    
-    result = not_in_but_partial(sentences, annotations)
-    print('There is a {} \%\ of the not-consistent annotations whose anchors are anyway part of the corresponding sentence.'.format(result))
+    size = int(round(sample*n)) if isinstance(sample, float) else int(sample)
+    size = max(0, min(size, n))
+    return np.sort(np.random.RandomState(seed).choice(n, size, replace=False))
 
-    result = not_in_low_up(sentences, annotations)
-    print('There is a {} \%\ of the not-consistent annotations whose not-validity is due to an upper-lower format mismatch.'.format(result))
 
-    result = not_in_other_lang(sentences, annotations)
-    print('There is a {} \%\ of the not-consistent annotations whose anchors belong to other languages.'.format(result))
-
-    result = in_but_wrong_annot(sentences, annotations, bnId2wnId)
-    print('There is a {} \%\ of the consistent annotations whose synsets do not match with the corresponding lemma.'.format(result))
-    
-    result = in_but_up_low_mismatch(sentences, annotations, bnId2wnId)
-    print('There is a {} \%\ of the consistent annotations whose mismatch between synsets and corresponding lemma is due an upper-lower format mismatch.'.format(result))
-
-    result = in_but_underscore_mismatch(sentences, annotations, bnId2wnId)
-    print('There is a {} \%\ of the consistent annotations whose mismatch is due a missing underscore among multiple-words lemmas.'.format(result))
-
-    result = in_wrong_but_shifted(sentences, annotations, bnId2wnId)
-    print('There is a {} \%\ of the consistent annotations whose mismatch is due to a shift of annotations into the same sentence.'.format(result))
-
-    return
\ No newline at end of file
+# --- Function that computes all the statistics of the functions described above in a single pass over the annotations. ---
+# Each sentence is lower-cased once, the lemma of the synset of each consistent annotation is retrieved once from the lemma table and the language of
+# each distinct not-consistent anchor is detected once at the end.
+# :param sentences: a 1D numpy array of all the English sentences collected from the dataset
+# :param annotations: a 3D numpy array with nr. of rows the nr. of sentences, nr. of cols the nr. of annotations for each sentence and as 3rd dim. a 3-element vector (anchor, lemma, id_synset)
+# :param bnId2wnId: dictionary that maps the BabelNet ids to WordNet ones
+# :param workers: number of worker processes for the language detection
+# :param sample: if not None, only a random sample of the sentences is analysed (see sample_sentences)
+# :param seed: seed of the random sample
+# :return report: InconsistencyReport with the counts of all the categories
+
+@instrument(lambda report, *args, **kwargs: report.sentences)
+def analyze_inconsistencies(sentences, annotations, bnId2wnId, workers=1, sample=None, seed=0):
+
+    if sample is None:
+        report = InconsistencyReport()
+        indices = range(len(annotations))
+    else:
+        report = InconsistencyReport(population=len(annotations))
+        indices = sample_sentences(len(annotations), sample, seed).tolist()
+    bn2lemma = lemma_table(bnId2wnId)                   # BabelNet id -> lemma of the WordNet synset
+    anchors = collections.Counter()                     # occurrences of the anchors of the inconsistent annotations
+    sampled = report.population is not None
+    sentence_anchors = []                               # anchors of the inconsistent annotations of each sampled sentence
+    counts = report.counts
+    totals = report.totals
+
+    for i in indices:
+        annotation = annotations[i]
+        sentence = sentences[i]
+        lower_sentence = sentence.lower()
+        sentence_lemmas = None                          # lower-case lemmas of the sentence, computed only if needed
+        report.sentences += 1
+        if sampled:
+            before = report.snapshot()
+            sentence_anchors.append([])
+        for a in annotation:                            # a = (anchor,lemma,id)
+            string = ' '+a[0]+' '                       # pad the anchor with spaces to detect if it is in the sentence as a single word
+            totals['all'] += 1
+            if string not in sentence:                  # if inconsistent
+                totals['inconsistent'] += 1
+                counts['not_in_sentence'] += 1
+                if a[0].lower() in lower_sentence:      # if it's part of the sentence
+                    counts['not_in_but_partial'] += 1
+                if string.lower() in lower_sentence:    # if the padded version is part of the sentence
+                    counts['not_in_low_up'] += 1
+                anchors[a[0]] += 1                      # language detected at the end, once per distinct anchor
+                if sampled:
+                    sentence_anchors[-1].append(a[0])
+            else:                                       # if consistent
+                totals['consistent'] += 1
+                lemma = bn2lemma[a[2]]                  # lemma of the corr. WordNet synset
+                if lemma != a[1]:                       # if wrong-associated
+                    counts['in_but_wrong_annot'] += 1
+                    lower_lemma = a[1].lower()
+                    if lemma.lower() == lower_lemma:    # but with a lower reduction equivalent
+                        counts['in_but_up_low_mismatch'] += 1
+                    if lemma.lower() == edit_string(lower_lemma):   # or equivalent with underscored version
+                        counts['in_but_underscore_mismatch'] += 1
+                if lemma.lower() != a[1].lower():
+                    if sentence_lemmas is None:
+                        sentence_lemmas = get_lemmas(annotation)
+                    if lemma.lower() in sentence_lemmas:         # if lemma in other synsets of the same sentence
+                        counts['in_wrong_but_shifted'] += 1
+        if sampled:
+            report.add_cluster(before)
+
+    langs = detect_languages(anchors, workers)
+    counts['not_in_other_lang'] = sum(n for anchor, n in anchors.items() if langs[anchor] != 'en')   # if not in English
+    column = report.columns.index('not_in_other_lang')
+    for cluster, l in zip(report.clusters, sentence_anchors):
+        cluster[column] = sum(langs[anchor] != 'en' for anchor in l)
+    return report
+
+
+# --- Main function that computes all the statistics descibed above and prints the results. ---
+# :param sentences: a 1D numpy array of all the English sentences collected from the dataset
+# :param annotations: a 3D numpy array with nr. of rows the nr. of sentences, nr. of cols the nr. of annotations for each sentence and as 3rd dim. a 3-element vector (anchor, lemma, id_synset)
+# :param bnId2wnId: dictionary that maps the BabelNet ids to WordNet ones
+# :param verbose: whether to print the results
+# :param workers: number of worker processes for the language detection
+# :param sample: if not None, fraction (float) or nr. (int) of sentences of the reproducible random sample to analyse instead of the whole corpus
+# :param seed: seed of the random sample
+# :return report: InconsistencyReport with the results (and their confidence intervals when sampling)
+
+def inconsistency_analysis(sentences, annotations, bnId2wnId, verbose=True, workers=1, sample=None, seed=0):
+
+    if verbose:
+        print('Starting analysis...')
+    report = analyze_inconsistencies(sentences, annotations, bnId2wnId, workers, sample, seed)
+    if verbose:
+        print(report)
+    return report
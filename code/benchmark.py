@@ -0,0 +1,431 @@
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+#   Benchmarks of the stages of the pipeline on synthetic corpora.
+#
+# @author Giada Simionato <simionato.1822614@studenti.uniroma1.it>
+#
+# It generates a synthetic BabelNet-WordNet mapping, the word lists of the validity filter, a EuroSense-style XML file, a Sew-style tree of articles,
+# a word-similarity file and random embeddings of a configurable size, then times each stage (parse_eurosense, parse_sew, fix_data, getSewTensor,
+# score_model, filter_embedding, save_senses) in its own process, recording its throughput (sentences/s, annotations/s, MB/s) and peak memory. The
+# results are saved as JSON and can be compared with the ones of a previous run.
+#
+# Usage: python benchmark.py [--sentences 20000] [--articles 2000] [--folders 8] [--workers 1] [--out benchmark.json] [--compare old.json]
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import os
+import json
+import time
+import shutil
+import random
+import platform
+import argparse
+import queue as queues
+import multiprocessing
+import numpy as np
+from pipeline import peak_rss
+
+STOPWORDS = ['the', 'of', 'and', 'a', 'in', 'is', 'which', 'also', ',', '.', '12', 'i']  # tokens that the validation discards (or keeps) most often
+
+# --- Function that generates the vocabulary of a synthetic corpus. ---
+# :param nWords: nr. of content words
+# :param rng: random.Random instance
+# :return words: list of the words, content words followed by the stopwords
+
+def generate_words(nWords, rng):
+
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = set()
+    while len(words) < nWords:
+        words.add(''.join(rng.choice(letters) for _ in range(rng.randint(3, 10))))
+        words.difference_update(STOPWORDS)
+    return sorted(words) + STOPWORDS
+
+
+# --- Function that generates the synthetic word lists of the validity filter (see fix_inconsistencies.build_validity_resource). ---
+# :param folder: folder where stopwords.json, long_stopwords.json, 1words.json and 2words.json are written
+
+def generate_word_lists(folder):
+
+    lists = {'stopwords.json': ['the', 'of', 'and', 'a', 'in', 'is'], 'long_stopwords.json': ['which', 'also'], '1words.json': ['i'], '2words.json': []}
+    for name, words in lists.items():
+        with open(os.path.join(folder, name), 'w', encoding='utf-8') as f:
+            json.dump(words, f)
+
+
+# --- Function that generates a synthetic bn2wn_mapping file. ---
+# :param path: path of the file
+# :param nSynsets: nr. of BabelNet ids with a WordNet id (the ids from bn:00000000n to nSynsets-1)
+
+def generate_mapping(path, nSynsets):
+
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(nSynsets):
+            f.write('bn:{:08d}n\t{:08d}n\n'.format(i, 1000000+i))
+
+
+# --- Function that draws a sentence from the vocabulary, mixing content words and stopwords. ---
+# :param words: vocabulary
+# :param length: nr. of tokens
+# :param rng: random.Random instance
+# :return tokens: list of the tokens
+
+def draw_tokens(words, length, rng):
+
+    return [rng.choice(STOPWORDS) if rng.random() < 0.3 else rng.choice(words) for _ in range(length)]
+
+
+# --- Function that generates a synthetic EuroSense XML file. ---
+# Every sentence has an English and an Italian text and English and Italian annotations; some English anchors are upper-case variants of the words of
+# the sentence, some are not in the sentence at all and some BabelNet ids are not in the mapping, as in the real dataset.
+# :param path: path of the file
+# :param nSentences: nr. of sentences
+# :param words: vocabulary
+# :param nSynsets: nr. of BabelNet ids in the mapping
+# :param rng: random.Random instance
+# :return nAnnotations: nr. of English annotations written
+
+def generate_eurosense(path, nSentences, words, nSynsets, rng):
+
+    nAnnotations = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<corpus source="synthetic">\n')
+        for i in range(nSentences):
+            tokens = draw_tokens(words, rng.randint(10, 40), rng)
+            f.write('<sentence id="{}">\n<text lang="en">{}</text>\n<text lang="it">{}</text>\n<annotations>\n'.format(i, ' '.join(tokens), ' '.join(tokens[::-1])))
+            for _ in range(rng.randint(1, 8)):
+                anchor = rng.choice(tokens) if rng.random() < 0.9 else rng.choice(words)
+                if rng.random() < 0.2:
+                    anchor = anchor.capitalize()
+                bn = 'bn:{:08d}n'.format(rng.randrange(int(nSynsets*1.1)))     # about 10% of the ids are not in the mapping
+                f.write('<annotation lang="en" type="NASARI" anchor="{0}" lemma="{1}" coherenceScore="0.5" nasariScore="0.5">{2}</annotation>\n'.format(anchor, anchor.lower(), bn))
+                nAnnotations += 1
+            f.write('<annotation lang="it" type="NASARI" anchor="x" lemma="x">bn:00000000n</annotation>\n</annotations>\n</sentence>\n')
+        f.write('</corpus>\n')
+    return nAnnotations
+
+
+# --- Function that generates a synthetic Sew dataset: a folder of folders of XML articles. ---
+# :param path: path of the dataset folder
+# :param nFolders: nr. of folders
+# :param nArticles: nr. of articles (spread over the folders)
+# :param words: vocabulary
+# :param nSynsets: nr. of BabelNet ids in the mapping
+# :param rng: random.Random instance
+# :return nAnnotations: nr. of annotations written
+
+def generate_sew(path, nFolders, nArticles, words, nSynsets, rng):
+
+    nAnnotations = 0
+    for i in range(nArticles):
+        folder = os.path.join(path, 'wiki{:03d}'.format(i % nFolders))
+        os.makedirs(folder, exist_ok=True)
+        tokens = draw_tokens(words, rng.randint(100, 1000), rng)
+        language = 'EN' if rng.random() < 0.95 else 'IT'
+        with open(os.path.join(folder, '{}.xml'.format(i)), 'w', encoding='utf-8') as f:
+            f.write('<wikiArticle language="{}" title="article {}">\n<text>{}</text>\n<annotations>\n'.format(language, i, ' '.join(tokens)))
+            for start in sorted(rng.sample(range(len(tokens)), min(len(tokens), rng.randint(10, 100)))):
+                bn = 'bn:{:08d}n'.format(rng.randrange(int(nSynsets*1.1)))
+                f.write('<annotation>\n<babelNetID>{}</babelNetID>\n<mention>{}</mention>\n<anchorStart>{}</anchorStart>\n<anchorEnd>{}</anchorEnd>\n'
+                        '<type>HL</type>\n</annotation>\n'.format(bn, tokens[start], start, start+1))
+                nAnnotations += 1
+            f.write('</annotations>\n</wikiArticle>\n')
+    return nAnnotations
+
+
+# --- Function that generates a synthetic word-similarity file (as combined.tab). ---
+# :param path: path of the file
+# :param words: vocabulary
+# :param nPairs: nr. of pairs
+# :param rng: random.Random instance
+
+def generate_pairs(path, words, nPairs, rng):
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('# Word 1\tWord 2\tHuman (mean)\n')
+        for _ in range(nPairs):
+            f.write('{}\t{}\t{:.2f}\n'.format(rng.choice(words), rng.choice(words), rng.uniform(0, 10)))
+
+
+# --- Function that generates random embeddings in word2vec text format, for all the words and for the senses of the lemmas. ---
+# :param path: path of the file
+# :param words: vocabulary
+# :param word2senses: dictionary whose keys are the lemmas and the corr. values are lists containing all the BabelNet ids corr. to that lemma
+# :param size: size of the embeddings
+# :param seed: seed of the random vectors
+
+def generate_embeddings(path, words, word2senses, size, seed):
+
+    keys = list(words) + [lemma.replace(' ', '_')+'_'+bnId for lemma in sorted(word2senses) for bnId in word2senses[lemma]]
+    vectors = np.random.RandomState(seed).standard_normal((len(keys), size)).astype(np.float32)
+    line = '%s' + ' %.6f'*size + '\n'
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{} {}\n'.format(len(keys), size))
+        for key, row in zip(keys, vectors.tolist()):
+            f.write(line % (key, *row))
+
+
+# --- Function that generates all the inputs of the benchmarks. ---
+# :param root: folder where the inputs are written
+# :param config: dictionary with the sizes of the inputs and the seed
+# :return inputs: dictionary with the paths of the inputs and the nr. of annotations generated
+
+def generate_inputs(root, config):
+
+    rng = random.Random(config['seed'])
+    os.makedirs(root, exist_ok=True)
+    words = generate_words(config['words'], rng)
+    inputs = {
+        'mapping': os.path.join(root, 'bn2wn_mapping.txt'),
+        'eurosense': os.path.join(root, 'eurosense.xml'),
+        'sew': os.path.join(root, 'sew'),
+        'pairs': os.path.join(root, 'pairs.tab'),
+        'embeddings': os.path.join(root, 'embeddings.vec'),
+    }
+    if os.path.exists(inputs['sew']):
+        shutil.rmtree(inputs['sew'])
+    generate_mapping(inputs['mapping'], config['synsets'])
+    generate_word_lists(root)
+    inputs['wordLists'] = root
+    inputs['eurosense_annotations'] = generate_eurosense(inputs['eurosense'], config['sentences'], words, config['synsets'], rng)
+    inputs['sew_annotations'] = generate_sew(inputs['sew'], config['folders'], config['articles'], words, config['synsets'], rng)
+    generate_pairs(inputs['pairs'], words, config['pairs'], rng)
+    word2senses = dict((word, sorted(set('bn:{:08d}n'.format(rng.randrange(config['synsets'])) for _ in range(rng.randint(1, 5))))) for word in words[:config['words']])
+    generate_embeddings(inputs['embeddings'], words, word2senses, config['size'], config['seed'])
+    with open(os.path.join(root, 'word2senses.json'), 'w', encoding='utf-8') as f:
+        json.dump(word2senses, f)
+    inputs['word2senses'] = os.path.join(root, 'word2senses.json')
+    return inputs
+
+
+# --- Function that returns the total size of a file or of the files of a folder. ---
+# :param path: path of the file or folder
+# :return size: size in bytes
+
+def disk_size(path):
+
+    if os.path.isdir(path):
+        return sum(disk_size(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+
+# --------- STAGES: each function runs a stage on the inputs and returns the amounts of work done --------------------------------------------------
+
+def bench_parse_eurosense(inputs, root, workers):
+
+    from utils import load_bn2wn, parse_eurosense
+    from cache_utils import ParseCache
+    shutil.rmtree(os.path.join(root, 'cache'), ignore_errors=True)     # cold cache: the file is parsed
+    sentences, annotations = parse_eurosense(inputs['eurosense'], load_bn2wn(inputs['mapping']), ParseCache(os.path.join(root, 'cache')), out=os.path.join(root, 'euroStore'))
+    return {'sentences': len(sentences), 'annotations': annotations.store.meta['annotations'], 'bytes': disk_size(inputs['eurosense'])}
+
+
+def bench_parse_sew(inputs, root, workers):
+
+    from utils import load_bn2wn
+    from sew_utils import parse_sew
+    sentences, annotations = parse_sew(inputs['sew'], load_bn2wn(inputs['mapping']), workers=workers, verbose=False, out=os.path.join(root, 'sewStore'))
+    return {'sentences': len(sentences), 'annotations': annotations.store.meta['annotations'], 'bytes': disk_size(inputs['sew'])}
+
+
+def bench_fix_data(inputs, root, workers):
+
+    from store_utils import AnnotationStore
+    from fix_inconsistencies import iter_fix_data, set_word_lists
+    set_word_lists(inputs['wordLists'])
+    store = AnnotationStore(os.path.join(root, 'euroStore'))
+    rows = sum(1 for _ in iter_fix_data(store.sentences, store.annotations, 4, workers=workers))
+    return {'sentences': len(store), 'annotations': store.meta['annotations'], 'rows': rows}
+
+
+def bench_sew_tensor(inputs, root, workers):
+
+    from store_utils import AnnotationStore
+    from sew_utils import iterSewTensor
+    from fix_inconsistencies import set_word_lists
+    set_word_lists(inputs['wordLists'])
+    store = AnnotationStore(os.path.join(root, 'sewStore'))
+    rows = sum(1 for _ in iterSewTensor(store.sentences, store.annotations, 4, workers=workers))
+    return {'sentences': len(store), 'annotations': store.meta['annotations'], 'rows': rows}
+
+
+def bench_score_model(inputs, root, workers):
+
+    from gensim.models import KeyedVectors
+    from score import score_model
+    from sense_index import build_sense_index
+    luTable = KeyedVectors.load_word2vec_format(inputs['embeddings'], binary=False)
+    with open(inputs['word2senses'], encoding='utf-8') as f:
+        word2senses = json.load(f)
+    start = time.time()
+    score_model(inputs['pairs'], build_sense_index(luTable, word2senses), None)     # the index is built once per model, as in main.py
+    with open(inputs['pairs'], encoding='utf-8') as f:
+        pairs = sum(1 for _ in f) - 1
+    return {'pairs': pairs, 'seconds': time.time()-start}     # the loading of the embeddings is not part of the scoring
+
+
+def bench_filter_embedding(inputs, root, workers):
+
+    from utils import filter_embedding
+    path = os.path.join(root, 'filtered.vec')
+    shutil.copy(inputs['embeddings'], path)
+    start = time.time()
+    filter_embedding(path, os.path.join(root, 'full_embeddings.vec'))
+    return {'bytes': disk_size(inputs['embeddings']), 'seconds': time.time()-start}
+
+
+def bench_save_senses(inputs, root, workers):
+
+    from gensim.models import KeyedVectors
+    from utils import save_senses, save_senses_npy
+    luTable = KeyedVectors.load_word2vec_format(inputs['embeddings'], binary=False)
+    start = time.time()
+    save_senses(luTable, os.path.join(root, 'senses.vec'))
+    save_senses_npy(luTable, os.path.join(root, 'senses.npy'))
+    return {'bytes': disk_size(inputs['embeddings']), 'seconds': time.time()-start}
+
+
+STAGES = [
+    ('parse_eurosense', bench_parse_eurosense),
+    ('parse_sew', bench_parse_sew),
+    ('fix_data', bench_fix_data),
+    ('getSewTensor', bench_sew_tensor),
+    ('score_model', bench_score_model),
+    ('filter_embedding', bench_filter_embedding),
+    ('save_senses', bench_save_senses),
+]
+
+
+# --- Function executed in the child process of a stage: runs it and sends back its measures. ---
+
+def _measure_stage(function, inputs, root, workers, queue):
+
+    try:
+        start = time.time()
+        result = function(inputs, root, workers)
+        result.setdefault('seconds', time.time()-start)
+        result['peak_rss_mb'] = peak_rss()
+        queue.put(('ok', result))
+    except BaseException as e:
+        queue.put(('error', '{}: {}'.format(type(e).__name__, e)))
+
+
+# --- Function that runs a stage in its own process and computes its throughput. ---
+# :param function: function of the stage
+# :param inputs: dictionary of the paths of the inputs
+# :param root: folder of the inputs and of the outputs of the stages
+# :param workers: nr. of worker processes of the stages that support them
+# :return result: dictionary with the seconds, the peak memory, the amounts of work and the corr. throughputs (or the error)
+
+def measure(function, inputs, root, workers):
+
+    queue = multiprocessing.Queue()
+    child = multiprocessing.Process(target=_measure_stage, args=(function, inputs, root, workers, queue))
+    child.start()
+    while True:
+        try:
+            status, result = queue.get(timeout=1)
+            break
+        except queues.Empty:
+            if not child.is_alive():                # killed without reporting (e.g. out of memory)
+                status, result = 'error', 'the process of the stage exited with code {}'.format(child.exitcode)
+                break
+    child.join()
+    if status != 'ok':
+        return {'error': result}
+    seconds = max(result['seconds'], 1e-9)
+    for unit in ('sentences', 'annotations', 'rows', 'pairs'):
+        if unit in result:
+            result[unit+'_per_s'] = result[unit] / seconds
+    if 'bytes' in result:
+        result['mb_per_s'] = result['bytes'] / 2**20 / seconds
+    return result
+
+
+# --- Function that runs all the benchmarks. ---
+# :param root: folder of the inputs and of the outputs of the stages
+# :param config: dictionary with the sizes of the inputs, the seed and the nr. of workers
+# :param stages: names of the stages to run (None for all)
+# :param verbose: whether to print the results of each stage
+# :return results: dictionary with the configuration, the environment and the results of each stage
+
+def run_benchmarks(root, config, stages=None, verbose=True):
+
+    start = time.time()
+    inputs = generate_inputs(root, config)
+    if verbose:
+        print('Inputs generated in {:.1f}s: {} EuroSense and {} Sew annotations'.format(time.time()-start, inputs['eurosense_annotations'], inputs['sew_annotations']))
+    results = {
+        'config': config,
+        'environment': {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'stages': dict(),
+    }
+    for name, function in STAGES:
+        if stages is not None and name not in stages:
+            continue
+        result = measure(function, inputs, root, config['workers'])
+        results['stages'][name] = result
+        if verbose:
+            print(format_stage(name, result))
+    return results
+
+
+# --- Function that formats the result of a stage as a line of text. ---
+# :param name: name of the stage
+# :param result: dictionary of the results of the stage, see measure
+# :return line: the line
+
+def format_stage(name, result):
+
+    if 'error' in result:
+        return '{:<17} ERROR {}'.format(name, result['error'])
+    rates = ', '.join('{:.0f} {}/s'.format(result[unit+'_per_s'], unit) for unit in ('sentences', 'annotations', 'rows', 'pairs') if unit+'_per_s' in result)
+    if 'mb_per_s' in result:
+        rates += (', ' if rates else '') + '{:.1f} MB/s'.format(result['mb_per_s'])
+    return '{:<17} {:>8.2f}s  {:>7.0f} MB  {}'.format(name, result['seconds'], result['peak_rss_mb'], rates)
+
+
+# --- Function that compares the results of two runs. ---
+# :param results: dictionary of the results of the current run
+# :param baseline: dictionary of the results of a previous run
+# :param tolerance: relative slowdown above which a stage is reported as a regression
+# :return lines: list of lines of text, one per stage in both runs
+
+def compare(results, baseline, tolerance=0.1):
+
+    lines = []
+    for name, result in results['stages'].items():
+        old = baseline.get('stages', {}).get(name)
+        if old is None or 'error' in old or 'error' in result:
+            continue
+        ratio = result['seconds'] / max(old['seconds'], 1e-9)
+        flag = 'REGRESSION' if ratio > 1+tolerance else ('faster' if ratio < 1-tolerance else '')
+        lines.append('{:<17} {:>8.2f}s -> {:>8.2f}s  x{:.2f}  {}'.format(name, old['seconds'], result['seconds'], ratio, flag).rstrip())
+    return lines
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmarks the stages of the pipeline on synthetic corpora.')
+    parser.add_argument('--sentences', type=int, default=20000, help='nr. of EuroSense sentences')
+    parser.add_argument('--articles', type=int, default=2000, help='nr. of Sew articles')
+    parser.add_argument('--folders', type=int, default=8, help='nr. of Sew folders')
+    parser.add_argument('--words', type=int, default=20000, help='nr. of distinct content words')
+    parser.add_argument('--synsets', type=int, default=50000, help='nr. of BabelNet ids in the mapping')
+    parser.add_argument('--pairs', type=int, default=2000, help='nr. of word-similarity pairs')
+    parser.add_argument('--size', type=int, default=200, help='size of the embeddings')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes of the stages that support them')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='*', default=None, choices=[name for name, _ in STAGES], help='stages to run (all by default)')
+    parser.add_argument('--dir', default='../benchmark', help='folder of the generated inputs')
+    parser.add_argument('--out', default='benchmark.json', help='file where the results are saved')
+    parser.add_argument('--compare', default=None, help='results of a previous run to compare with')
+    args = parser.parse_args()
+
+    config = dict((name, getattr(args, name)) for name in ('sentences', 'articles', 'folders', 'words', 'synsets', 'pairs', 'size', 'workers', 'seed'))
+    results = run_benchmarks(args.dir, config, args.stages)
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print('Results saved in {}'.format(args.out))
+    if args.compare is not None:
+        with open(args.compare, encoding='utf-8') as f:
+            print('\n'.join(compare(results, json.load(f))))
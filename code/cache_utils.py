@@ -0,0 +1,160 @@
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+#   Content-addressed cache for the parsed EuroSense and Sew corpora.
+#
+# @author Giada Simionato <simionato.1822614@studenti.uniroma1.it>
+#
+# Every parsed shard (the whole EuroSense XML file or a single folder of the Sew dataset) is stored under a key computed from the path of its source,
+# its size and modification time (or the hash of its content) and the version of the BabelNet-WordNet mapping used to filter the annotations, so that
+# only the inputs that changed since the last run have to be parsed again.
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import os
+import json
+import hashlib
+import contextlib
+from store_utils import AnnotationStore, save_store
+
+CACHE_VERSION = 2   # to increment whenever the parsers change the format of their output
+
+_folder_signatures = None   # (folder, use_hash) -> its signature, kept only inside reuse_folder_signatures
+
+# --- Function that computes the hash of the content of a file. ---
+# :param path: path of the file
+# :return digest: hexadecimal sha1 digest of the file content
+
+def file_hash(path):
+
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):    # reads 1 MB at a time
+            h.update(block)
+    return h.hexdigest()
+
+
+# --- Function that computes the signature of a source file. ---
+# :param path: path of the file
+# :param use_hash: if True the content of the file is hashed, otherwise only its size and modification time are used
+# :return signature: list describing the file
+
+def file_signature(path, use_hash=False):
+
+    stat = os.stat(path)
+    if use_hash:
+        return [os.path.abspath(path), stat.st_size, file_hash(path)]
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+# --- Function that computes the signature of a folder as the signatures of all the files it contains. ---
+# Inside reuse_folder_signatures each folder is signed once, e.g. by the pipeline for the fingerprint of the parse stage and then by parse_sew.
+# :param path: path of the folder
+# :param use_hash: if True the content of the files is hashed, otherwise only their size and modification time are used
+# :return signature: list describing the folder
+
+def folder_signature(path, use_hash=False):
+
+    key = (os.path.abspath(path), use_hash)
+    if _folder_signatures is not None and key in _folder_signatures:
+        return _folder_signatures[key]
+    signature = [file_signature(os.path.join(path, name), use_hash) for name in sorted(os.listdir(path))]
+    if _folder_signatures is not None:
+        _folder_signatures[key] = signature
+    return signature
+
+
+# --- Context manager inside which the signature of each folder is computed once and then reused. ---
+# The folders must not change inside it: it is meant to span the fingerprint of a stage and its run (the child process of the stage inherits the
+# signatures already computed).
+
+@contextlib.contextmanager
+def reuse_folder_signatures():
+
+    global _folder_signatures
+    previous = _folder_signatures
+    if previous is None:
+        _folder_signatures = dict()
+    try:
+        yield
+    finally:
+        _folder_signatures = previous
+
+
+# --- Function that computes the version of a BabelNet-WordNet mapping. ---
+# :param bn2wn: a dictionary whose keys are the BabelNet ids and the values are the corr. WordNet ids
+# :return version: hexadecimal digest identifying the content of the mapping
+
+def mapping_version(bn2wn):
+
+    version = getattr(bn2wn, 'version', None)   # precomputed by the mappings that know their own version
+    if version is not None:
+        return version
+    h = hashlib.sha1()
+    for bn_id in sorted(bn2wn):
+        h.update((bn_id + '\t' + bn2wn[bn_id] + '\n').encode('utf-8'))
+    return h.hexdigest()
+
+
+# --- Function that builds the key of a cached shard. ---
+# :param kind: kind of shard (e.g. 'eurosense', 'sew')
+# :param signature: signature of the source of the shard
+# :param version: version of the BabelNet-WordNet mapping
+# :return key: hexadecimal digest of all the parameters
+
+def shard_key(kind, signature, version):
+
+    blob = json.dumps([CACHE_VERSION, kind, signature, version])
+    return kind + '-' + hashlib.sha1(blob.encode('utf-8')).hexdigest()
+
+
+# --- Class that stores the parsed shards in a folder, one columnar store (see store_utils.py) per key. ---
+
+class ParseCache(object):
+
+    def __init__(self, root):
+
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key):
+
+        return os.path.join(self.root, key)
+
+    def __contains__(self, key):
+
+        return os.path.exists(os.path.join(self.path(key), 'meta.json'))
+
+    # --- Method that loads a shard. ---
+    # :param key: key of the shard
+    # :return sentences, annotations: memory-mapped views of the shard
+
+    def load(self, key):
+
+        store = AnnotationStore(self.path(key))
+        return store.sentences, store.annotations
+
+    # --- Method that saves a shard (atomically, see save_store). ---
+    # :param key: key of the shard
+    # :param sentences: list of sentences of the shard
+    # :param annotations: list of the same length of sentences with the corr. annotations
+    # :param columns: list of (name, kind) describing the fields of each annotation
+
+    def save(self, key, sentences, annotations, columns):
+
+        save_store(self.path(key), sentences, annotations, columns)
+
+    # --- Method that returns a shard from the cache, parsing and storing it if it is missing. ---
+    # :param key: key of the shard
+    # :param parse: function without arguments returning (sentences, annotations)
+    # :param columns: list of (name, kind) describing the fields of each annotation
+    # :return sentences, annotations: memory-mapped views of the shard
+
+    def get_or_parse(self, key, parse, columns):
+
+        if key in self:
+            self.hits += 1
+        else:
+            self.misses += 1
+            sentences, annotations = parse()
+            self.save(key, sentences, annotations, columns)
+        return self.load(key)
@@ -0,0 +1,172 @@
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+#   Streaming training corpus.
+#
+# @author Giada Simionato <simionato.1822614@studenti.uniroma1.it>
+#
+# It provides the rows of the input tensors of the EuroSense and Sew datasets on demand, reading them from the columnar stores written by the parsing
+# step, so that the whole tensor is never kept in memory. The corpus can be iterated any number of times, as Gensim does once per epoch.
+# The rows can also be saved once as a memory-mapped matrix of token ids (save_rows) and streamed back by RowCorpus, without shaping them again.
+# The vocabulary of the training is counted in a single pass over that matrix and pruned of the rare context words (never of the senses), so that Gensim
+# does not scan the corpus again to build it.
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import os
+import json
+import math
+import array
+import shutil
+import numpy as np
+from store_utils import AnnotationStore
+from fix_inconsistencies import iter_fix_data
+from sew_utils import iterSewTensor
+
+# --- Function that opens a store given its folder, if needed. ---
+# :param store: folder of a columnar store, an opened AnnotationStore or None
+# :return store: the opened AnnotationStore or None
+
+def open_store(store):
+
+    if store is None or isinstance(store, AnnotationStore):
+        return store
+    return AnnotationStore(store)
+
+
+# --- Class that streams the rows of the input tensor of both datasets, first the EuroSense rows (see fix_data) then the Sew ones (see getSewTensor). ---
+
+class SenseCorpus(object):
+
+    def __init__(self, euroStore, sewStore, windowSize, chunkSize=4096, workers=1):
+
+        self.euroStore = open_store(euroStore)      # columnar store of the EuroSense dataset (None to skip it)
+        self.sewStore = open_store(sewStore)        # columnar store of the Sew dataset (None to skip it)
+        self.windowSize = windowSize
+        self.chunkSize = chunkSize
+        self.workers = workers                      # nr. of worker processes building the rows (the order of the rows is the same)
+
+    def __iter__(self):
+
+        if self.euroStore is not None:
+            yield from iter_fix_data(self.euroStore.sentences, self.euroStore.annotations, self.windowSize, self.chunkSize, self.workers)
+        if self.sewStore is not None:
+            yield from iterSewTensor(self.sewStore.sentences, self.sewStore.annotations, self.windowSize, workers=self.workers)
+
+
+# --- Function that saves the rows of an input tensor as a matrix of token ids. ---
+# The folder contains rows.bin (the int32 matrix, a row per annotation), tokens.txt (a token per line, the id is the line number) and meta.json.
+# :param rows: iterable of rows of the same length
+# :param path: folder where the matrix is saved
+# :param chunkSize: nr. of rows written at a time
+# :return n: nr. of rows saved
+
+def save_rows(rows, path, chunkSize=65536):
+
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    token2id = dict()
+    ids = array.array('i')
+    n = 0
+    width = None
+    with open(os.path.join(tmp, 'rows.bin'), 'wb') as f:
+        for row in rows:
+            if width is None:
+                width = len(row)
+            ids.extend([token2id.setdefault(token, len(token2id)) for token in row])
+            n += 1
+            if n % chunkSize == 0:
+                f.write(ids.tobytes())
+                ids = array.array('i')
+        f.write(ids.tobytes())
+    with open(os.path.join(tmp, 'tokens.txt'), 'w', encoding='utf-8') as f:
+        f.write(''.join(token + '\n' for token in token2id))
+    with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'rows': n, 'width': width or 0}, f)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+    return n
+
+
+# --- Class that streams the rows saved by save_rows, optionally cropped to a smaller window. ---
+
+class RowCorpus(object):
+
+    def __init__(self, path, windowSize=None, chunkSize=65536):
+
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(os.path.join(path, 'tokens.txt'), encoding='utf-8') as f:
+            self.tokens = np.array(f.read().splitlines(), dtype=object)    # id -> token
+        shape = (meta['rows'], meta['width'])
+        self.rows = np.memmap(os.path.join(path, 'rows.bin'), dtype=np.int32, mode='r', shape=shape) if meta['rows'] else np.zeros(shape, dtype=np.int32)
+        center = meta['width'] // 2
+        if windowSize is None:
+            windowSize = center
+        if windowSize > center:
+            raise ValueError('the rows were saved with a window of size {}'.format(center))
+        self.columns = slice(center-windowSize, center+windowSize+1)      # the sense in the middle of its cropped context
+        self.chunkSize = chunkSize
+
+    def __len__(self):
+
+        return len(self.rows)
+
+    def __iter__(self):
+
+        for start in range(0, len(self.rows), self.chunkSize):
+            yield from self.tokens[self.rows[start:start+self.chunkSize, self.columns]].tolist()
+
+    # --- Method that counts the occurrences of each token in the (cropped) rows, a chunk of ids at a time. ---
+    # :return counts: 1D integer array whose i-th element is the nr. of occurrences of the token with id i
+
+    def counts(self):
+
+        counts = np.zeros(len(self.tokens), dtype=np.int64)
+        for start in range(0, len(self.rows), self.chunkSize):
+            counts += np.bincount(self.rows[start:start+self.chunkSize, self.columns].ravel(), minlength=len(self.tokens))
+        return counts
+
+
+# --- Function that builds the vocabulary of the training from the counts of the tokens of a corpus. ---
+# The senses (the tokens containing a BabelNet id) are always kept, whatever their frequency.
+# :param corpus: RowCorpus
+# :param minCount: minimum nr. of occurrences of the words that are kept
+# :param threshold: the threshold for the relative frequences of the words under which the words are discarded (None for no threshold)
+# :return vocab: dictionary whose keys are the kept tokens and values are their nr. of occurrences, by decreasing frequency
+
+def build_vocabulary(corpus, minCount=1, threshold=None):
+
+    counts = corpus.counts()
+    limit = max(minCount, math.floor(threshold*counts.sum())+1 if threshold is not None else 0)  # freq/total > threshold <=> freq > threshold*total
+    vocab = dict()
+    for i in np.argsort(-counts, kind='stable').tolist():
+        token, n = corpus.tokens[i], int(counts[i])
+        if n > 0 and (n >= limit or '_bn:' in token):
+            vocab[token] = n
+    return vocab
+
+
+# --- Function that saves a vocabulary as a text file with a token and its nr. of occurrences per line, separated by a tab. ---
+# :param vocab: dictionary whose keys are the tokens and values are their nr. of occurrences
+# :param path: path of the file
+
+def save_vocabulary(vocab, path):
+
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(''.join('{}\t{}\n'.format(token, n) for token, n in vocab.items()))
+    os.replace(path + '.tmp', path)
+
+
+# --- Function that loads a vocabulary saved by save_vocabulary. ---
+# :param path: path of the file
+# :return vocab: dictionary whose keys are the tokens and values are their nr. of occurrences
+
+def load_vocabulary(path):
+
+    vocab = dict()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            token, n = line.rstrip('\n').rsplit('\t', 1)
+            vocab[token] = int(n)
+    return vocab
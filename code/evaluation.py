@@ -0,0 +1,212 @@
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+#   Evaluation of many models against many word-similarity benchmarks.
+#
+# @author Giada Simionato <simionato.1822614@studenti.uniroma1.it>
+#
+# The benchmark files (WordSim-353 combined.tab, SimLex-999, MEN, RG-65, ...) are read once and the senses of all their words are gathered once from
+# word2senses in a shared index. Every model is then scored against all the benchmarks at once: only the embeddings of the senses of the index are
+# normalized (or taken from the SenseIndex of the model, see sense_index.py) and the maximum cosine similarities of all the pairs are computed with
+# the batched products of score.py. The results are reported as a table with the Spearman and Pearson correlations and the coverage of each
+# benchmark, i.e. the share of the pairs whose words both have embedded senses.
+#
+# Usage: python evaluation.py model.vec [model2.vec ...] --benchmarks ../combined.tab ../simlex.txt [--euro euroStore] [--sew sewStore]
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import os
+import re
+import argparse
+import numpy as np
+from scipy.stats import spearmanr, pearsonr
+from score import lookup_index, max_cosines, found_pairs
+from sense_index import load_sense_index
+from store_utils import AnnotationStore
+from input_utils import get_map_senses
+from sew_utils import getSensesSew
+
+POS_SUFFIX = re.compile(r'-[a-z]$')     # part-of-speech suffix of the words of some benchmarks (e.g. 'sun-n' in MEN)
+
+# --- Function that reads the pairs of words of a benchmark file. ---
+# The fields can be separated by tabs, semicolons or spaces; the comments, the headers and the lines without a numeric score are skipped.
+# :param path: the path of the benchmark file
+# :return words1, words2: lists of the lower-case first and second words of each pair
+# :return gold: 1D array of the gold scores
+
+def read_benchmark(path):
+
+    words1, words2, gold = [], [], []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            parts = re.split(r'[\t;]', line.strip()) if re.search(r'[\t;]', line) else line.split()
+            if len(parts) < 3:
+                continue
+            try:
+                score = float(parts[2])
+            except ValueError:              # header
+                continue
+            words1.append(parts[0].strip().lower())
+            words2.append(parts[1].strip().lower())
+            gold.append(score)
+    words = words1 + words2
+    if words and all(POS_SUFFIX.search(w) for w in words):      # removes the part-of-speech suffixes, when all the words have one
+        words1 = [w[:-2] for w in words1]
+        words2 = [w[:-2] for w in words2]
+    return words1, words2, np.array(gold)
+
+
+# --- Class that holds many benchmarks and the index of the senses of their words. ---
+
+class Evaluation(object):
+
+    def __init__(self, paths, word2senses=None):
+
+        self.names = []                     # name of each benchmark
+        self.gold = []                      # gold scores of each benchmark
+        self.pairs = []                     # (rows of the first words, rows of the second words) of each benchmark in self.words
+        rowOf = dict()                      # word -> row in self.words
+        for path in paths:
+            words1, words2, gold = read_benchmark(path)
+            for w in words1 + words2:
+                rowOf.setdefault(w, len(rowOf))
+            self.names.append(os.path.splitext(os.path.basename(path))[0])
+            self.gold.append(gold)
+            self.pairs.append((np.array([rowOf[w] for w in words1], dtype=np.int64), np.array([rowOf[w] for w in words2], dtype=np.int64)))
+        self.words = list(rowOf)            # all the distinct words of the benchmarks
+        self.word2senses = word2senses
+        if word2senses is None:             # the senses are taken from the index of each model, see cosines
+            word2senses = dict()
+
+        self.senses = []                    # all the senses of the words (lemma_BabelNetId)
+        rows = []
+        for word in self.words:
+            first = len(self.senses)
+            self.senses.extend(word+'_'+bnId for bnId in word2senses.get(word, ()))
+            rows.append(range(first, len(self.senses)))
+        self.gather = np.full((len(self.words), max([len(r) for r in rows] + [1])), -1, dtype=np.int64)  # word -> padded indexes in self.senses
+        for i, r in enumerate(rows):
+            self.gather[i, :len(r)] = r
+
+    # --- Method that computes the maximum cosine similarities of the pairs of all the benchmarks for a model. ---
+    # :param luTable: the look-up table of the embeddings, the keys are the senses and the values are the corr. embeddings, or its SenseIndex
+    # :return cosines: list with the 1D array of the similarities of each benchmark, -1.0 for the pairs where a word has no embedded senses
+    # :return found: list with the 1D boolean array of each benchmark, True for the pairs whose words both have embedded senses
+
+    def cosines(self, luTable):
+
+        if hasattr(luTable, 'gather'):      # SenseIndex: the senses of each word are a slice of its normalized embeddings
+            vectors, local = luTable.vectors, luTable.gather(self.words)
+        else:
+            vectors, local = self.unit_vectors(luTable)
+        cosines = [max_cosines(vectors, local[rows1], local[rows2]) for rows1, rows2 in self.pairs]
+        found = [found_pairs(local[rows1], local[rows2]) for rows1, rows2 in self.pairs]
+        return cosines, found
+
+    # --- Method that normalizes the embeddings of the senses of the index of the benchmarks. ---
+    # :param luTable: the look-up table of the embeddings, the keys are the senses and the values are the corr. embeddings
+    # :return unit: 2D array of the normalized embeddings of the senses, one row per sense of self.senses plus a null one
+    # :return local: padded rows in unit of the embedded senses of each word of self.words, -1 for the senses without embeddings
+
+    def unit_vectors(self, luTable):
+
+        if self.word2senses is None:
+            raise ValueError('the senses of the words are unknown: build the Evaluation with word2senses, or score a SenseIndex or a path')
+        vectors, index = lookup_index(luTable)
+        found = np.array([index.get(sense, -1) for sense in self.senses] + [-1], dtype=np.int64)    # row of each sense in the model
+        unit = np.zeros((len(found), vectors.shape[1]))
+        present = found >= 0
+        unit[present] = vectors[found[present]]
+        norms = np.linalg.norm(unit, axis=1, keepdims=True)
+        unit = np.divide(unit, norms, out=np.zeros_like(unit), where=norms > 0)     # normalized once for all the benchmarks
+        local = np.where(self.gather >= 0, self.gather, len(found)-1)
+        local = np.where(present[local], local, -1)                                   # the senses without embeddings become padding
+        return unit, local
+
+    # --- Method that scores a model against all the benchmarks. ---
+    # :param luTable: the look-up table of the embeddings, the keys are the senses and the values are the corr. embeddings, or its SenseIndex (a
+    #                 look-up table needs the word2senses of the Evaluation)
+    # :param name: name of the model in the results
+    # :return results: list of dictionaries, one per benchmark, with the correlations and the coverage
+
+    def score(self, luTable, name='model'):
+
+        results = []
+        cosines, found = self.cosines(luTable)
+        for benchmark, gold, cosine, covered in zip(self.names, self.gold, cosines, found):
+            results.append({
+                'model': name,
+                'benchmark': benchmark,
+                'pairs': len(gold),
+                'covered': int(covered.sum()),
+                'coverage': 100*covered.mean() if len(gold) else float('nan'),
+                'spearman': correlation(spearmanr, gold, cosine),           # the missing pairs count as -1.0, as in score_model
+                'pearson': correlation(pearsonr, gold, cosine),
+                'spearman_covered': correlation(spearmanr, gold[covered], cosine[covered]),     # only over the covered pairs
+            })
+        return results
+
+    # --- Method that scores many models against all the benchmarks. ---
+    # :param models: dictionary whose keys are the names of the models and the values are their look-up tables, SenseIndex or the paths to load them from
+    # :return results: list of dictionaries, one per model and benchmark, see score
+
+    def score_all(self, models):
+
+        results = []
+        for name, model in models.items():
+            luTable = load_sense_index(model, self.word2senses) if isinstance(model, str) else model   # the index is built once per model
+            results.extend(self.score(luTable, name))
+        return results
+
+
+# --- Function that computes a correlation coefficient, nan when it is not defined. ---
+# :param function: spearmanr or pearsonr
+# :param x, y: 1D arrays
+# :return r: the correlation coefficient
+
+def correlation(function, x, y):
+
+    if len(x) < 2 or np.all(x == x[0]) or np.all(y == y[0]):
+        return float('nan')
+    return float(function(x, y)[0])
+
+
+# --- Function that formats the results of an evaluation as a text table. ---
+# :param results: list of dictionaries, see Evaluation.score
+# :return table: the table as a string
+
+def format_table(results):
+
+    header = ['model', 'benchmark', 'pairs', 'coverage', 'spearman', 'pearson', 'spearman_covered']
+    lines = [[str(r['model']), str(r['benchmark']), '{}/{}'.format(r['covered'], r['pairs']), '{:.1f}%'.format(r['coverage']),
+              '{:.4f}'.format(r['spearman']), '{:.4f}'.format(r['pearson']), '{:.4f}'.format(r['spearman_covered'])] for r in results]
+    widths = [max([len(h)] + [len(l[i]) for l in lines]) for i, h in enumerate(header)]
+    rows = [header, ['-'*w for w in widths]] + lines
+    return '\n'.join('  '.join(cell.ljust(w) for cell, w in zip(row, widths)).rstrip() for row in rows)
+
+
+# --- Function that builds the dictionary of the senses of the lemmas from the stores written by main.py. ---
+# :param euroStore: folder of the columnar store of the EuroSense dataset (None to skip it)
+# :param sewStore: folder of the columnar store of the Sew dataset (None to skip it)
+# :return word2senses: dictionary whose keys are the lemmas and the corr. values are lists containing all the BabelNet ids corr. to that lemma
+
+def load_senses(euroStore, sewStore):
+
+    word2senses = dict()
+    if euroStore is not None:
+        word2senses.update(get_map_senses(AnnotationStore(euroStore).annotations))
+    if sewStore is not None:
+        word2senses.update(getSensesSew(AnnotationStore(sewStore).annotations))
+    return word2senses
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Scores sense embeddings against word-similarity benchmarks.')
+    parser.add_argument('models', nargs='+', help='embeddings (.vec, .txt, .bin) or models saved by Gensim')
+    parser.add_argument('--benchmarks', nargs='+', default=['../combined.tab'], help='benchmark files')
+    parser.add_argument('--euro', default='euroStore', help='columnar store of the EuroSense dataset')
+    parser.add_argument('--sew', default='sewStore', help='columnar store of the Sew dataset')
+    args = parser.parse_args()
+
+    evaluation = Evaluation(args.benchmarks, load_senses(args.euro, args.sew))
+    print(format_table(evaluation.score_all(dict((path, path) for path in args.models))))
@@ -5,24 +5,100 @@
 #
 # It creates the stuctured-input tensors, as the one in input_utils.py but fixing all the inconsistencies of the dataset so as to augment the data provided. 
 # It also handles a higher number of constraints over the validation process of words.
+# The sentences are tokenized once into integer ids of a shared vocabulary, whose tokens are validated once, and the windows of all the annotations
+# are extracted together with array operations, chunk by chunk, optionally in a pool of worker processes. The word lists of the validation are
+# loaded lazily from a single prebuilt resource, rebuilt when the word lists it was built from change.
 # -----------------------------------------------------------------------------------------------------------------------------------------------------------
 
+import os
 import numpy as np
 import json
+import operator
+import itertools
+import collections
+import multiprocessing
+from cache_utils import file_signature
+import profiling
+from profiling import instrument, result_length
 
 punctuation = ['.', ',', ':', ';', '"', "'", '!', '$', '£', '%', '&', '/', '(', ')', '=', '?', '^', '-', '_', '|', '<', '>', '+', '-', '*']
 
-with open("./stopwords.json") as handle:        # imports stopword
-    stopwords = set(json.load(handle))
+VALIDITY_PATH = './validity.json'   # single prebuilt resource with all the word lists needed to validate the tokens
+VALIDITY_SOURCES = ('./stopwords.json', './long_stopwords.json', './1words.json', './2words.json')     # word lists the resource is built from
 
-with open("./long_stopwords.json") as handle:   # imports longer stopwords
-    long_stopwords = stopwords.union(set(json.load(handle)))
+_filter = None      # (invalid tokens, valid 1-char. words, valid 2-chars words), loaded at the first validation
+_verdicts = dict()  # token -> validity, each distinct token is validated once
 
-with open("./1words.json") as handle:           # imports the valid 1-char. words
-    word1 = json.load(handle)
 
-with open("./2words.json") as handle:           # imports the valid 2-chars words
-    word2 = json.load(handle)
+# --- Function that computes the signatures of the word lists the resource of the validity filter is built from. ---
+# :return signatures: list with the signature of each file (see cache_utils.file_signature), None if any of them is missing
+
+def validity_sources():
+
+    try:
+        return [file_signature(path) for path in VALIDITY_SOURCES]
+    except FileNotFoundError:
+        return None
+
+
+# --- Function that sets the folder of the word lists of the validity filter (and of its resource), e.g. for synthetic word lists. ---
+# It must be called before validating any token, as the verdicts already given are kept in the vocabulary.
+# :param folder: folder with the stopwords.json, long_stopwords.json, 1words.json and 2words.json files
+
+def set_word_lists(folder):
+
+    global VALIDITY_PATH, VALIDITY_SOURCES, _filter
+    VALIDITY_PATH = os.path.join(folder, 'validity.json')
+    VALIDITY_SOURCES = tuple(os.path.join(folder, name) for name in ('stopwords.json', 'long_stopwords.json', '1words.json', '2words.json'))
+    _filter = None
+    _verdicts.clear()
+
+
+# --- Function that builds the resource of the validity filter from the stopwords.json, long_stopwords.json, 1words.json and 2words.json files. ---
+# The signatures of the files are stored in the resource, so that it is rebuilt when they change (see validity_filter).
+# :param path: path of the resource to write
+# :return None: it writes the resource
+
+@instrument()
+def build_validity_resource(path=VALIDITY_PATH):
+
+    stopwordsPath, longStopwordsPath, word1Path, word2Path = VALIDITY_SOURCES
+    sources = validity_sources()                    # taken before reading, so that a file changed meanwhile triggers a new build
+    with open(stopwordsPath) as handle:             # imports stopword
+        stopwords = set(json.load(handle))
+    with open(longStopwordsPath) as handle:         # imports longer stopwords
+        long_stopwords = stopwords.union(set(json.load(handle)))
+    with open(word1Path) as handle:                 # imports the valid 1-char. words
+        word1 = json.load(handle)
+    with open(word2Path) as handle:                 # imports the valid 2-chars words
+        word2 = json.load(handle)
+    resource = {'invalid': sorted(long_stopwords.union(punctuation)), 'word1': sorted(word1), 'word2': sorted(word2), 'sources': sources}
+    tmp = path + '.' + str(os.getpid())            # written apart and renamed, as several worker processes may build it at once
+    with open(tmp, 'w') as handle:
+        json.dump(resource, handle)
+    os.replace(tmp, path)
+
+
+# --- Function that returns the validity filter, loading it the first time it is needed. ---
+# The resource is built if it is missing, or if the word lists it was built from changed (when they are not available the resource is used as it is).
+# :return invalid, word1, word2: the sets of the punctuation symbols and stopwords, of the valid 1-char. words and of the valid 2-chars words
+
+def validity_filter():
+
+    global _filter
+    if _filter is None:
+        sources = validity_sources()
+        try:
+            with open(VALIDITY_PATH) as handle:
+                resource = json.load(handle)
+        except FileNotFoundError:
+            resource = None
+        if resource is None or (sources is not None and resource.get('sources') != sources):
+            build_validity_resource(VALIDITY_PATH)
+            with open(VALIDITY_PATH) as handle:
+                resource = json.load(handle)
+        _filter = (frozenset(resource['invalid']), frozenset(resource['word1']), frozenset(resource['word2']))
+    return _filter
 
 
 # --- Function that verifies whether a string is valid or not. ---
@@ -31,21 +107,157 @@ with open("./2words.json") as handle:           # imports the valid 2-chars word
 
 def isValid(elem):
 
-    if elem in punctuation:
-        return False
-    if elem.isdigit():
-        return False
-    
-    if not elem:
-        return False
-    if elem in long_stopwords:
-        return False
-    if len(elem)==1 and elem not in word1:
-        return False
-    if len(elem)==2 and elem not in word2:
-        return False
-    
-    return True
+    verdict = _verdicts.get(elem)
+    if verdict is None:                 # first time the string is met
+        invalid, word1, word2 = validity_filter()
+        if not elem or elem in invalid or elem.isdigit():
+            verdict = False
+        elif len(elem)==1:
+            verdict = elem in word1
+        elif len(elem)==2:
+            verdict = elem in word2
+        else:
+            verdict = True
+        _verdicts[elem] = verdict
+    return verdict
+
+
+# --- Vocabulary of the tokens met while shaping the tensors: each token is mapped to an integer id and validated only the first time it is met. ---
+
+PAD = '<PAD>'
+token2id = {PAD: 0}                             # token -> id
+id2token = np.array([PAD]*1024, dtype=object)   # id -> token (grown as needed)
+_validity = np.zeros(1024, dtype=bool)          # id -> whether the token is valid (the padding is never a valid context element)
+
+
+# --- Function that converts a list of tokens into their ids, adding the new ones to the vocabulary. ---
+# :param tokens: list of strings
+# :return ids: 1D integer array of the ids of the tokens
+
+def token_ids(tokens):
+
+    global id2token, _validity
+    ids = list(map(token2id.get, tokens))
+    if None in ids:                             # there are tokens never met before
+        new = set(itertools.compress(tokens, map(operator.is_, ids, itertools.repeat(None))))
+        size = len(token2id) + len(new)
+        if size > len(_validity):               # grows the arrays of the vocabulary
+            capacity = max(size, 2*len(_validity))
+            id2token = np.concatenate([id2token, np.full(capacity-len(id2token), PAD, dtype=object)])
+            _validity = np.concatenate([_validity, np.zeros(capacity-len(_validity), dtype=bool)])
+        for token in sorted(new):               # sorted so that the ids do not depend on the hashing of the strings
+            i = len(token2id)
+            token2id[token] = i
+            id2token[i] = token
+            _validity[i] = isValid(token)       # the validity of each token is stored in the vocabulary
+        ids = list(map(token2id.__getitem__, tokens))
+    return np.array(ids, dtype=np.int64)
+
+
+# --- Function that returns the validity mask of tokenized text. ---
+# :param ids: 1D integer array of token ids
+# :return mask: 1D boolean array, True where the token is a valid context element
+
+def validity_mask(ids):
+
+    return _validity[ids]
+
+
+# --- Function that extracts at once the context windows of many annotations. ---
+# The tokens of many sentences can be concatenated in the same array, each annotation then takes its context only from the tokens of its sentence.
+# :param ids: 1D integer array of the token ids
+# :param mask: 1D boolean array of the validity of the tokens
+# :param starts: 1D integer array with the index of the first token of each annotation
+# :param ends: 1D integer array with the index following the last token of each annotation
+# :param windowSize: nr. of valid elements to take before and after each annotation
+# :param lows: 1D integer array with the index of the first token of the sentence of each annotation (None if all the tokens are one sentence)
+# :param highs: 1D integer array with the index following the last token of the sentence of each annotation
+# :return windows: 2D integer array of shape (nr. of annotations, 2*windowSize) with the ids of the windowSize valid tokens before and the
+#                  windowSize valid tokens after each annotation, padded with the id of the padding element where the sentence is too short
+
+def get_windows(ids, mask, starts, ends, windowSize, lows=None, highs=None):
+
+    valid = np.flatnonzero(mask)                                            # positions of the valid tokens
+    padding = np.full(windowSize, -1)
+    padded = np.concatenate([padding, valid, padding])                      # valid positions surrounded by windowSize out-of-bound markers
+    steps = np.arange(windowSize)
+    before = padded[np.searchsorted(valid, starts)[:, None] + steps]                # the windowSize valid positions preceding each start
+    after = padded[windowSize + np.searchsorted(valid, ends)[:, None] + steps]      # the windowSize valid positions from each end on
+    if lows is not None:
+        before[before < lows[:, None]] = -1                                 # positions of the previous sentences become padding
+        after[after >= highs[:, None]] = -1                                 # positions of the next sentences become padding
+    positions = np.concatenate([before, after], axis=1)
+    return np.where(positions >= 0, ids[positions], token2id[PAD])
+
+
+# --- Function that finds the first occurrence of an anchor in a tokenized sentence. ---
+# :param tokens: list of the tokens of the sentence
+# :param anchor: list of the tokens of the anchor
+# :return index: index of the first token of the anchor, -1 if the anchor is not in the sentence
+
+def find_anchor(tokens, anchor):
+
+    n = len(anchor)
+    index = -1
+    while n:
+        try:
+            index = tokens.index(anchor[0], index+1)
+        except ValueError:
+            break
+        if n == 1 or tokens[index:index+n] == anchor:
+            return index
+    return -1
+
+
+# --- Function that builds the rows of all the annotations of many sentences. ---
+# Each sentence is tokenized and validated once and all the windows are extracted in one step.
+# :param sentences: list of lower-case sentences
+# :param annotations: list of the same length of sentences with the lists of (anchor, lemma, id_synset) of the sentences
+# :param windowSize: int representing the window-size
+# :return rows: list of the rows of the valid annotations (whose anchors are single words of their sentences), in order, see fix_row
+
+@instrument(result_length)
+def fix_sentences(sentences, annotations, windowSize):
+
+    tokens = []                                 # tokens of all the sentences
+    found = []                                  # (sense, start, end, start of the sentence, end of the sentence) of each valid annotation
+    for sentence, annotation in zip(sentences, annotations):
+        parts = None
+        for a in annotation:                    # a = (anchor, lemma, id_synset)
+            anchor = a[0].lower()               # gets lower-case anchor (first source of inconsistence (S.O.I.) solved)
+            if ' '+anchor+' ' not in sentence:  # if the annotation is not valid
+                continue
+            if parts is None:
+                parts = sentence.split()        # gets the parts of the sentence, once
+                low = len(tokens)
+                high = low+len(parts)
+                tokens.extend(parts)
+            anchor = anchor.split()
+            index = find_anchor(parts, anchor)
+            if index >= 0:
+                lemma = a[1].lower().replace(' ', '_')  # gets lemma parts divided by '_' instead of spaces (second S.O.I. solved)
+                found.append((lemma+'_'+a[2], low+index, low+index+len(anchor), low, high))
+    return build_rows(tokens, found, windowSize)
+
+
+# --- Function that builds the rows of many annotations from the tokens of their sentences. ---
+# :param tokens: list of the tokens of all the sentences, concatenated
+# :param found: list of (sense, start, end, start of the sentence, end of the sentence) of each annotation, as indexes in tokens
+# :param windowSize: int representing the window-size
+# :return rows: list of the rows, each the sense surrounded by the windowSize valid tokens before and after the annotation, eventually padded
+
+def build_rows(tokens, found, windowSize):
+
+    if not found:
+        return []
+    centers, starts, ends, lows, highs = zip(*found)
+    ids = token_ids(tokens)
+    windows = get_windows(ids, validity_mask(ids), np.array(starts), np.array(ends), windowSize, np.array(lows), np.array(highs))
+    rows = np.empty((len(found), 2*windowSize+1), dtype=object)
+    rows[:, :windowSize] = id2token[windows[:, :windowSize]]
+    rows[:, windowSize] = centers               # the sense in the middle of its context
+    rows[:, windowSize+1:] = id2token[windows[:, windowSize:]]
+    return rows.tolist()
 
 
 # --- Function that builds a row for the input tensor. ---
@@ -56,62 +268,95 @@ def isValid(elem):
 
 def fix_row(sentence, a, windowSize):
 
-    anchor = a[0].lower()               # gets lower-case anchor (first source of inconsistence (S.O.I.) solved)
-    lemma = a[1].lower()                # gets lower-case lemma
-    lemma = lemma.replace(' ', '_')     # gets lemma parts divided by '_' instead of spaces (second S.O.I. solved)
-    lemma_synset = lemma+'_'+a[2]
-    sentence = sentence.replace(anchor, lemma_synset)
-    parts = sentence.split()            # gets the parts of the sentences
-    index = parts.index(lemma_synset)   # gets the index of the sense in the list
-    row = [lemma_synset]                # initializes the row with the center
-    valid = 0
-    pos = 0
-    while valid < windowSize:           # for windowSize valid elements
-        i = index-(pos+1)               # gets element before it
-        if i<0:                         # if outside of the bound pad 
-            row.insert(0, '<PAD>')
-            valid += 1
-        else:
-            elem = parts[i]
-            if isValid(elem):
-                row.insert(0, elem)     # otherwise fill the list only if valid
-                valid += 1
-        pos +=1
-    valid = 0
-    pos = 0
-    while valid < windowSize:           # same for the 'after' part
-        i = index+(pos+1)
-        if i>=len(parts):
-            row.append('<PAD>')
-            valid += 1
-        else:
-            elem = parts[i]
-            if isValid(elem):
-                row.append(elem)
-                valid += 1
-        pos +=1
-
-    return row
+    rows = fix_sentences([sentence], [[a]], windowSize)
+    if not rows:
+        raise ValueError('anchor not in sentence')
+    return rows[0]
 
 
 # --- Function that creates the input tensor in the same structured-way of input_utils.py. ---
 # :param sentences: 1D numpy array whose elements are the English sentences in the dataset
 # :param annotations: 3D numpy array whose rows are arrays of length as nr. of annots for that sentence whose elems in turn are 3-vectors (anchor, lemma, id_synset)
 # :param window_size: window size for the context
+# :param chunkSize: nr. of sentences whose windows are extracted together
+# :param workers: nr. of worker processes building the chunks in parallel (1 builds them in the current process)
 # :return inTensor: 2D numpy array whose row number is the conistent annotations one and the number of col. are 2*window_size + 1 (with all solvable S.O.I.s solved)
 
-def fix_data(sentences, annotations, windowSize):
+def fix_data(sentences, annotations, windowSize, chunkSize=4096, workers=1):
+
+    return list(iter_fix_data(sentences, annotations, windowSize, chunkSize, workers))
 
-    inTensor = []                                   # contains the whole structure
+
+# --- Function that splits the annotated sentences of a dataset in chunks. ---
+# :param sentences: sequence of the sentences of the dataset
+# :param annotations: sequence of the same length of sentences with the corr. annotations
+# :param chunkSize: nr. of annotated sentences of each chunk
+# :param lower: whether to lower-case the sentences
+# :return generator of the chunks, each a tuple (sentences, annotations) of lists skipping the sentences without annotations
+
+def iter_chunks(sentences, annotations, chunkSize, lower=True):
+
+    chunkSentences = []
+    chunkAnnotations = []
     for i, annotation in enumerate(annotations):
-        if annotation != []:
-            sentence = sentences[i].lower()         # gets the lower-case version of the sentence (solved S.O.I.)
-            for a in annotation:                    # a = (anchor, lemma, id_synset)
-                anchor = a[0].lower()
-                if ' '+anchor+' ' in sentence:      # if the annotation is valid
-                    row = fix_row(sentence, a, windowSize)  # gets the row
-                    inTensor.append(row)            # updates the structure
-    return inTensor
+        if len(annotation) != 0:
+            sentence = sentences[i]
+            chunkSentences.append(sentence.lower() if lower else sentence)  # gets the lower-case version of the sentence (solved S.O.I.)
+            chunkAnnotations.append(annotation)
+            if len(chunkSentences) == chunkSize:
+                yield chunkSentences, chunkAnnotations
+                chunkSentences = []
+                chunkAnnotations = []
+    if chunkSentences:
+        yield chunkSentences, chunkAnnotations
+
+
+# --- Function that applies a function to a sequence of chunks in a pool of worker processes, returning the results in the order of the chunks. ---
+# At most 2 chunks per worker are pending at any time, so that the chunks are read from the input only as fast as they are processed.
+# :param function: function of a module-level name taking a chunk and returning its result
+# :param chunks: iterable of the chunks
+# :param workers: nr. of worker processes (1 applies the function in the current process)
+# :return generator of the results, in the same order of the chunks
+
+def map_chunks(function, chunks, workers=1):
+
+    if workers <= 1:
+        yield from map(function, chunks)
+        return
+    pool = multiprocessing.Pool(workers, initializer=profiling.init_worker)
+    pending = collections.deque()
+    try:
+        for chunk in chunks:
+            pending.append(pool.apply_async(profiling.collected, (function, chunk)))   # the instrumentation of the workers is sent back
+            if len(pending) >= 2*workers:
+                yield profiling.merge(pending.popleft().get())
+        while pending:
+            yield profiling.merge(pending.popleft().get())
+    finally:
+        pool.terminate()    # the results have all been collected, or the consumer stopped early
+        pool.join()
+
+
+# --- Function executed by the worker processes: builds the rows of a chunk of sentences. ---
+# :param job: tuple (sentences, annotations, windowSize), see fix_sentences
+# :return rows: list of the rows of the chunk
+
+def _fix_chunk_job(job):
+
+    return fix_sentences(*job)
+
+
+# --- Function that generates the rows of the input tensor of fix_data one at a time, without keeping them in memory. ---
+# :param sentences: 1D numpy array whose elements are the English sentences in the dataset
+# :param annotations: 3D numpy array whose rows are arrays of length as nr. of annots for that sentence whose elems in turn are 3-vectors (anchor, lemma, id_synset)
+# :param window_size: window size for the context
+# :param chunkSize: nr. of sentences whose windows are extracted together
+# :param workers: nr. of worker processes building the chunks in parallel (1 builds them in the current process), the order of the rows is the same
+# :return generator of the rows, each a list of length 2*window_size + 1
 
-        
+@instrument()
+def iter_fix_data(sentences, annotations, windowSize, chunkSize=4096, workers=1):
 
+    jobs = ((s, a, windowSize) for s, a in iter_chunks(sentences, annotations, chunkSize))
+    for rows in map_chunks(_fix_chunk_job, jobs, workers):
+        yield from rows
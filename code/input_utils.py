@@ -7,6 +7,9 @@
 # It provides a dictionary so as to retrieve all the senses attached to a certain lemma.
 # -----------------------------------------------------------------------------------------------------------------------------------------------------------
 
+from store_utils import AnnotationView
+from profiling import instrument, result_length
+
 punctuation = ['.', ',', ':', ';', '"', "'", '!', '$', '£', '%', '&', '/', '(', ')', '=', '?', '^', '-', '_', '|', '<', '>', '+', '-', '*']
 
 # --- Function that returns the row for the input of the model. ---
@@ -53,6 +56,7 @@ def get_partials(sentence, a, window_size):
 # :param window_size: window size for the context
 # :return tensor: 2D numpy array whose row number is the conistent annotations one and the number of col. are 2*window_size + 1
 
+@instrument(result_length)
 def get_tensor(sentences, annotations, window_size): 
 
     tensor = []     # input tensor
@@ -67,12 +71,18 @@ def get_tensor(sentences, annotations, window_size):
 
 
 # --- Function that builds a dictionary whose keys are the lemmas and the values are lists of corresponding BabelNet ids. ---
-# :param annotations: 3D numpy array whose rows are arrays of length as nr. of annots for that sentence whose elems in turn are 3-vectors (anchor, lemma, id_synset)
+# :param annotations: 3D numpy array (or view of a columnar store) whose rows are arrays of length as nr. of annots for that sentence whose elems in turn are 3-vectors (anchor, lemma, id_synset)
 # :return d: dictionary whose keys are the lemmas and the values are lists of corresponding BabelNet ids
 
+@instrument(result_length)
 def get_map_senses(annotations):
 
     d = dict()
+    if isinstance(annotations, AnnotationView):     # columnar store: only the distinct (lemma, id) pairs are decoded
+        store = annotations.store
+        for lemmaId, bnId in store.unique_pairs('lemma', 'bn').tolist():
+            d.setdefault(store.string(lemmaId), []).append(store.string(bnId))
+        return d
     for annotation in annotations:
         for a in annotation:                        # a = (anchor,lemma,id_synset)
             lemma = a[1]                            # gets the lemma
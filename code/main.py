@@ -3,73 +3,220 @@
 #
 # @author Giada Simionato <simionato.1822614@studenti.uniroma1.it>
 #
+# The process is split in the stages of a checkpointed pipeline (see pipeline.py): parse, analyze, senses, shape, vocab, train, export, score. Each stage is
+# skipped when its inputs and parameters did not change since its last run, e.g. changing EPOCHS re-runs only train, export and score.
+# A machine-readable summary of the run (wall time and peak memory of each stage and, with --profile, the statistics of the instrumented functions and
+# the most expensive functions of the cProfile dump of each stage that ran) is saved in summary.json in the folder of the pipeline.
+# Usage: python main.py [--from-stage STAGE] [--only-stage STAGE] [--force] [--profile [--trace-memory]]
 # -----------------------------------------------------------------------------------------------------------------------------------------------------------
 
 import numpy as np
+import gensim
 from gensim.models import Word2Vec
 from gensim.models import KeyedVectors
-from utils import collect_bn2wn, trim_xml, filter_embedding
-from sew_utils import parse_sew, getSewTensor, getSensesSew
+from utils import load_bn2wn, parse_eurosense, save_senses, save_senses_npy
+from store_utils import AnnotationStore
+from cache_utils import ParseCache
+from sew_utils import parse_sew, getSensesSew
 from input_utils import get_tensor, get_map_senses
 from analysis_inconsistencies import inconsistency_analysis
-from fix_inconsistencies import fix_data
+from corpus import SenseCorpus, RowCorpus, save_rows, build_vocabulary, save_vocabulary, load_vocabulary
 from score import score_model
+from sense_cbow import SenseCBOW
+from sense_index import SenseIndex, load_sense_index, index_path
+from pipeline import Stage, Pipeline, parse_options, format_report
+from profiling import write_summary
 from remove_limits import getNotBoundedInput
 
 # Hyperparameters
 
+MODE = 'cbow'            # 'cbow' trains all the words and senses, 'senses' trains only the sense embeddings (see fit)
 WINDOW_SIZE = 4
 EMBEDDING_SIZE = 200
 NEGATIVE_SAMPLING = 15
 EPOCHS = 5
+MIN_COUNT = 3           # context words occurring fewer times are not trained (the senses are always kept)
+VOCAB_THRESHOLD = None  # relative frequency under which the context words are not trained, None for no threshold
+
+GENSIM_4 = int(gensim.__version__.split('.')[0]) >= 4    # Gensim 4 renamed size and iter of Word2Vec to vector_size and epochs
+
+# Parallelism
+
+SEW_WORKERS = 4        # processes used to parse the Sew dataset
+TENSOR_WORKERS = 4     # processes used to build the rows of the input tensor
+
+# Analysis
+
+ANALYSIS_SAMPLE = None  # fraction or nr. of sentences for a quick sampled analysis with confidence intervals, None for the whole corpus
+ANALYSIS_SEED = 0
 
 # Paths
 
 path_mapping = '../resources/bn2wn_mapping.txt'
 path_savings = '../resources/embeddings.vec'
+path_matrix = '../resources/embeddings.npy'
 path_xml = '../EuroSense/eurosense.v1.0.high-precision.xml'
 path_scoreData = '../combined.tab'
 path_sew = '../sew_conservative'
+path_cache = '../cache'
+path_euroStore = 'euroStore'
+path_sewStore = 'sewStore'
+path_pipeline = '../pipeline'
+path_rows = '../pipeline/rows'
+path_vocab = '../pipeline/vocab.tsv'
+path_model = '../pipeline/word2vec.model'
+path_vectors = '../pipeline/vectors.kv'
+path_summary = '../pipeline/summary.json'
+
+
+# --- Function of the parse stage: parses the EuroSense and Sew datasets into their columnar stores. ---
+# :param inputs: artifacts of the previous stages (none)
+# :param params: parameters of the stage (none)
+# :return artifacts: paths of the stores
+
+def parse(inputs, params):
+
+    dict_bn2wn = load_bn2wn(path_mapping)                       # memory-mapped mapping whose keys are the BabelNet ids and values are the WordNet ones
+    cache = ParseCache(path_cache)                              # parsed shards, reused while their sources and the mapping do not change
+    parse_eurosense(path_xml, dict_bn2wn, cache, out=path_euroStore)                                    # parses the EuroSense dataset
+    parse_sew(path_sew, dict_bn2wn, workers=SEW_WORKERS, cache=cache, out=path_sewStore)                # parses the Sew dataset
+    return {'euroStore': path_euroStore, 'sewStore': path_sewStore}
+
+
+# --- Function of the analyze stage: analyses the inconsistencies of the EuroSense dataset. ---
+# :param inputs: artifacts of the parse stage
+# :param params: sample and seed of the analysis
+# :return artifacts: the report of the analysis, as a dictionary
+
+def analyze(inputs, params):
+
+    euro = AnnotationStore(inputs['euroStore'])
+    report = inconsistency_analysis(euro.sentences, euro.annotations, load_bn2wn(path_mapping), sample=params['sample'], seed=params['seed'])
+    return {'analysis': report.as_dict()}
+
+
+# --- Function of the senses stage: collects the BabelNet ids of each lemma. ---
+# :param inputs: artifacts of the parse stage
+# :param params: parameters of the stage (none)
+# :return artifacts: the dictionary of the senses of the lemmas
+
+def senses(inputs, params):
+
+    word2senses = get_map_senses(AnnotationStore(inputs['euroStore']).annotations)     # dictionary where the keys are the lemmas of the EuroSense dataset and the values are the lists of BabelNet ids
+    word2sensesSew = getSensesSew(AnnotationStore(inputs['sewStore']).annotations)     # dictionary where the keys are the lemmas of the Sew dataset and the values are the lists of BabelNet ids
+    word2senses.update(word2sensesSew)                          # creates a common dictionary
+    return {'word2senses': word2senses}
+
+
+# --- Function of the shape stage: builds the rows of the input tensor once and saves them as a memory-mapped matrix. ---
+# :param inputs: artifacts of the parse stage
+# :param params: window size
+# :return artifacts: path of the rows and their number
+
+def shape(inputs, params):
+
+    in_tensor = SenseCorpus(inputs['euroStore'], inputs['sewStore'], params['window'], workers=TENSOR_WORKERS)  # rows of the common input tensor (EuroSense then Sew)
+    return {'rows': path_rows, 'nRows': save_rows(in_tensor, path_rows)}
+
+
+# --- Function of the vocab stage: counts the tokens of the rows in one pass and prunes the rare context words. ---
+# :param inputs: artifacts of the shape stage
+# :param params: minimum count and relative frequency threshold of the words
+# :return artifacts: path of the vocabulary and its size
+
+def vocab(inputs, params):
+
+    vocabulary = build_vocabulary(RowCorpus(inputs['rows']), params['min_count'], params['threshold'])
+    save_vocabulary(vocabulary, path_vocab)
+    return {'vocab': path_vocab, 'vocabSize': len(vocabulary)}
+
+
+# --- Function that trains a model on the rows of the input tensor. ---
+# In the 'cbow' mode all the words and senses are trained by a CBOW (or skip-gram) Gensim model. In the 'senses' mode only the senses are predicted, from
+# the mean of their context words (see sense_cbow.py): a single prediction per row instead of one per token and no vectors for the words as outputs
+# nor for the senses as inputs, which would be discarded anyway.
+# :param rows: folder of the rows saved by save_rows, cropped to the window of the model
+# :param vocabulary: dictionary whose keys are the tokens to train and values are their nr. of occurrences
+# :param params: hyperparameters of the model: mode, size, window, negative, epochs and optionally sg (1 for skip-gram, CBOW by default)
+# :param workers: nr. of threads of the training (of the Gensim model only)
+# :return model: the trained model
+# :return luTable: its look-up table of the embeddings
+
+def fit(rows, vocabulary, params, workers=4):
+
+    if params['mode'] == 'senses':
+        model = SenseCBOW.for_vocabulary(vocabulary, params['size'], params['negative'])
+        model.train(RowCorpus(rows, params['window']), params['epochs'])
+        return model, model.sense_vectors()
+    in_tensor = RowCorpus(rows, params['window'])               # streams the rows at every epoch
+    if GENSIM_4:
+        sizes = {'vector_size': params['size'], 'epochs': params['epochs']}
+    else:                                                       # names of Gensim 3
+        sizes = {'size': params['size'], 'iter': params['epochs']}
+    model = Word2Vec(sg=params.get('sg', 0), window=params['window'], negative=params['negative'], min_count=1, workers=workers, **sizes)  # CBOW (or skip-gram) Gensim model
+    model.build_vocab_from_freq(vocabulary, corpus_count=len(in_tensor))   # the pruned vocabulary, without scanning the rows
+    model.train(in_tensor, total_examples=len(in_tensor), epochs=params['epochs'])
+    return model, model.wv
+
+
+# --- Function of the train stage: trains the model on the rows of the input tensor (see fit). ---
+# :param inputs: artifacts of the shape and vocab stages
+# :param params: hyperparameters of the model
+# :return artifacts: paths of the model and of its look-up table
+
+def train(inputs, params):
+
+    model, luTable = fit(inputs['rows'], load_vocabulary(inputs['vocab']), params)
+    model.save(path_model)
+    luTable.save(path_vectors)
+    return {'model': path_model, 'vectors': path_vectors}
+
+
+# --- Function of the export stage: saves the sense embeddings and their index. ---
+# :param inputs: artifacts of the train and senses stages
+# :param params: parameters of the stage (none)
+# :return artifacts: paths of the embeddings and of the index of their senses
+
+def export(inputs, params):
+
+    luTable = KeyedVectors.load(inputs['vectors'])
+    save_senses(luTable, path_savings)                          # saves only the sense embeddings in the required format
+    save_senses_npy(luTable, path_matrix)                       # and as a memory-mappable matrix for the fast loading of the other scripts
+    load_sense_index(path_savings, inputs['word2senses'], luTable)     # index of the senses of each lemma, saved next to the embeddings
+    return {'embeddings': path_savings, 'matrix': path_matrix, 'index': index_path(path_savings)}
+
+
+# --- Function of the score stage: computes the Spearman score of the model. ---
+# :param inputs: artifacts of the export stage
+# :param params: parameters of the stage (none)
+# :return artifacts: the score
+
+def score(inputs, params):
+
+    index = SenseIndex.load(inputs['index'])                    # the senses of each lemma are slices of the index
+    result = score_model(path_scoreData, index, None)           # computes the score
+    print('SCORE: ', result)
+    return {'score': result}
+
+
+STAGES = [
+    Stage('parse', parse, files=[path_mapping, path_xml, path_sew]),
+    Stage('analyze', analyze, after=['parse'], params={'sample': ANALYSIS_SAMPLE, 'seed': ANALYSIS_SEED}, files=[path_mapping]),
+    Stage('senses', senses, after=['parse']),
+    Stage('shape', shape, after=['parse'], params={'window': WINDOW_SIZE}),
+    Stage('vocab', vocab, after=['shape'], params={'min_count': MIN_COUNT, 'threshold': VOCAB_THRESHOLD}),
+    Stage('train', train, after=['shape', 'vocab'], params={'mode': MODE, 'size': EMBEDDING_SIZE, 'window': WINDOW_SIZE, 'negative': NEGATIVE_SAMPLING, 'epochs': EPOCHS}),
+    Stage('export', export, after=['train', 'senses']),
+    Stage('score', score, after=['export'], files=[path_scoreData]),
+]
+
+
+if __name__ == '__main__':
 
-print('Starting process...')
-dict_bn2wn = collect_bn2wn(path_mapping)                    # dictionary whose keys are the BabelNet ids and values are the WordNet ones
-
-print('Parsing EuroSense and Sew datasets...')
-sentences, annotations = trim_xml(path_xml, dict_bn2wn)     # parses the EuroSense dataset
-sentences = np.load('sentences.npy')
-annotations = np.load('annotations.npy')
-parse_sew(path_sew, dict_bn2wn)                             # parses the Sew dataset
-sewSentences = np.load('sewSentences.npy')
-sewAnnotations = np.load('sewAnnotations.npy')
-print('Done')
-
-print('Starting analysis of inconsistencies..')
-inconsistency_analysis(sentences, annotations, dict_bn2wn)  # does the analysis of the inconsistencies
-print('Done')
-
-print('Collecting senses...')
-word2senses = get_map_senses(annotations)                   # dictionary where the keys are the lemmas of the EuroSense dataset and the values are the lists of BabelNet ids
-word2sensesSew = getSensesSew(sewAnnotations)               # dictionary where the keys are the lemmas of the Sew dataset and the values are the lists of BabelNet ids 
-word2senses.update(word2sensesSew)                          # creates a common dictionary
-print('Done')
-
-print('Shaping tensors...')
-in_tensor = fix_data(sentences, annotations, WINDOW_SIZE)            # creates the input tensor with EuroSense data
-sewTensor = getSewTensor(sewSentences, sewAnnotations, WINDOW_SIZE)  # creates the input tensor with Sew data
-in_tensor.extend(sewTensor)                                          # creates the common input tensor
-print('Done')
-
-print('Start training...')
-model = Word2Vec(sentences=in_tensor, sg=0, size=EMBEDDING_SIZE, window=WINDOW_SIZE, min_count=1, workers=4, iter=EPOCHS)  # CBOW Gensim model
-print('Done')
-
-print('Start scoring...')
-vw_table = model.wv
-score = score_model(path_scoreData, vw_table, word2senses)  # computes the score
-print('Done')
-print('SCORE: ', score)
-
-print('Saving model...')
-model.wv.save_word2vec_format(path_savings)                 # saves the embeddings in the required format
-filter_embedding(path_savings)                              # removes all the word embeddings 
-print('Done process.')
\ No newline at end of file
+    print('Starting process...')
+    pipeline = Pipeline(STAGES, path_pipeline)
+    report = pipeline.run(**parse_options([stage.name for stage in STAGES]))
+    print(format_report(report))
+    write_summary(path_summary, report, pipeline.profiles)
+    print('Summary saved in {}'.format(path_summary))
+    print('Done process.')
@@ -18,42 +18,44 @@ from matplotlib import pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D 
 from sew_utils import getSensesSew
 from sklearn.preprocessing import StandardScaler
-
-def get_senses(word, luTable, word2senses):
-    emb_Set = []
+from store_utils import AnnotationStore
+from sense_index import load_sense_index
+from sense_search import load_search
+
+# --- Function that retrieves the embeddings of the senses of a lemma and their names. ---
+# :param word: lemma
+# :param index: SenseIndex of the model (see sense_index.py), built with word2senses
+# :param word2senses: dictionary whose keys are the lemmas and the corr. values are lists containing all the BabelNet ids corr. to that lemma
+# :return embeddings, names: 2D array of the normalized embeddings of the senses of the lemma (zeros for the senses without an embedding) and 1D array
+#                            of the corr. senses ('empty' for the senses without an embedding)
+
+def get_senses(word, index, word2senses):
     if word in word2senses:
-        senses = word2senses[word]      # gets the list of all BabelNet ids of the lemma
-        lemma_syns = []
-        for sense in senses:
-            lemma_syn = word+'_'+sense  # builds the sense       
-            if lemma_syn in luTable:    # if there is an embedding of this sense retrieve it
-                emb_Set.append(luTable[lemma_syn])
-                lemma_syns.append(lemma_syn)
-            else:
-                emb_Set.append(np.zeros((1, 200)))
-                lemma_syns.append('empty')
-        assert len(emb_Set) == len(lemma_syns)
-        return np.asarray(emb_Set), np.asarray(lemma_syns)     # converts the list as array
+        start, end = index.rows(word)       # the embedded senses of the lemma are a slice of the index
+        missing = len(word2senses[word]) - (end-start)
+        rows = np.concatenate([np.arange(start, end), np.full(missing, -1)])   # -1 for the senses without an embedding
+        embeddings = np.zeros((len(rows), index.vectors.shape[1]))
+        embeddings[rows >= 0] = index.vectors[start:end]
+        return embeddings, np.asarray(index.senses[start:end] + ['empty']*missing)
     else:
-        return np.zeros((1,200)), np.array(['empty'])
+        return np.zeros((1, index.vectors.shape[1])), np.array(['empty'])
 
 
 path = '../combined.tab'
 
-annotations = np.load('annotations.npy', allow_pickle=True)
-
-new_annotations = np.load('sewAnnotations.npy', allow_pickle=True)
+annotations = AnnotationStore('euroStore').annotations       # memory-mapped columnar stores written by main.py
 
+new_annotations = AnnotationStore('sewStore').annotations
 
-model = KeyedVectors.load_word2vec_format('./embeddings.vec', binary=False)
 
-table = model.wv
 word2senses = get_map_senses(annotations)
 
 word2senses_sew = getSensesSew(new_annotations)
 
 word2senses.update(word2senses_sew)
 
+index = load_sense_index('./embeddings.npy', word2senses)   # memory-mapped sense embeddings (see utils.save_senses_npy), indexed once
+
 
 f = open(path, encoding='utf-8')
 words = []
@@ -74,7 +76,7 @@ f.close()
 ext_senses = []
 names = []
 for word in words:
-    sns, lemma_syns = get_senses(word, table, word2senses)
+    sns, lemma_syns = get_senses(word, index, word2senses)
     for elem in sns:
         ext_senses.append(elem)
     for lmsyn in lemma_syns:
@@ -102,6 +104,8 @@ print('Sel. sense: ', names[sel_index])
 for m in indices[0]:
     print(m)
     print('NN names', names[m])
+search = load_search('./embeddings.npy', word2senses)        # nearest senses in the full embedding space, for comparison
+print('NN names (full space)', search.by_senses([names[sel_index]], k=3)[0])
 
 for n in range(len(comp_senses)):
     if comp_senses[n].all() == np.zeros(3).all():
@@ -128,9 +132,9 @@ print(names[max_point_index])
 
 words_best = ['paper', 'journal', 'article']
 
-_, first_senses = get_senses(words_best[0], table, word2senses)
-_, second_senses = get_senses(words_best[1], table, word2senses)
-_, third_senses = get_senses(words_best[2], table, word2senses)
+_, first_senses = get_senses(words_best[0], index, word2senses)
+_, second_senses = get_senses(words_best[1], index, word2senses)
+_, third_senses = get_senses(words_best[2], index, word2senses)
 print(first_senses)
 print(second_senses)
 print(third_senses)
@@ -0,0 +1,277 @@
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+#   Checkpointed stage runner.
+#
+# @author Giada Simionato <simionato.1822614@studenti.uniroma1.it>
+#
+# A pipeline is a list of stages, each with the stages it depends on, its parameters and the input files it reads. The artifacts returned by a stage
+# (a dictionary of small values, usually paths of the files it wrote) are saved in the folder of the pipeline together with its fingerprint, i.e. the hash
+# of its parameters, of the signatures of its input files and of the fingerprints of the stages it depends on. A stage is skipped when its fingerprint
+# did not change since its last successful run, so that changing a parameter re-runs only the stages that depend on it.
+# Each stage runs in a child process, so that the wall time and the peak memory recorded for it are its own (the peak of the stage or of the
+# largest worker process it started, see peak_rss).
+# When profiling, each stage also runs under cProfile (its dump is saved as <stage>.prof in the folder of the pipeline, readable with pstats or snakeviz)
+# and the statistics of the instrumented functions (see profiling.py) are collected for it.
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import pickle
+import hashlib
+import argparse
+import cProfile
+import resource
+import traceback
+import queue as queues
+import multiprocessing
+import profiling
+from cache_utils import file_signature, folder_signature, reuse_folder_signatures
+
+# --- Class that describes a stage of the pipeline. ---
+
+class Stage(object):
+
+    def __init__(self, name, function, after=(), params=None, files=()):
+
+        self.name = name
+        self.function = function        # function(inputs, params) -> dictionary of artifacts, inputs being the merged artifacts of the stages in after
+        self.after = list(after)        # names of the stages whose artifacts are needed
+        self.params = params or dict()  # parameters of the stage (JSON-serializable)
+        self.files = list(files)        # input files and folders read by the stage
+
+
+# --- Function that computes the signature of an input file or folder. ---
+# A folder is described by the signatures of its subfolders as computed by the parse cache (cache_utils.folder_signature, i.e. by the files they
+# directly contain), so that inside reuse_folder_signatures the parsers do not list the same folders again.
+# :param path: path of the file or folder
+# :return signature: list describing it (None if it does not exist)
+
+def path_signature(path):
+
+    if not os.path.exists(path):
+        return None
+    if os.path.isdir(path):
+        children = [(name, os.path.join(path, name)) for name in sorted(os.listdir(path))]
+        return [[name, folder_signature(child) if os.path.isdir(child) else file_signature(child)] for name, child in children]
+    return file_signature(path)
+
+
+# --- Function that returns the peak resident memory of the current process and of its children (e.g. the workers of its pools). ---
+# The children are counted by the largest of them that terminated, not by their sum, so the figure is a lower bound of the memory of the process and
+# of its workers together.
+# :return mb: highest peak resident set size, in MB, of the current process and of each of its terminated children
+
+def peak_rss():
+
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024        # ru_maxrss is in KB on Linux
+
+
+# --- Function that runs the function of a stage, under cProfile if required, and saves its artifacts. ---
+# :param stage: the Stage
+# :param inputs: merged artifacts of the stages it depends on
+# :param path: path of the file where the artifacts are saved
+# :param profilePath: path of the cProfile dump (None not to profile)
+# :return functions: statistics of the instrumented functions called by the stage (None when not profiling)
+
+def _call_stage(stage, inputs, path, profilePath=None):
+
+    if profilePath is None:
+        artifacts = stage.function(inputs, stage.params) or dict()
+    else:
+        profiling.reset()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            artifacts = stage.function(inputs, stage.params) or dict()
+        finally:
+            profiler.disable()
+            profiler.dump_stats(profilePath)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(artifacts, f)
+    os.replace(path + '.tmp', path)
+    return profiling.snapshot() if profilePath is not None else None
+
+
+# --- Function executed in the child process of a stage: runs it and saves its artifacts. ---
+# :param stage: the Stage
+# :param inputs: merged artifacts of the stages it depends on
+# :param path: path of the file where the artifacts are saved
+# :param queue: queue where the peak memory and the instrumentation (or the error) are sent back
+# :param profilePath: path of the cProfile dump (None not to profile)
+
+def _run_stage(stage, inputs, path, queue, profilePath=None):
+
+    try:
+        functions = _call_stage(stage, inputs, path, profilePath)
+        queue.put(('ok', (peak_rss(), functions)))
+    except BaseException:
+        queue.put(('error', traceback.format_exc()))
+
+
+# --- Class that runs the stages of a pipeline, skipping the ones whose inputs did not change. ---
+
+class Pipeline(object):
+
+    def __init__(self, stages, root, isolate=True):
+
+        self.stages = list(stages)
+        self.byName = dict((stage.name, stage) for stage in self.stages)
+        self.root = root                # folder of the artifacts and of the state of the stages
+        self.isolate = isolate          # whether each stage runs in a child process
+        self.loaded = dict()            # name of the stage -> artifacts, loaded once
+        self.profiles = dict()          # name of the stage -> instrumentation of its last run in this process (when profiling)
+        os.makedirs(root, exist_ok=True)
+        self.statePath = os.path.join(root, 'state.json')
+        self.state = dict()             # name of the stage -> {'fingerprint', 'wall', 'peak_rss_mb', 'finished'}
+        if os.path.exists(self.statePath):
+            with open(self.statePath, encoding='utf-8') as f:
+                self.state = json.load(f)
+
+    def artifact_path(self, name):
+
+        return os.path.join(self.root, name + '.pkl')
+
+    def profile_path(self, name):
+
+        return os.path.join(self.root, name + '.prof')
+
+    # --- Method that computes the fingerprint of a stage. ---
+    # :param name: name of the stage
+    # :param fingerprints: dictionary of the fingerprints of the stages already computed
+    # :return fingerprint: hexadecimal digest
+
+    def fingerprint(self, name, fingerprints):
+
+        stage = self.byName[name]
+        blob = json.dumps([name, stage.params, [fingerprints[dep] for dep in stage.after], [path_signature(p) for p in stage.files]], sort_keys=True)
+        return hashlib.sha1(blob.encode('utf-8')).hexdigest()
+
+    # --- Method that returns the artifacts of a stage, loading them if needed. ---
+    # :param name: name of the stage
+    # :return artifacts: dictionary of the artifacts
+
+    def artifacts(self, name):
+
+        if name not in self.loaded:
+            if not os.path.exists(self.artifact_path(name)):
+                raise RuntimeError('the stage {} has never been run, its artifacts are missing'.format(name))
+            with open(self.artifact_path(name), 'rb') as f:
+                self.loaded[name] = pickle.load(f)
+        return self.loaded[name]
+
+    # --- Method that runs a single stage and records its wall time and peak memory. ---
+    # :param stage: the Stage
+    # :param fingerprint: fingerprint of the stage
+    # :param profile: whether to profile the stage
+
+    def execute(self, stage, fingerprint, profile=False):
+
+        inputs = dict()
+        for dep in stage.after:
+            inputs.update(self.artifacts(dep))
+        profilePath = self.profile_path(stage.name) if profile else None
+        start = time.time()
+        if self.isolate:
+            queue = multiprocessing.Queue()
+            child = multiprocessing.Process(target=_run_stage, args=(stage, inputs, self.artifact_path(stage.name), queue, profilePath))
+            child.start()
+            while True:
+                try:
+                    status, value = queue.get(timeout=1)
+                    break
+                except queues.Empty:
+                    if not child.is_alive():        # killed without reporting (e.g. out of memory)
+                        status, value = 'error', 'the process of the stage exited with code {}'.format(child.exitcode)
+                        break
+            child.join()
+        else:
+            functions = _call_stage(stage, inputs, self.artifact_path(stage.name), profilePath)
+            status, value = 'ok', (peak_rss(), functions)   # the peak of the whole process so far, an upper bound of the one of the stage
+        if status != 'ok':
+            raise RuntimeError('stage {} failed:\n{}'.format(stage.name, value))
+        rss, functions = value
+        if profile:
+            self.profiles[stage.name] = {'profile': profilePath, 'functions': functions, 'top': profiling.top_functions(profilePath)}
+        self.loaded.pop(stage.name, None)
+        self.state[stage.name] = {'fingerprint': fingerprint, 'wall': time.time()-start, 'peak_rss_mb': rss, 'finished': time.time()}
+        with open(self.statePath + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(self.statePath + '.tmp', self.statePath)
+
+    # --- Method that runs the pipeline. ---
+    # With onlyStage the input files of the other stages are not scanned: the stage uses the artifacts of their previous runs, so its fingerprint is
+    # computed from the fingerprints recorded for them.
+    # :param fromStage: name of the first stage to run anyway, the previous ones are skipped when unchanged (None to start from the first)
+    # :param onlyStage: name of the only stage to run, with the artifacts of the previous runs of the stages it depends on
+    # :param force: whether to run all the selected stages even if unchanged
+    # :param verbose: whether to print the progress
+    # :param profile: whether to profile the stages that run (see profiling.py), their instrumentation is kept in profiles
+    # :param traceMemory: whether the instrumentation also traces the allocations (much slower)
+    # :return report: list of (name of the stage, 'run' or 'skipped', wall time, peak memory in MB)
+
+    def run(self, fromStage=None, onlyStage=None, force=False, verbose=True, profile=False, traceMemory=False):
+
+        if profile:
+            profiling.enable(traceMemory)
+        for name in (fromStage, onlyStage):
+            if name is not None and name not in self.byName:
+                raise ValueError('unknown stage {}, the stages are: {}'.format(name, ', '.join(self.byName)))
+        names = [stage.name for stage in self.stages]
+        forced = set(names[names.index(fromStage):]) if fromStage is not None else set()
+        fingerprints = dict()
+        if onlyStage is not None:
+            fingerprints = dict((name, self.state.get(name, {}).get('fingerprint')) for name in names if name != onlyStage)
+        report = []
+        for stage in self.stages:
+            if onlyStage is not None and stage.name != onlyStage:
+                continue
+            with reuse_folder_signatures():         # the folders signed for the fingerprint are not listed again by the stage
+                fingerprints[stage.name] = self.fingerprint(stage.name, fingerprints)
+                previous = self.state.get(stage.name, {})
+                unchanged = previous.get('fingerprint') == fingerprints[stage.name] and os.path.exists(self.artifact_path(stage.name))
+                if unchanged and not force and stage.name not in forced and stage.name != onlyStage:
+                    report.append((stage.name, 'skipped', previous.get('wall', 0.0), previous.get('peak_rss_mb', 0.0)))
+                    if verbose:
+                        print('[{}] unchanged, skipped'.format(stage.name))
+                    continue
+                if verbose:
+                    print('[{}] running...'.format(stage.name))
+                self.execute(stage, fingerprints[stage.name], profile)
+            record = self.state[stage.name]
+            report.append((stage.name, 'run', record['wall'], record['peak_rss_mb']))
+            if verbose:
+                print('[{}] done in {:.1f}s, peak memory {:.0f} MB'.format(stage.name, record['wall'], record['peak_rss_mb']))
+        return report
+
+
+# --- Function that parses the command line options of a pipeline. ---
+# :param stages: names of the stages
+# :param argv: list of the arguments (None for sys.argv)
+# :return options: dictionary with fromStage, onlyStage, force, profile and traceMemory, see Pipeline.run
+
+def parse_options(stages, argv=None):
+
+    parser = argparse.ArgumentParser(description='Runs the stages of the pipeline, skipping the unchanged ones.')
+    parser.add_argument('--from-stage', choices=stages, default=None, help='runs this stage and all the following ones anyway')
+    parser.add_argument('--only-stage', choices=stages, default=None, help='runs only this stage')
+    parser.add_argument('--force', action='store_true', help='runs all the stages anyway')
+    parser.add_argument('--profile', action='store_true', help='profiles the stages that run and instruments the hot paths')
+    parser.add_argument('--trace-memory', action='store_true', help='with --profile, also traces the memory allocated by the instrumented functions')
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    return {'fromStage': args.from_stage, 'onlyStage': args.only_stage, 'force': args.force, 'profile': args.profile or args.trace_memory,
+            'traceMemory': args.trace_memory}
+
+
+# --- Function that formats the report of a run as a text table. ---
+# :param report: output of Pipeline.run
+# :return table: the table as a string
+
+def format_report(report):
+
+    lines = ['{:<10} {:<8} {:>9} {:>10}'.format('stage', 'status', 'wall (s)', 'peak (MB)')]
+    for name, status, wall, rss in report:
+        lines.append('{:<10} {:<8} {:>9.1f} {:>10.0f}'.format(name, status, wall, rss))
+    return '\n'.join(lines)
@@ -0,0 +1,268 @@
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+#   Opt-in instrumentation of the hot paths of the pipeline.
+#
+# @author Giada Simionato <simionato.1822614@studenti.uniroma1.it>
+#
+# The functions decorated with instrument record, only while the instrumentation is enabled, their nr. of calls, their cumulative time, the nr. of items
+# they processed and (optionally, through tracemalloc) the memory they allocated. For the generators the time is the one spent producing their items,
+# i.e. inside next(), and the items are the ones yielded (their memory is not traced). The statistics of the instrumented functions called by the jobs
+# of a pool of worker processes are sent back with the results of the jobs and added to the ones of the process waiting for them (see collected and
+# merge), whose instrumented function also counts the time spent waiting.
+# The instrumentation is enabled with enable() (inherited by the processes forked afterwards, e.g. the ones of the stages) or by setting the
+# SENSE_PROFILE environment variable to 1 (or to memory to also trace the allocations). When disabled, a decorated function costs one extra call.
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import os
+import json
+import time
+import pstats
+import functools
+import inspect
+import tracemalloc
+
+ENABLED = os.environ.get('SENSE_PROFILE', '') in ('1', 'memory')   # whether the decorated functions record their statistics
+MEMORY = os.environ.get('SENSE_PROFILE', '') == 'memory'           # whether they also record the memory they allocate
+
+_stats = dict()     # name of the function -> [calls, seconds, items, allocated bytes, peak bytes]
+_peaks = []         # highest traced memory seen inside each active instrumented call, see _enter and _exit
+
+
+# --- Function that enables the instrumentation. ---
+# :param memory: whether to trace the allocations too (much slower)
+
+def enable(memory=False):
+
+    global ENABLED, MEMORY
+    ENABLED = True
+    MEMORY = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+# --- Function that disables the instrumentation, keeping the statistics recorded so far. ---
+
+def disable():
+
+    global ENABLED, MEMORY
+    ENABLED = False
+    if MEMORY and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    MEMORY = False
+
+
+# --- Function that discards the statistics recorded so far. ---
+
+def reset():
+
+    _stats.clear()
+    del _peaks[:]
+
+
+# --- Function that initializes a worker process of a pool: the statistics inherited from the parent are discarded, as they are counted there. ---
+# :param initializer: optional initializer of the pool, called with the following arguments
+
+def init_worker(initializer=None, *initargs):
+
+    reset()
+    if initializer is not None:
+        initializer(*initargs)
+
+
+# --- Function executed by the worker processes: runs a job and takes the statistics it recorded. ---
+# :param function: function of a module-level name
+# :param args: arguments of the function
+# :return result, stats: result of the function and the statistics recorded since the previous job (see merged)
+
+def collected(function, *args):
+
+    result = function(*args)
+    stats = dict((name, list(values)) for name, values in _stats.items())
+    _stats.clear()
+    return result, stats
+
+
+# --- Function that adds the statistics recorded by a job of a pool to the ones of the current process. ---
+# :param output: output of collected
+# :return result: the result of the job
+
+def merge(output):
+
+    result, stats = output
+    for name, (calls, seconds, items, allocated, peak) in stats.items():
+        current = _stats.setdefault(name, [0, 0.0, 0, 0, 0])
+        current[0] += calls
+        current[1] += seconds
+        current[2] += items
+        current[3] += allocated
+        current[4] = max(current[4], peak)
+    return result
+
+
+# --- Function that adds the statistics recorded by the jobs of a pool to the ones of the current process, as their outputs are consumed. ---
+# :param outputs: iterable of the outputs of collected
+# :return generator of the results of the jobs
+
+def merged(outputs):
+
+    for output in outputs:
+        yield merge(output)
+
+
+# --- Function that returns the statistics recorded so far. ---
+# :return stats: dictionary whose keys are the names of the functions (module.function) and values are dictionaries with calls, seconds, items,
+#                items_per_s and, when tracing the memory, alloc_mb (net memory allocated by the calls) and peak_mb (highest memory above the one at the call)
+
+def snapshot():
+
+    stats = dict()
+    for name, (calls, seconds, items, allocated, peak) in sorted(_stats.items()):
+        stats[name] = {'calls': calls, 'seconds': seconds, 'items': items, 'items_per_s': items / seconds if seconds > 0 else 0.0}
+        if MEMORY:
+            stats[name]['alloc_mb'] = allocated / 2**20
+            stats[name]['peak_mb'] = peak / 2**20
+    return stats
+
+
+# --- Functions that measure the memory of an instrumented call: the peak of tracemalloc is reset at its start and the peak of the enclosing call is
+# kept in _peaks, so that the nested calls do not hide it. ---
+
+def _enter():
+
+    if not MEMORY:
+        return 0
+    current, peak = tracemalloc.get_traced_memory()
+    if _peaks:
+        _peaks[-1] = max(_peaks[-1], peak)
+    _peaks.append(current)
+    tracemalloc.reset_peak()
+    return current
+
+
+def _exit(start):
+
+    if not MEMORY:
+        return 0, 0
+    current, peak = tracemalloc.get_traced_memory()
+    peak = max(_peaks.pop(), peak)
+    if _peaks:
+        _peaks[-1] = max(_peaks[-1], peak)
+    return current-start, peak-start
+
+
+# --- Function that adds the measures of a call to the statistics of a function. ---
+
+def _record(name, seconds, items, allocated=0, peak=0):
+
+    stats = _stats.setdefault(name, [0, 0.0, 0, 0, 0])
+    stats[0] += 1
+    stats[1] += seconds
+    stats[2] += items
+    stats[3] += allocated
+    stats[4] = max(stats[4], peak)
+
+
+# --- Function that wraps a generator, measuring the time spent to produce its items. ---
+
+def _traced(name, generator):
+
+    seconds = 0.0
+    items = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                seconds += time.perf_counter()-start
+                return
+            seconds += time.perf_counter()-start
+            items += 1
+            yield item
+    finally:
+        _record(name, seconds, items)
+
+
+# --- Decorator that instruments a function. ---
+# :param items: function(result, *args, **kwargs) returning the nr. of items processed by a call (None for no items); the generators count the items
+#               they yield
+# :return decorator
+
+def instrument(items=None):
+
+    def decorator(function):
+
+        name = function.__module__ + '.' + function.__qualname__
+        if inspect.isgeneratorfunction(function):
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+
+                if not ENABLED:
+                    return function(*args, **kwargs)
+                return _traced(name, function(*args, **kwargs))
+
+        else:
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+
+                if not ENABLED:
+                    return function(*args, **kwargs)
+                memory = _enter()
+                start = time.perf_counter()
+                try:
+                    result = function(*args, **kwargs)
+                finally:
+                    seconds = time.perf_counter()-start
+                    allocated, peak = _exit(memory)
+                _record(name, seconds, items(result, *args, **kwargs) if items is not None else 0, allocated, peak)
+                return result
+
+        return wrapper
+    return decorator
+
+
+# --- Functions returning the nr. of items of the results of the instrumented functions. ---
+
+def first_length(result, *args, **kwargs):
+
+    return len(result[0])
+
+
+def result_length(result, *args, **kwargs):
+
+    return len(result)
+
+
+# --- Function that returns the most expensive functions of a cProfile dump. ---
+# :param path: path of the dump
+# :param n: nr. of functions
+# :return top: list of dictionaries with the function, its nr. of calls, its own time and its cumulative time, by decreasing cumulative time
+
+def top_functions(path, n=20):
+
+    stats = pstats.Stats(path).stats       # (file, line, function) -> (primitive calls, calls, own time, cumulative time, callers)
+    top = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:n]
+    return [{'function': '{}:{}({})'.format(os.path.basename(file), line, function), 'calls': calls, 'tottime': own, 'cumtime': cumulative}
+            for (file, line, function), (primitive, calls, own, cumulative, callers) in top]
+
+
+# --- Function that writes the machine-readable summary of a run of a pipeline. ---
+# :param path: path of the JSON file
+# :param report: output of Pipeline.run
+# :param profiles: dictionary whose keys are the names of the profiled stages and values are their instrumentation (see Pipeline.profiles)
+# :return summary: the summary written
+
+def write_summary(path, report, profiles=None):
+
+    profiles = profiles or dict()
+    stages = []
+    for name, status, wall, rss in report:
+        stage = {'stage': name, 'status': status, 'wall': wall, 'peak_rss_mb': rss}
+        stage.update(profiles.get(name, {}))
+        stages.append(stage)
+    summary = {'finished': time.strftime('%Y-%m-%dT%H:%M:%S'), 'wall': sum(stage['wall'] for stage in stages if stage['status'] == 'run'), 'stages': stages}
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    os.replace(path + '.tmp', path)
+    return summary
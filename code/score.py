@@ -4,67 +4,157 @@
 # @author Giada Simionato <simionato.1822614@studenti.uniroma1.it>
 #
 # It contains all the methods needed for the computation of the Spearman score based on the cosine_similarity for the evaluation of the model.
+# The similarities of all the pairs of the evaluation file are computed together with batched matrix products over the normalized embeddings.
+# The senses of a lemma are read as a slice of the SenseIndex of the model (see sense_index.py), loaded once per model.
 # -----------------------------------------------------------------------------------------------------------------------------------------------------------
 
-from sklearn.metrics.pairwise import cosine_similarity
 from scipy.stats import spearmanr
 import numpy as np
+from profiling import instrument, first_length, result_length
 
 # --- Function that retrieves all the embeddings of all the senses associated to a certain lemma. ---
 # :param word: lemma
-# :param luTable: the look-up table of the embeddings, the keys are the senses and the values are the corr. embeddings
-# :param word2senses: dictionary whose keys are the lemmas and the corr. values are lists containing all the BabelNet ids corr. to that lemma
+# :param index: SenseIndex of the model (see sense_index.py)
+# :return embeddings: 2D array of the normalized embeddings of the senses of the lemma (no rows if it has none)
 
-def get_senses(word, luTable, word2senses):
+def get_senses(word, index):
 
-    emb_Set = []
-    senses = word2senses[word]      # gets the list of all BabelNet ids of the lemma
-    for sense in senses:
-        lemma_syn = word+'_'+sense  # builds the sense
-        if lemma_syn in luTable:    # if there is an embedding of this sense retrieve it
-            emb_Set.append(luTable[lemma_syn])
-    return np.asarray(emb_Set)      # converts the list as array
+    return index.vectors_of(word)   # the senses of the lemma are a slice of the index
 
 
 # --- Function that computes the maximum cosine similarity among all the embeddings of all the senses of two words. ---
 # :param w1: first word
 # :param w2: second word
-# :param luTable: the look-up table of the embeddings, the keys are the senses and the values are the corr. embeddings
+# :param index: SenseIndex of the model (see sense_index.py)
+# :return cosine: the maximum cosine similarity, -1.0 if a word has no embedded senses
+
+def get_cosine(w1, w2, index):
+
+    S1 = get_senses(w1, index)      # gets the senses for w1
+    S2 = get_senses(w2, index)      # gets the senses for w2
+    if len(S1) and len(S2):         # if there are embeddings for the senses then
+        return float(np.max(S1 @ S2.T))     # compute the maximum cosine similarity (the embeddings are normalized)
+    return -1.0                     # otherwise return the worst case
+
+
+# --- Function that returns the embeddings of a look-up table with the index of each sense. ---
+# :param luTable: the look-up table of the embeddings (Gensim KeyedVectors or dictionary), the keys are the senses and the values are the corr. embeddings
+# :return vectors: 2D array whose rows are the embeddings
+# :return index: dictionary whose keys are the senses and the values are the corr. rows of vectors
+
+def lookup_index(luTable):
+
+    if hasattr(luTable, 'key_to_index'):                    # Gensim 4 KeyedVectors
+        return luTable.vectors, luTable.key_to_index
+    if hasattr(luTable, 'index2word'):                      # Gensim 3 KeyedVectors
+        return luTable.vectors, {sense: i for i, sense in enumerate(luTable.index2word)}
+    senses = list(luTable)
+    return np.asarray([luTable[sense] for sense in senses]), {sense: i for i, sense in enumerate(senses)}
+
+
+# --- Function that builds the padded matrix of the indexes of the embeddings of the senses of some words. ---
+# :param words: list of lemmas
+# :param index: dictionary whose keys are the senses and the values are the corr. rows of the embeddings
 # :param word2senses: dictionary whose keys are the lemmas and the corr. values are lists containing all the BabelNet ids corr. to that lemma
+# :return indexes: 2D integer array with a row per word holding the indexes of the embeddings of its senses, padded with -1
+
+def sense_indexes(words, index, word2senses):
+
+    rows = []
+    for word in words:
+        rows.append([index[word+'_'+sense] for sense in word2senses.get(word, ()) if word+'_'+sense in index])
+    indexes = np.full((len(rows), max([len(row) for row in rows] + [1])), -1, dtype=np.int64)
+    for i, row in enumerate(rows):
+        indexes[i, :len(row)] = row
+    return indexes
+
+
+# --- Function that computes at once the maximum cosine similarity among the senses of many pairs of words (see get_cosine). ---
+# :param vectors: 2D array of the embeddings, normalized to unit length
+# :param indexes1: padded indexes of the senses of the first word of each pair (see sense_indexes)
+# :param indexes2: padded indexes of the senses of the second word of each pair
+# :param batchSize: nr. of pairs whose similarities are computed together
+# :return cosines: 1D array with the maximum cosine similarity of each pair, -1.0 for the pairs where a word has no embedded senses
+
+def max_cosines(vectors, indexes1, indexes2, batchSize=1024):
+
+    cosines = np.full(len(indexes1), -1.0)
+    for start in range(0, len(indexes1), batchSize):
+        i1 = indexes1[start:start+batchSize]
+        i2 = indexes2[start:start+batchSize]
+        sims = np.matmul(vectors[i1], vectors[i2].transpose(0, 2, 1))     # (batch, senses of w1, senses of w2) cosine similarities
+        valid = (i1 >= 0)[:, :, None] & (i2 >= 0)[:, None, :]
+        sims = np.where(valid, sims, -np.inf).max(axis=(1, 2))
+        cosines[start:start+batchSize] = np.where(np.isfinite(sims), sims, -1.0)
+    return cosines
+
+
+# --- Function that tells which pairs have embedded senses for both their words, i.e. which pairs max_cosines actually scores. ---
+# :param indexes1: padded indexes of the senses of the first word of each pair (see sense_indexes)
+# :param indexes2: padded indexes of the senses of the second word of each pair
+# :return found: 1D boolean array, True for the pairs whose words both have at least an embedded sense
+
+def found_pairs(indexes1, indexes2):
+
+    return (indexes1 >= 0).any(axis=1) & (indexes2 >= 0).any(axis=1)
+
+
+# --- Function that reads the pairs of words of an evaluation file. ---
+# :param path: the path of the file for the evaluation (combined.tab)
+# :return words1, words2: lists of the lower-case first and second words of each pair
+# :return gold: list of the gold scores
+
+@instrument(first_length)
+def read_pairs(path):
+
+    words1, words2, gold = [], [], []
+    with open(path, encoding='utf-8') as f:
+        f.readline()                    # discard first line (comments)
+        for line in f:
+            parts = line.split()
+            if len(parts) < 3:
+                continue
+            words1.append(parts[0].lower())
+            words2.append(parts[1].lower())
+            gold.append(float(parts[2]))
+    return words1, words2, gold
+
+
+# --- Function that computes the maximum cosine similarities of many pairs of words. ---
+# The embeddings of the senses of the pairs are normalized once and all the similarities are computed with batched matrix products.
+# :param words1: list of the first words of the pairs
+# :param words2: list of the second words of the pairs
+# :param luTable: the look-up table of the embeddings, the keys are the senses and the values are the corr. embeddings, or its SenseIndex
+# :param word2senses: dictionary whose keys are the lemmas and the corr. values are lists containing all the BabelNet ids corr. to that lemma (unused with a SenseIndex)
+# :return cosines: 1D array with the maximum cosine similarity of each pair, -1.0 for the pairs where a word has no embedded senses
 
-def get_cosine(w1, w2, luTable, word2senses):
+@instrument(result_length)
+def pair_cosines(words1, words2, luTable, word2senses):
 
-    if w1 in word2senses and w2 in word2senses:     # if there are senses for these words
-        S1 = get_senses(w1, luTable, word2senses)   # gets the senses for w1
-        S2 = get_senses(w2, luTable, word2senses)   # gets the senses for w2
-        if S1 != [] and S2 != []:                   # if there are embeddings for the senses then            
-            return np.max(cosine_similarity(S1, S2))    # compute the maximum cosine similarity
-        else:
-            return -1.0                             # otherwise return the worst case
-    else:
-        return -1.0
+    if hasattr(luTable, 'pair_cosines'):    # SenseIndex (see sense_index.py): the senses of each lemma are already grouped and normalized
+        return luTable.pair_cosines(words1, words2)
+    vectors, index = lookup_index(luTable)
+    indexes1 = sense_indexes(words1, index, word2senses)
+    indexes2 = sense_indexes(words2, index, word2senses)
+    used, inverse = np.unique(np.concatenate([indexes1.ravel(), indexes2.ravel(), [-1]]), return_inverse=True)     # only the needed senses are normalized
+    unit = np.zeros((len(used), vectors.shape[1]))                                  # row 0 is for the padding (-1)
+    unit[1:] = vectors[used[1:]]
+    norms = np.linalg.norm(unit, axis=1, keepdims=True)
+    unit = np.divide(unit, norms, out=np.zeros_like(unit), where=norms > 0)         # null embeddings have null similarities, as in cosine_similarity
+    local1 = np.where(indexes1 >= 0, inverse[:indexes1.size].reshape(indexes1.shape), -1)
+    local2 = np.where(indexes2 >= 0, inverse[indexes1.size:-1].reshape(indexes2.shape), -1)
+    return max_cosines(unit, local1, local2)
 
 
 # --- Function that computes the score of the model. ---
 # :param path: the path of the file for the evaluation (combined.tab)
-# :param luTable: the look-up table of the embeddings, the keys are the senses and the values are the corr. embeddings
+# :param luTable: the look-up table of the embeddings, the keys are the senses and the values are the corr. embeddings, or its SenseIndex
 # :param word2senses: dictionary whose keys are the lemmas and the corr. values are lists containing all the BabelNet ids corr. to that lemma
 
+@instrument()
 def score_model(path, luTable, word2senses):
 
-    gold = []               # list of the gold scores
-    cosine = []             # list of cosine scores
-    f = open(path, encoding='utf-8')
-    line = f.readline()     # discard first line (comments)
-    line = f.readline()
-
-    while line!='':
-        parts = line.split()
-        cos = get_cosine(parts[0].lower(), parts[1].lower(), luTable, word2senses)  # get cosine score of the two words
-        cosine.append(cos)              # updates cosine list
-        gold.append(float(parts[2]))    # updates gold list
-        line = f.readline()
-    
-    f.close()
+    words1, words2, gold = read_pairs(path)
+    cosine = pair_cosines(words1, words2, luTable, word2senses)    # cosine scores of all the pairs
     rho, _ = spearmanr(gold, cosine)    # computes the Spearman score
-    return rho
\ No newline at end of file
+    return rho
@@ -0,0 +1,139 @@
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+#   Sense-only CBOW model.
+#
+# @author Giada Simionato <simionato.1822614@studenti.uniroma1.it>
+#
+# A CBOW model with negative sampling where only the senses are predicted: the context words of each row are inputs only (they have no output vector)
+# and the senses are outputs only (they have no input vector), so each row is a single prediction of its sense from the mean of its context, instead
+# of one prediction per token as in the CBOW model of Gensim, and the model has a vector per word plus one per sense instead of two per token.
+# The sense embeddings are the output vectors. The rows are trained a batch at a time: the mean of the contexts and the updates of the vectors are
+# products of sparse matrices with the (few) vectors involved in the batch.
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import os
+import numpy as np
+import scipy.sparse as sparse
+from fix_inconsistencies import PAD
+from utils import keyed_vectors
+
+# --- Function that adds the rows of a matrix, weighted, to some rows of the vectors. ---
+# :param vectors: 2D array updated in place
+# :param indexes: 1D array, the index of the row of vectors updated by each term
+# :param terms: 1D array of the same length of indexes, the row of X of each term
+# :param weights: 1D array of the same length of indexes, the weight of each term
+# :param X: 2D array whose rows are added
+
+def scatter_add(vectors, indexes, terms, weights, X):
+
+    unique, inverse = np.unique(indexes, return_inverse=True)
+    vectors[unique] += sparse.csr_matrix((weights, (inverse, terms)), shape=(len(unique), len(X))) @ X
+
+
+# --- Class of the sense-only CBOW model. ---
+
+class SenseCBOW(object):
+
+    def __init__(self, words, senses, counts, size, negative=5, seed=0):
+
+        self.words = list(words)            # context words, inputs only
+        self.senses = list(senses)          # senses, outputs only
+        self.negative = negative            # nr. of negative senses sampled for each row
+        rng = np.random.RandomState(seed)
+        self.inputs = ((rng.rand(len(self.words), size) - 0.5) / size).astype(np.float32)   # initialized as Gensim does
+        self.outputs = np.zeros((len(self.senses), size), dtype=np.float32)
+        noise = np.asarray(counts, dtype=np.float64) ** 0.75                                # distribution of the negative senses
+        self.noise = np.cumsum(noise) / noise.sum()
+        self.rng = rng
+
+    # --- Method that builds the model for the vocabulary of a corpus. ---
+    # :param vocabulary: dictionary whose keys are the tokens to train and values are their nr. of occurrences (see corpus.build_vocabulary)
+    # :param size: size of the embeddings
+    # :param negative: nr. of negative samples
+    # :param seed: seed of the initialization and of the sampling
+    # :return model: the SenseCBOW
+
+    @classmethod
+    def for_vocabulary(cls, vocabulary, size, negative=5, seed=0):
+
+        words = [token for token in vocabulary if '_bn:' not in token and token != PAD]
+        senses = [token for token in vocabulary if '_bn:' in token]
+        return cls(words, senses, [vocabulary[sense] for sense in senses], size, negative, seed)
+
+    # --- Method that trains one batch of rows. ---
+    # :param context: 2D array of the indexes of the context words of each row (-1 for the padding and the pruned words)
+    # :param targets: 1D array of the indexes of the senses of the rows
+    # :param alpha: learning rate
+
+    def train_batch(self, context, targets, alpha):
+
+        valid = context >= 0
+        n = valid.sum(1)
+        keep = (n > 0) & (targets >= 0)                 # rows without context words or without a trained sense are skipped
+        context, valid, n, targets = context[keep], valid[keep], n[keep], targets[keep]
+        if len(targets) == 0:
+            return
+        rows, columns = np.nonzero(valid)
+        unique, inverse = np.unique(context[rows, columns], return_inverse=True)
+        mean = sparse.csr_matrix(((1.0 / n[rows]).astype(np.float32), (rows, inverse)), shape=(len(targets), len(unique)))
+        h = mean @ self.inputs[unique]                  # mean of the context of each row
+
+        samples = np.concatenate([targets[:, None], np.searchsorted(self.noise, self.rng.rand(len(targets), self.negative))], axis=1)
+        labels = np.zeros(samples.shape, dtype=np.float32)
+        labels[:, 0] = 1
+        out = self.outputs[samples]
+        g = (labels - 1 / (1 + np.exp(-np.einsum('bd,bkd->bk', h, out)))) * alpha
+        g[:, 1:][samples[:, 1:] == targets[:, None]] = 0     # the sense itself drawn as a negative sample is ignored
+        errors = np.einsum('bk,bkd->bd', g, out)
+
+        scatter_add(self.outputs, samples.ravel(), np.repeat(np.arange(len(targets)), samples.shape[1]), g.ravel(), h)
+        self.inputs[unique] += sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (inverse, rows)), shape=(len(unique), len(targets))) @ errors
+
+    # --- Method that trains the model on the rows of a corpus. ---
+    # The learning rate decreases linearly from alpha to minAlpha over all the epochs, as in Gensim.
+    # :param corpus: RowCorpus (cropped to the window of the model)
+    # :param epochs: nr. of epochs
+    # :param alpha: initial learning rate
+    # :param minAlpha: final learning rate
+    # :param batchSize: nr. of rows trained at a time
+
+    def train(self, corpus, epochs, alpha=0.025, minAlpha=0.0001, batchSize=1024):
+
+        lookup = dict((token, i) for i, token in enumerate(self.words))
+        wordIndex = np.array([lookup.get(token, -1) for token in corpus.tokens.tolist()], dtype=np.int64)     # corpus token id -> word index
+        lookup = dict((token, i) for i, token in enumerate(self.senses))
+        senseIndex = np.array([lookup.get(token, -1) for token in corpus.tokens.tolist()], dtype=np.int64)   # corpus token id -> sense index
+        rows = corpus.rows[:, corpus.columns]
+        center = rows.shape[1] // 2
+        contextColumns = [c for c in range(rows.shape[1]) if c != center]
+        total = max(1, epochs * len(rows))
+        done = 0
+        for epoch in range(epochs):
+            for start in range(0, len(rows), batchSize):
+                batch = np.asarray(rows[start:start+batchSize])
+                self.train_batch(wordIndex[batch[:, contextColumns]], senseIndex[batch[:, center]], max(minAlpha, alpha - (alpha-minAlpha) * done / total))
+                done += len(batch)
+
+    # --- Method that returns the sense embeddings as a look-up table. ---
+    # :return luTable: Gensim KeyedVectors whose keys are the senses and values are their output vectors
+
+    def sense_vectors(self):
+
+        return keyed_vectors(self.senses, self.outputs)
+
+    def save(self, path):
+
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, words=np.array(self.words, dtype=object), senses=np.array(self.senses, dtype=object), inputs=self.inputs,
+                     outputs=self.outputs, noise=self.noise, negative=self.negative)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+
+        data = np.load(path, allow_pickle=True)
+        model = cls.__new__(cls)
+        model.words, model.senses = data['words'].tolist(), data['senses'].tolist()
+        model.inputs, model.outputs, model.noise = data['inputs'], data['outputs'], data['noise']
+        model.negative = int(data['negative'])
+        model.rng = np.random.RandomState(0)
+        return model
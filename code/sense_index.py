@@ -0,0 +1,208 @@
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+#   Index of the sense embeddings of the lemmas.
+#
+# @author Giada Simionato <simionato.1822614@studenti.uniroma1.it>
+#
+# The embeddings of the senses (lemma_BabelNetId) of a model are copied, normalized to unit length, into a single matrix where the senses of each lemma
+# are contiguous rows. The index is stored in CSR form: the senses of the lemma with id i are the rows indptr[i]:indptr[i+1] of the matrix, so that
+# the senses of a lemma are a slice instead of the look-ups of the strings lemma+'_'+id in the model.
+# The index is built once when a model is loaded and saved next to its embeddings (embeddings.vec -> embeddings.vec.senses.npz).
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import os
+import json
+import hashlib
+import numpy as np
+from cache_utils import file_signature
+from utils import load_embeddings
+from gensim.models import KeyedVectors
+from gensim.utils import SaveLoad
+from score import lookup_index, max_cosines
+
+SENSE_MARKER = '_bn:'       # separates the lemma from the BabelNet id in the senses
+
+# --- Function that computes the version of a dictionary of the senses of the lemmas. ---
+# :param word2senses: dictionary whose keys are the lemmas and the corr. values are lists containing all the BabelNet ids corr. to that lemma (None if the senses are taken from the model)
+# :return version: hexadecimal digest identifying the content of the dictionary
+
+def senses_version(word2senses):
+
+    if word2senses is None:
+        return None
+    h = hashlib.sha1()
+    for lemma in sorted(word2senses):
+        h.update((lemma + '\t' + ' '.join(word2senses[lemma]) + '\n').encode('utf-8'))
+    return h.hexdigest()
+
+
+# --- Class that holds the normalized embeddings of the senses grouped by lemma. ---
+
+class SenseIndex(object):
+
+    def __init__(self, lemmas, indptr, senses, vectors, meta=None):
+
+        self.lemmas = list(lemmas)                  # lemma id -> lemma
+        self.lemma2id = dict((lemma, i) for i, lemma in enumerate(self.lemmas))
+        self.indptr = np.asarray(indptr, dtype=np.int64)    # the senses of the lemma i are the rows indptr[i]:indptr[i+1]
+        self.senses = list(senses)                  # row -> sense
+        self.vectors = vectors                      # 2D float32 array of the embeddings of the senses, normalized to unit length
+        self.meta = meta or dict()                  # signature of the source model and version of the senses
+
+    def __len__(self):
+
+        return len(self.senses)
+
+    def __contains__(self, lemma):
+
+        return lemma in self.lemma2id
+
+    # --- Method that returns the rows of the senses of a lemma. ---
+    # :param lemma: the lemma
+    # :return start, end: the senses of the lemma are the rows start:end (empty if the lemma is not in the index)
+
+    def rows(self, lemma):
+
+        i = self.lemma2id.get(lemma)
+        if i is None:
+            return 0, 0
+        return int(self.indptr[i]), int(self.indptr[i+1])
+
+    # --- Method that returns the normalized embeddings of the senses of a lemma. ---
+    # :param lemma: the lemma
+    # :return vectors: 2D array, a row per sense
+
+    def vectors_of(self, lemma):
+
+        start, end = self.rows(lemma)
+        return self.vectors[start:end]
+
+    # --- Method that returns the senses of a lemma. ---
+    # :param lemma: the lemma
+    # :return senses: list of the senses (lemma_BabelNetId) in the order of their rows
+
+    def senses_of(self, lemma):
+
+        start, end = self.rows(lemma)
+        return self.senses[start:end]
+
+    # --- Method that builds the padded matrix of the rows of the senses of some lemmas. ---
+    # :param words: list of lemmas
+    # :return indexes: 2D integer array with a row per lemma holding the rows of its senses, padded with -1
+
+    def gather(self, words):
+
+        ids = np.array([self.lemma2id.get(w, -1) for w in words], dtype=np.int64)
+        known = ids >= 0
+        starts = np.where(known, self.indptr[ids], 0)
+        counts = np.where(known, self.indptr[ids+1]-starts, 0)
+        steps = np.arange(max(int(counts.max()) if len(counts) else 0, 1))
+        return np.where(steps < counts[:, None], starts[:, None] + steps, -1)
+
+    # --- Method that computes the maximum cosine similarities among the senses of many pairs of lemmas. ---
+    # :param words1: list of the first lemmas of the pairs
+    # :param words2: list of the second lemmas of the pairs
+    # :return cosines: 1D array with the maximum cosine similarity of each pair, -1.0 for the pairs where a lemma has no senses
+
+    def pair_cosines(self, words1, words2):
+
+        return max_cosines(self.vectors, self.gather(words1), self.gather(words2))
+
+    # --- Method that saves the index. ---
+    # :param path: path of the file (.npz)
+
+    def save(self, path):
+
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, lemmas=np.array(self.lemmas, dtype=str), indptr=self.indptr, senses=np.array(self.senses, dtype=str),
+                 vectors=self.vectors, meta=np.array(json.dumps(self.meta)))
+        os.replace(tmp, path)
+
+    # --- Method that loads an index. ---
+    # :param path: path of the file (.npz)
+    # :return index: the SenseIndex
+
+    @classmethod
+    def load(cls, path):
+
+        with np.load(path) as data:
+            return cls(data['lemmas'].tolist(), data['indptr'], data['senses'].tolist(), data['vectors'], json.loads(str(data['meta'])))
+
+
+# --- Function that loads a model, returning its look-up table of the embeddings. ---
+# :param path: path of the embeddings in word2vec format (.vec/.txt as text, .bin as binary), saved by utils.save_senses_npy (.npy) or of a model saved by Gensim
+# :return luTable: Gensim KeyedVectors (or MappedEmbeddings) of the model
+
+def load_model(path):
+
+    if path.endswith('.npy'):
+        return load_embeddings(path)
+    if path.endswith('.vec') or path.endswith('.txt'):
+        return KeyedVectors.load_word2vec_format(path, binary=False)
+    if path.endswith('.bin'):
+        return KeyedVectors.load_word2vec_format(path, binary=True)
+    model = SaveLoad.load(path)             # Word2Vec checkpoints and KeyedVectors saved with save()
+    return getattr(model, 'wv', model)
+
+
+# --- Function that builds the index of the senses of a model. ---
+# :param luTable: the look-up table of the embeddings, the keys are the senses and the values are the corr. embeddings
+# :param word2senses: dictionary whose keys are the lemmas and the corr. values are lists containing all the BabelNet ids corr. to that lemma; if None
+#                     the lemmas and their senses are taken from the keys of the model containing a BabelNet id
+# :return index: the SenseIndex
+
+def build_sense_index(luTable, word2senses=None):
+
+    vectors, index = lookup_index(luTable)
+    lemmas = []
+    senses = []
+    indptr = [0]
+    if word2senses is None:
+        grouped = dict()                            # lemma -> senses of the model
+        for key in index:
+            cut = key.rfind(SENSE_MARKER)
+            if cut > 0:
+                grouped.setdefault(key[:cut], []).append(key)
+        items = sorted(grouped.items())
+    else:
+        items = [(lemma, [lemma+'_'+bnId for bnId in word2senses[lemma]]) for lemma in sorted(word2senses)]
+    for lemma, keys in items:
+        keys = [key for key in keys if key in index]
+        if keys:
+            lemmas.append(lemma)
+            senses.extend(keys)
+            indptr.append(len(senses))
+    matrix = np.asarray(vectors[[index[key] for key in senses]], dtype=np.float32).reshape(len(senses), vectors.shape[1])
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)   # null embeddings stay null
+    return SenseIndex(lemmas, indptr, senses, matrix)
+
+
+# --- Function that returns the path of the index of the embeddings saved at a path. ---
+# :param path: path of the embeddings
+# :return path: path of the index
+
+def index_path(path):
+
+    return path + '.senses.npz'
+
+
+# --- Function that loads the index of the senses of the embeddings saved at a path, building and saving it if it is missing or out of date. ---
+# :param path: path of the embeddings in word2vec format (.vec/.txt as text, .bin as binary) or of a model saved by Gensim
+# :param word2senses: dictionary whose keys are the lemmas and the corr. values are lists containing all the BabelNet ids corr. to that lemma (None to
+#                     take the senses from the model, see build_sense_index)
+# :param luTable: the model, if already loaded
+# :return index: the SenseIndex
+
+def load_sense_index(path, word2senses=None, luTable=None):
+
+    meta = {'source': file_signature(path), 'senses': senses_version(word2senses)}
+    if os.path.exists(index_path(path)):
+        index = SenseIndex.load(index_path(path))
+        if index.meta == meta:
+            return index
+    if luTable is None:
+        luTable = load_model(path)
+    index = build_sense_index(luTable, word2senses)
+    index.meta = meta
+    index.save(index_path(path))
+    return index
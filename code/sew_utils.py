@@ -3,74 +3,220 @@
 #
 # @author Giada Simionato <simionato.1822614@studenti.uniroma1.it>
 #
-# It parses the Sew dataset returning sentences and annotations.
-# It contains a method that builds the input tensor for the Sew dataset as the one implemented for the EuroSense and for retrieving the senses from the former.
+# It parses the Sew dataset returning sentences and annotations, optionally spreading the folders over a pool of worker processes.
+# The windows are taken from the tokens of each article, lower-cased, split and validated once for all its annotations.
+# It contains a method that builds the input tensor for the Sew dataset as the one implemented for the EuroSense (optionally in a pool of worker
+# processes) and for retrieving the senses from the former.
 # -------------------------------------------------------------------------------------------------------------------------------------------------------------
 
 import os
+import time
+import itertools
+import functools
 import string
-import numpy as np
+import multiprocessing
 from lxml import etree
-from fix_inconsistences import isValid
+from fix_inconsistencies import build_rows, iter_chunks, map_chunks
+from cache_utils import mapping_version, folder_signature, shard_key
+from store_utils import SEW_COLUMNS, AnnotationView, save_store
+import profiling
+from profiling import instrument, first_length, result_length
 
 # --- Function that parses a single XML file. ---
+# The file is streamed: every 'text', 'annotation' and 'wikiArticle' element is cleared as soon as it has been read, so that the memory needed
+# does not depend on the size of the file.
 # :param path: the path of the XML file to parse
 # :param bn2wn: a dictionary whose keys are the BabelNet ids and the values are the corr. WordNet ids
-# :return text: the text of the XML file
+# :return text: the text of the XML file (None if there is no English article)
 # :return annot: the list of tuples like (BabelNet_id, mention, anchorStart, anchorEnd)
 
 def trim_xml(path, bn2wn):
 
+    text = None
     annot = []      # will contain tuples like (BabelNet_id, mention, anchorStart, anchorEnd)
-    content = etree.iterparse(path, events = ('start', ), remove_blank_text=True, encoding='UTF-8')  # creates the parsing structure
+    english = False
+    content = etree.iterparse(path, events = ('start', 'end'), tag = ('wikiArticle', 'text', 'annotation'), remove_blank_text=True, encoding='UTF-8', huge_tree=True)  # creates the streaming parsing structure
     for event, element in content:
-        if element.tag == 'wikiArticle' and element.get('language').lower() == 'en':   # if the article is in English
-            for child in element:
-                if child.tag == 'text':
-                    text = child.text.replace('\t', '').replace('\n', '')   # collects the text
-                if child.tag == 'annotations':
-                    for rec_child in child:   # for each annotation tag 
-                        for elem in rec_child:
-                            if elem.tag == 'babelNetID':
-                                babelNetId = elem.text   # collects the babelNet id
-                                if babelNetId not in bn2wn: # if not in WordNet 
-                                    babelNetId = None       # sets it to None
-                            if elem.tag == 'mention':
-                                mention = elem.text      # collects the mention
-                            if elem.tag == 'anchorStart':
-                                anchorStart = elem.text  # collects the anchorStart
-                            if elem.tag == 'anchorEnd':
-                                anchorEnd = elem.text    # collects the anchorEnd
-                        if babelNetId!=None and mention!=None and anchorStart!=None and anchorEnd!= None:  # if the tuple is valid
-                            annot.append([babelNetId, mention.lower(), anchorStart, anchorEnd])     # appends the annotation
+        if event == 'start':                                    # the children of the elements are complete only at their end
+            if element.tag == 'wikiArticle':
+                english = (element.get('language') or '').lower() == 'en'   # whether the article is in English
+            continue
+        if english and element.tag == 'text' and element.text != None:
+            text = element.text.replace('\t', '').replace('\n', '')   # collects the text
+        elif english and element.tag == 'annotation':
+            babelNetId = mention = anchorStart = anchorEnd = None
+            for elem in element:
+                if elem.tag == 'babelNetID':
+                    babelNetId = elem.text   # collects the babelNet id
+                    if babelNetId not in bn2wn: # if not in WordNet 
+                        babelNetId = None       # sets it to None
+                if elem.tag == 'mention':
+                    mention = elem.text      # collects the mention
+                if elem.tag == 'anchorStart':
+                    anchorStart = elem.text  # collects the anchorStart
+                if elem.tag == 'anchorEnd':
+                    anchorEnd = elem.text    # collects the anchorEnd
+            if babelNetId!=None and mention!=None and anchorStart!=None and anchorEnd!= None:  # if the tuple is valid
+                annot.append([babelNetId, mention.lower(), anchorStart, anchorEnd])     # appends the annotation
+        element.clear()                                         # frees the memory of the element already read
+        while element.getprevious() is not None:                # and drops the empty siblings still referenced by the parent
+            del element.getparent()[0]
     return text, annot
 
 
+# --- Function that parses all the XML files of a single folder of the Sew dataset. ---
+# :param path: path of the Sew dataset folder
+# :param folder: name of the folder to parse
+# :param bn2wn: a dictionary whose keys are the BabelNet ids and the values are the corr. WordNet ids
+# :return texts: list of the texts of the valid articles of the folder
+# :return annots: list of the same length of texts whose elements are the lists of annotations of the corr. article
+# :return nFiles: number of XML files parsed
+
+@instrument(first_length)
+def parse_folder(path, folder, bn2wn):
+
+    texts = []
+    annots = []
+    nFiles = 0
+    list_elements = sorted(os.listdir(path+'/'+folder))  # list of all the XML files in a specific folder (sorted for a reproducible order)
+    for xmlFile in list_elements:
+        path_xml = path + '/'+folder+'/'+xmlFile
+        if xmlFile != 'PaxHeader' and len(xmlFile)<80:    # if the file can be handled (any size, the parser is streaming)
+            nFiles += 1
+            try:
+                text, annot = trim_xml(path_xml, bn2wn)     # parse it
+                if text != None:                            # if the text is valid
+                    texts.append(text)                      # collects the texts
+                    annots.append(annot)                    # collects the annotations
+            except Exception as e:                          # to handle invalid xmlChar values
+                continue
+    return texts, annots, nFiles
+
+
+_worker_args = None     # (path, bn2wn) shared by the worker processes, set once by the pool initializer
+
+# --- Function that initializes a worker process with the arguments shared by all its jobs. ---
+# :param path: path of the Sew dataset folder
+# :param bn2wn: a dictionary whose keys are the BabelNet ids and the values are the corr. WordNet ids
+
+def _init_worker(path, bn2wn):
+
+    global _worker_args
+    _worker_args = (path, bn2wn)
+
+
+# --- Function executed by the worker processes: parses one folder and measures the time spent. ---
+# :param job: tuple (index, folder) where index is the position of the folder in the sorted list
+# :return tuple: (index, folder, texts, annots, nFiles, elapsed time, pid of the worker)
+
+def _parse_folder_job(job):
+
+    index, folder = job
+    path, bn2wn = _worker_args
+    start = time.time()
+    texts, annots, nFiles = parse_folder(path, folder, bn2wn)
+    return index, folder, texts, annots, nFiles, time.time()-start, os.getpid()
+
+
 # --- Function that parses the Sew dataset. ---
 # :param path: path of the Sew dataset folder
 # :param bn2wn: a dictionary whose keys are the BabelNet ids and the values are the corr. WordNet ids
-# :return None: it saves the sentences and annotations
-
-def parse_sew(path, bn2wn):
-
-    texts = []      # contains all the texts of all the articles
-    annots = []     # contains all the annotations
-    list_folders = os.listdir(path)  # list of all the folders of the dataset
-    for folder in list_folders:
-        list_elements = os.listdir(path+'/'+folder)  # list of all the XML files in a specific folder
-        for xmlFile in list_elements:
-            path_xml = path + '/'+folder+'/'+xmlFile  
-            if xmlFile != 'PaxHeader' and len(xmlFile)<80 and os.path.getsize(path_xml) < 92160:    # if the file can be handled
-                try:
-                    text, annot = trim_xml(path_xml, bn2wn)     # parse it
-                    if text != None:                            # if the text is valid
-                        texts.append(text)                      # collects the texts
-                        annots.append(annot)                    # collects the annotations
-                except Exception as e:                          # to handle invalid xmlChar values 
-                    continue
-
-    np.save('sewSentences', np.asarray(texts))
-    np.save('sewAnnotations', np.asarray(annots))
+# :param workers: number of worker processes parsing the folders in parallel (1 parses them in the current process)
+# :param verbose: whether to print the progress and the throughput of each worker
+# :param cache: optional ParseCache, the folders whose content did not change since they were cached are loaded instead of parsed
+# :param out: folder where the columnar store of the whole dataset is saved
+# :return texts: memory-mapped view of the texts of all the articles
+# :return annots: memory-mapped view of the same length of texts with the corr. annotations
+
+@instrument(first_length)
+def parse_sew(path, bn2wn, workers=1, verbose=True, cache=None, out='sewStore'):
+
+    list_folders = sorted(os.listdir(path))  # list of all the folders of the dataset (sorted so that the output is reproducible)
+    results = [None]*len(list_folders)       # results stored by folder position so that the merge order does not depend on the scheduling
+    stats = dict()                           # pid -> [nr. of folders, nr. of files, seconds]
+    start = time.time()
+
+    keys = dict()                            # folder position -> cache key
+    jobs = []
+    if cache is not None:
+        version = mapping_version(bn2wn)
+    for index, folder in enumerate(list_folders):
+        if cache is not None:
+            keys[index] = shard_key('sew', folder_signature(path+'/'+folder), version)
+            if keys[index] in cache:         # unchanged folder: no need to parse it again
+                results[index] = cache.load(keys[index])
+                cache.hits += 1
+                continue
+            cache.misses += 1
+        jobs.append((index, folder))
+    if verbose and cache is not None:
+        print('{} folders loaded from the cache, {} to parse'.format(len(list_folders)-len(jobs), len(jobs)))
+
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=profiling.init_worker, initargs=(_init_worker, path, bn2wn))
+        outputs = profiling.merged(pool.imap_unordered(functools.partial(profiling.collected, _parse_folder_job), jobs))   # with the workers' instrumentation
+    else:
+        _init_worker(path, bn2wn)
+        outputs = map(_parse_folder_job, jobs)
+
+    try:
+        for done, (index, folder, texts, annots, nFiles, elapsed, pid) in enumerate(outputs, 1):
+            results[index] = (texts, annots)
+            if cache is not None:
+                cache.save(keys[index], texts, annots, SEW_COLUMNS)
+            s = stats.setdefault(pid, [0, 0, 0.0])
+            s[0] += 1
+            s[1] += nFiles
+            s[2] += elapsed
+            if verbose:
+                print('[{}/{}] worker {}: {} ({} files, {:.1f} files/s)'.format(done, len(jobs), pid, folder, nFiles, nFiles/max(elapsed, 1e-9)))
+    finally:
+        if workers > 1:
+            pool.close()
+            pool.join()
+
+    texts = itertools.chain.from_iterable(r[0] for r in results)     # all the texts of all the articles, in the order of the folders
+    annots = itertools.chain.from_iterable(r[1] for r in results)    # all the annotations
+    store = save_store(out, texts, annots, SEW_COLUMNS)
+
+    if verbose:
+        for pid, (nFolders, nFiles, elapsed) in sorted(stats.items()):
+            print('Worker {}: {} folders, {} files in {:.1f}s ({:.1f} files/s)'.format(pid, nFolders, nFiles, elapsed, nFiles/max(elapsed, 1e-9)))
+        print('Parsed {} articles in {:.1f}s'.format(len(store), time.time()-start))
+
+    return store.sentences, store.annotations
+
+
+# --- Function that builds the rows of the annotations of some articles. ---
+# Each article is tokenized and validated once and the windows of all its annotations are taken from its tokens through anchorStart and anchorEnd.
+# :param sentences: list of the lower-case articles
+# :param annotations: list of the same length of sentences with the corr. annotations
+# :param windowSize: window size
+# :return rows: list of the rows of the valid annotations (whose anchorStart is within their article), in order
+
+@instrument(result_length)
+def getRows(sentences, annotations, windowSize):
+
+    tokens = []                             # tokens of all the articles
+    found = []                              # (sense, anchorStart, anchorEnd, start of the article, end of the article) of each valid annotation
+    for sentence, annotation in zip(sentences, annotations):
+        parts = None
+        for a in annotation:                # a= (babelnet, mention, anchorStart, anchorEnd)
+            try:
+                anchorStart = int(a[2])
+                anchorEnd = int(a[3])
+            except (TypeError, ValueError):
+                continue
+            if parts is None:
+                parts = sentence.split()    # splits the article, once
+                low = len(tokens)
+                high = low+len(parts)
+                tokens.extend(parts)
+            if anchorStart > len(parts) or anchorEnd < 0:   # the context would start outside the article
+                continue
+            mention = a[1].replace(' ', '_').strip(string.punctuation)  # puts the mention in the correct form
+            found.append((mention+'_'+a[0], low+anchorStart, low+anchorEnd, low, high))     # builds the sense
+    return build_rows(tokens, found, windowSize)
 
 
 # --- Function that builds the row of the input tensor. ---
@@ -81,67 +227,68 @@ def parse_sew(path, bn2wn):
 
 def getRow(sentence, a, windowSize):
 
-    sentence = sentence.lower()
-    anchorStart = int(a[2])
-    anchorEnd = int(a[3])
-    mention = a[1].replace(' ', '_').strip(string.punctuation)  # puts the mention in the correct form
-    sense = mention + '_' + a[0]                                # builds the sense
-    row = [sense]
-    parts = sentence.split()                                    # splits the sentence
-    valid = 0
-    i = anchorStart-1
-    while valid<windowSize:                                     # for windowSize times
-        if i<0:
-            row.insert(0, '<PAD>')                              # if out of bound then pad
-            valid += 1
-        else:
-            elem = parts[i]
-            if isValid(elem):
-                row.insert(0, elem)                             # otherwise insert a valid element
-                valid += 1
-        i -= 1
-    valid = 0
-    i = anchorEnd
-    while valid<windowSize:                                     # for windowSize times
-        if i>=len(parts):                                       # if out of bound then pad
-            row.append('<PAD>')
-            valid += 1
-        else:
-            elem = parts[i]
-            if isValid(elem):
-                row.append(elem)                                # otherwise insert a valid element
-                valid += 1
-        i += 1
-    return row
+    rows = getRows([sentence.lower()], [[a]], windowSize)
+    if not rows:
+        raise ValueError('anchor not in sentence')
+    return rows[0]
 
 
 # --- Function that builds the input tensor. ---
 # :param sentences: 1D numpy array whose elements are the English sentences in the dataset
 # :param annotations: 3D numpy array whose rows are arrays of length as nr. of annots for that sentence whose elems in turn are 4-vectors (BabelNet_id, mention, anchorStart, anchorEnd)
 # :param window_size: window size for the context
+# :param chunkSize: nr. of articles whose windows are extracted together
+# :param workers: nr. of worker processes building the chunks in parallel (1 builds them in the current process)
 # :return tensor: 2D numpy array whose row number is the conistent annotations one and the number of col. are 2*window_size + 1
 
-def getSewTensor(sentences, annotations, windowSize):
+def getSewTensor(sentences, annotations, windowSize, chunkSize=256, workers=1):
 
-    tensor = []
-    for i, annotation in enumerate(annotations):
-        sentence = sentences[i]
-        for a in annotation:  # a= (babelnet, mention, anchorStart, anchorEnd)
-            try:
-                row = getRow(sentence, a, windowSize)
-                tensor.append(row)
-            except Exception as e:
-                continue
-    return tensor
+    return list(iterSewTensor(sentences, annotations, windowSize, chunkSize, workers))
 
 
-# --- Function that builds a dictionary whose keys are the lemmas and the values are lists of corresponding BabelNet ids. ---
+# --- Function executed by the worker processes: builds the rows of a chunk of articles. ---
+# :param job: tuple (sentences, annotations, windowSize), see getRows
+# :return rows: list of the rows of the chunk
+
+def _rows_chunk_job(job):
+
+    return getRows(*job)
+
+
+# --- Function that generates the rows of the input tensor of getSewTensor one at a time, without keeping them in memory. ---
+# :param sentences: 1D numpy array whose elements are the English sentences in the dataset
 # :param annotations: 3D numpy array whose rows are arrays of length as nr. of annots for that sentence whose elems in turn are 4-vectors (BabelNet_id, mention, anchorStart, anchorEnd)
+# :param window_size: window size for the context
+# :param chunkSize: nr. of articles whose windows are extracted together
+# :param workers: nr. of worker processes building the chunks in parallel (1 builds them in the current process), the order of the rows is the same
+# :return generator of the rows, each a list of length 2*window_size + 1
+
+@instrument()
+def iterSewTensor(sentences, annotations, windowSize, chunkSize=256, workers=1):
+
+    jobs = ((s, a, windowSize) for s, a in iter_chunks(sentences, annotations, chunkSize))  # the articles are lower-cased once
+    for rows in map_chunks(_rows_chunk_job, jobs, workers):
+        yield from rows
+
+
+# --- Function that builds a dictionary whose keys are the lemmas and the values are lists of corresponding BabelNet ids. ---
+# :param annotations: 3D numpy array (or view of a columnar store) whose rows are arrays of length as nr. of annots for that sentence whose elems in turn are 4-vectors (BabelNet_id, mention, anchorStart, anchorEnd)
 # :return d: dictionary whose keys are the lemmas and the values are lists of corresponding BabelNet ids
 
+@instrument(result_length)
 def getSensesSew(annotations):
 
     d = dict()
+    if isinstance(annotations, AnnotationView):     # columnar store: only the distinct (mention, id) pairs are decoded
+        store = annotations.store
+        for mentionId, bnId in store.unique_pairs('mention', 'bn').tolist():
+            lemma = store.string(mentionId).replace(' ', '_').strip(string.punctuation)
+            bnId = store.string(bnId)
+            if lemma in d and bnId not in d[lemma]:
+                d[lemma].append(bnId)
+            elif lemma not in d:
+                d[lemma] = [bnId]
+        return d
     for annotation in annotations:
         for a in annotation:
             lemma = a[1].replace(' ', '_').strip(string.punctuation) # removes all the punctuation from the lemma and sets it in correct format
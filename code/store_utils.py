@@ -0,0 +1,230 @@
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+#   Columnar on-disk format for the parsed sentences and annotations.
+#
+# @author Giada Simionato <simionato.1822614@studenti.uniroma1.it>
+#
+# A store is a folder containing:
+#  - strings.bin, strings_offsets.npy: the interned table of all the strings of the annotations (anchors, lemmas, mentions, BabelNet ids), as the
+#    concatenation of their UTF-8 encodings and the offsets where each one starts;
+#  - text.bin, text_offsets.npy: the sentences, encoded in the same way;
+#  - annot_offsets.npy: for each sentence the index of its first annotation (the annotations of sentence i are the rows annot_offsets[i]:annot_offsets[i+1]);
+#  - <column>.npy: one integer array per annotation field, holding either an id in the string table or the value itself;
+#  - meta.json: the list of the columns and the sizes.
+# Every file is memory-mapped when the store is opened, so that the annotations can be accessed by sentence or column by column without loading
+# them as Python objects.
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import os
+import json
+import array
+import shutil
+import functools
+import numpy as np
+
+STR = 'str'     # column whose values are ids in the string table
+INT = 'int'     # column whose values are integers
+
+EUROSENSE_COLUMNS = [('anchor', STR), ('lemma', STR), ('bn', STR)]              # (anchor, lemma, id_synset)
+SEW_COLUMNS = [('bn', STR), ('mention', STR), ('start', INT), ('end', INT)]     # (BabelNet_id, mention, anchorStart, anchorEnd)
+
+
+# --- Function that memory-maps a binary file of bytes. ---
+# :param path: path of the file
+# :return data: read-only 1D uint8 array
+
+def _map_bytes(path):
+
+    if os.path.getsize(path) == 0:      # an empty file cannot be mapped
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode='r')
+
+
+# --- Class that exposes a table of strings stored as concatenated UTF-8 bytes and offsets as a read-only sequence. ---
+
+class StringTable(object):
+
+    def __init__(self, data, offsets):
+
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+
+        return len(self.offsets)-1
+
+    def __getitem__(self, i):
+
+        if i < 0:
+            i += len(self)
+        return bytes(self.data[self.offsets[i]:self.offsets[i+1]]).decode('utf-8')
+
+    def __iter__(self):
+
+        for i in range(len(self)):
+            yield self[i]
+
+
+# --- Class that exposes the annotations of a store as a read-only sequence of lists of annotations, one per sentence. ---
+
+class AnnotationView(object):
+
+    def __init__(self, store):
+
+        self.store = store
+
+    def __len__(self):
+
+        return len(self.store)
+
+    def __getitem__(self, i):
+
+        return self.store.annotation(i)
+
+    def __iter__(self):
+
+        for i in range(len(self)):
+            yield self.store.annotation(i)
+
+
+# --- Class that opens a store in read-only mode. ---
+
+class AnnotationStore(object):
+
+    def __init__(self, path):
+
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.strings = StringTable(_map_bytes(os.path.join(path, 'strings.bin')), np.load(os.path.join(path, 'strings_offsets.npy'), mmap_mode='r'))
+        self.sentences = StringTable(_map_bytes(os.path.join(path, 'text.bin')), np.load(os.path.join(path, 'text_offsets.npy'), mmap_mode='r'))
+        self.offsets = np.load(os.path.join(path, 'annot_offsets.npy'), mmap_mode='r')
+        self.kinds = [kind for name, kind in self.meta['columns']]
+        self.columns = [np.load(os.path.join(path, name+'.npy'), mmap_mode='r') for name, kind in self.meta['columns']]
+        self.annotations = AnnotationView(self)
+        self.string = functools.lru_cache(maxsize=1 << 16)(self.strings.__getitem__)   # decodes a string id, keeping the most recent ones decoded
+
+    def __len__(self):
+
+        return len(self.offsets)-1
+
+    # --- Method that returns the integer array of a column. ---
+    # :param name: name of the column
+    # :return array: memory-mapped array with one element per annotation
+
+    def column(self, name):
+
+        for (colName, kind), col in zip(self.meta['columns'], self.columns):
+            if colName == name:
+                return col
+        raise KeyError(name)
+
+    # --- Method that decodes the annotations of a sentence. ---
+    # :param i: index of the sentence
+    # :return annotation: list of annotations of the sentence, each as the list of its fields
+
+    def annotation(self, i):
+
+        start, end = int(self.offsets[i]), int(self.offsets[i+1])
+        if start == end:
+            return []
+        cols = []
+        for kind, col in zip(self.kinds, self.columns):
+            values = col[start:end].tolist()
+            cols.append([self.string(v) for v in values] if kind == STR else values)
+        return [list(a) for a in zip(*cols)]
+
+    # --- Method that returns the distinct pairs of values of two columns, in order of first occurrence. ---
+    # :param first: name of the first column
+    # :param second: name of the second column
+    # :return pairs: 2D integer array whose rows are the distinct pairs
+
+    def unique_pairs(self, first, second):
+
+        a = np.asarray(self.column(first), dtype=np.int64)
+        b = np.asarray(self.column(second), dtype=np.int64)
+        keys = a*(int(b.max())+1 if len(b) else 1) + b     # a single integer per pair
+        _, index = np.unique(keys, return_index=True)
+        index.sort()
+        return np.stack([a[index], b[index]], axis=1)
+
+
+# --- Function that writes a store. ---
+# The store is written in a temporary folder renamed at the end, so that an interrupted write never leaves a partial store.
+# :param path: folder of the store
+# :param sentences: iterable of sentences
+# :param annotations: iterable of the same length of sentences whose elements are the lists of annotations of the corr. sentence
+# :param columns: list of (name, kind) describing the fields of each annotation
+# :return store: the written store, opened
+
+def save_store(path, sentences, annotations, columns):
+
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+
+    interned = dict()                                       # string -> id in the string table
+    stringOffsets = array.array('q', [0])
+    textOffsets = array.array('q', [0])
+    annotOffsets = array.array('q', [0])
+    cols = [array.array('i' if kind == STR else 'q') for name, kind in columns]
+    nAnnotations = 0
+
+    with open(os.path.join(tmp, 'strings.bin'), 'wb') as stringFile, open(os.path.join(tmp, 'text.bin'), 'wb') as textFile:
+        for sentence, annotation in zip(sentences, annotations):
+            encoded = (sentence or '').encode('utf-8')      # missing texts are stored as empty sentences
+            textFile.write(encoded)
+            textOffsets.append(textOffsets[-1]+len(encoded))
+            for a in annotation:
+                try:
+                    row = [int(v) if kind == INT else v for (name, kind), v in zip(columns, a)]
+                except (TypeError, ValueError):             # annotations with invalid integer fields are discarded
+                    continue
+                if any(v is None for (name, kind), v in zip(columns, row) if kind == STR):
+                    continue                                # and so are the ones with a missing string field (e.g. no anchor or lemma)
+                for (name, kind), col, v in zip(columns, cols, row):
+                    if kind == STR:
+                        if v not in interned:               # interns the new strings
+                            encoded = v.encode('utf-8')
+                            interned[v] = len(interned)
+                            stringFile.write(encoded)
+                            stringOffsets.append(stringOffsets[-1]+len(encoded))
+                        v = interned[v]
+                    col.append(v)
+                nAnnotations += 1
+            annotOffsets.append(nAnnotations)
+
+    np.save(os.path.join(tmp, 'strings_offsets.npy'), np.frombuffer(stringOffsets, dtype=np.int64))
+    np.save(os.path.join(tmp, 'text_offsets.npy'), np.frombuffer(textOffsets, dtype=np.int64))
+    np.save(os.path.join(tmp, 'annot_offsets.npy'), np.frombuffer(annotOffsets, dtype=np.int64))
+    for (name, kind), col in zip(columns, cols):
+        np.save(os.path.join(tmp, name+'.npy'), np.frombuffer(col, dtype=np.int32 if kind == STR else np.int64))
+    with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'columns': columns, 'sentences': len(textOffsets)-1, 'annotations': nAnnotations, 'strings': len(interned)}, f)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+    return AnnotationStore(path)
+
+
+# --- Function that exposes a store at another path without copying it, the files are hard-linked when possible. ---
+# :param src: folder of the existing store
+# :param dst: folder of the new store
+# :return store: the store at dst, opened
+
+def link_store(src, dst):
+
+    tmp = dst + '.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    for name in os.listdir(src):
+        try:
+            os.link(os.path.join(src, name), os.path.join(tmp, name))      # stores are never modified once written
+        except OSError:
+            shutil.copy2(os.path.join(src, name), os.path.join(tmp, name))
+    if os.path.exists(dst):
+        shutil.rmtree(dst)
+    os.replace(tmp, dst)
+    return AnnotationStore(dst)
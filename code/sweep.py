@@ -0,0 +1,245 @@
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+#   Hyperparameter sweep.
+#
+# @author Giada Simionato <simionato.1822614@studenti.uniroma1.it>
+#
+# The datasets are parsed and the rows of the input tensor are shaped once, at the largest window of the sweep, with the stages of main.py (in their own
+# pipeline folder, so that they are skipped when unchanged). Then all the combinations of the given hyperparameters are trained in a pool of worker
+# processes: the rows are a memory-mapped matrix shared by all the trials through the page cache, each trial cropping them to its own window, and the
+# vocabulary of each window is counted once. Every trial is scored with score_model and its results and timings are appended to trials.jsonl, so
+# that an interrupted sweep resumes from the trials not done yet. The leaderboard of all the trials is printed and saved in leaderboard.json.
+#
+# Usage: python sweep.py [--mode cbow senses] [--sg 0 1] [--size 100 200] [--window 2 4] [--negative 5 15] [--epochs 5] [--parallel 2] [--threads 2]
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import itertools
+import traceback
+import multiprocessing
+import main
+from corpus import SenseCorpus, RowCorpus, save_rows, build_vocabulary, save_vocabulary, load_vocabulary
+from pipeline import Stage, Pipeline, format_report, peak_rss
+from score import score_model
+from sense_index import build_sense_index
+
+path_sweep = '../sweep'
+
+_word2senses = None     # dictionary of the senses of the lemmas, set once in each worker process
+
+
+# --- Function of the shape stage of the sweep: builds the rows of the input tensor at the largest window of the sweep. ---
+# :param inputs: artifacts of the parse stage
+# :param params: window size and folder of the rows
+# :return artifacts: path of the rows and their number
+
+def shape(inputs, params):
+
+    in_tensor = SenseCorpus(inputs['euroStore'], inputs['sewStore'], params['window'], workers=main.TENSOR_WORKERS)
+    return {'rows': params['rows'], 'nRows': save_rows(in_tensor, params['rows'])}
+
+
+# --- Function that prepares the inputs shared by all the trials. ---
+# :param root: folder of the sweep
+# :param window: largest window of the sweep
+# :param verbose: whether to print the progress
+# :return artifacts: merged artifacts of the parse, senses and shape stages
+
+def prepare(root, window, verbose=True):
+
+    stages = [stage for stage in main.STAGES if stage.name in ('parse', 'senses')]
+    stages.append(Stage('shape', shape, after=['parse'], params={'window': window, 'rows': os.path.join(root, 'rows')}))
+    pipeline = Pipeline(stages, root)
+    report = pipeline.run(verbose=verbose)
+    if verbose:
+        print(format_report(report))
+    artifacts = dict()
+    for stage in stages:
+        artifacts.update(pipeline.artifacts(stage.name))
+    return artifacts
+
+
+# --- Function that builds all the combinations of the hyperparameters. ---
+# The sg values are only combined with the 'cbow' mode, the 'senses' one having no such choice.
+# :param grid: dictionary whose keys are the names of the hyperparameters and values are the lists of their values
+# :return trials: list of dictionaries of hyperparameters, without duplicates
+
+def combinations(grid):
+
+    names = sorted(grid)
+    trials = []
+    for values in itertools.product(*[grid[name] for name in names]):
+        params = dict(zip(names, values))
+        if params['mode'] == 'senses':
+            params['sg'] = 0
+        if params not in trials:
+            trials.append(params)
+    return trials
+
+
+# --- Function that returns the key of a trial, identifying it in trials.jsonl. ---
+
+def trial_key(params):
+
+    return json.dumps(params, sort_keys=True)
+
+
+# --- Function that sets the dictionary of the senses of the lemmas in a worker process. ---
+
+def _init_trial(word2senses):
+
+    global _word2senses
+    _word2senses = word2senses
+
+
+# --- Function executed by the worker processes: trains and scores a trial. ---
+# :param job: (hyperparameters, folder of the rows, path of the vocabulary of its window, nr. of threads of the training)
+# :return result: dictionary with the hyperparameters, the score, the timings and the peak memory of the trial (or its error)
+
+def _run_trial(job):
+
+    params, rows, vocab, threads = job
+    result = {'params': params}
+    try:
+        start = time.time()
+        model, luTable = main.fit(rows, load_vocabulary(vocab), params, threads)
+        result['train_s'] = time.time()-start
+        start = time.time()
+        index = build_sense_index(luTable, _word2senses)        # the senses of each lemma become slices of the index
+        result['score'] = float(score_model(main.path_scoreData, index, None))
+        result['score_s'] = time.time()-start
+        result['vocabulary'] = len(luTable.index_to_key if hasattr(luTable, 'index_to_key') else luTable.index2word)
+    except Exception:
+        result['error'] = traceback.format_exc()
+    result['peak_rss_mb'] = peak_rss()
+    return result
+
+
+# --- Function that runs a sweep. ---
+# :param grid: dictionary whose keys are the names of the hyperparameters (mode, sg, size, window, negative, epochs) and values are lists of values
+# :param root: folder of the sweep
+# :param parallel: nr. of trials trained at the same time
+# :param threads: nr. of threads of the training of each trial
+# :param force: whether to run again the trials already in trials.jsonl
+# :param verbose: whether to print the progress
+# :return results: list of the results of all the trials of the grid that succeeded, in this or in a previous run (see _run_trial)
+# :return failed: list of the results of the trials of this run that failed
+
+def run_sweep(grid, root=path_sweep, parallel=1, threads=1, force=False, verbose=True):
+
+    os.makedirs(root, exist_ok=True)
+    trials = combinations(grid)
+    artifacts = prepare(root, max(grid['window']), verbose)
+
+    done = dict()                                   # key of the trial -> its result
+    path_trials = os.path.join(root, 'trials.jsonl')
+    if os.path.exists(path_trials) and not force:
+        with open(path_trials, encoding='utf-8') as f:
+            for line in f:
+                result = json.loads(line)
+                if 'error' not in result:
+                    done[trial_key(result['params'])] = result
+    todo = [params for params in trials if trial_key(params) not in done]
+
+    vocabs = dict()                                 # window -> path of its vocabulary, counted once for all the trials with that window
+    for window in sorted(set(params['window'] for params in todo)):
+        vocabs[window] = os.path.join(root, 'vocab_{}.tsv'.format(window))
+        save_vocabulary(build_vocabulary(RowCorpus(artifacts['rows'], window), main.MIN_COUNT, main.VOCAB_THRESHOLD), vocabs[window])
+
+    if verbose:
+        print('{} trials, {} already done, {} to run ({} at a time)'.format(len(trials), len(trials)-len(todo), len(todo), parallel))
+    jobs = [(params, artifacts['rows'], vocabs[params['window']], threads) for params in todo]
+    failed = []
+    pool = multiprocessing.Pool(parallel, initializer=_init_trial, initargs=(artifacts['word2senses'],), maxtasksperchild=1)   # a process per trial
+    try:
+        with open(path_trials, 'a', encoding='utf-8') as f:
+            for count, result in enumerate(pool.imap_unordered(_run_trial, jobs), 1):
+                f.write(json.dumps(result) + '\n')
+                f.flush()
+                if 'error' not in result:
+                    done[trial_key(result['params'])] = result
+                else:
+                    failed.append(result)
+                if verbose:
+                    status = 'ERROR' if 'error' in result else 'score {:.4f} in {:.1f}s'.format(result['score'], result['train_s'])
+                    print('[{}/{}] {} {}'.format(count, len(jobs), trial_key(result['params']), status))
+                    if 'error' in result:
+                        print(result['error'])
+    finally:
+        pool.terminate()
+        pool.join()
+
+    results = [done[trial_key(params)] for params in trials if trial_key(params) in done]
+    with open(os.path.join(root, 'leaderboard.json'), 'w', encoding='utf-8') as f:
+        json.dump(leaderboard(results + failed), f, indent=2)                # the failed trials of this run are ranked last
+    return results, failed
+
+
+# --- Function that returns the sort key of the result of a trial: the scored trials first, by decreasing score, then the ones whose score is nan
+# and the failed ones last. ---
+# :param result: result of a trial (see _run_trial)
+# :return key: tuple to sort the results by
+
+def rank_key(result):
+
+    score = result.get('score', float('nan'))
+    if 'error' in result:
+        return (2, 0.0)
+    if math.isnan(score):
+        return (1, 0.0)
+    return (0, -score)
+
+
+# --- Function that sorts the results of the trials by decreasing score, the trials without a score last. ---
+# :param results: list of the results of the trials
+# :return results: the sorted list, each result with its rank
+
+def leaderboard(results):
+
+    ranked = sorted(results, key=rank_key)          # stable: the trials with the same key keep their order
+    return [dict(result, rank=rank) for rank, result in enumerate(ranked, 1)]
+
+
+# --- Function that formats the leaderboard as a text table. ---
+# :param results: list of the results of the trials
+# :return table: the table as a string
+
+def format_leaderboard(results):
+
+    lines = ['{:>4} {:<6} {:>2} {:>5} {:>6} {:>8} {:>6} {:>8} {:>9} {:>9} {:>9}'.format('rank', 'mode', 'sg', 'size', 'window', 'negative', 'epochs',
+                                                                                      'score', 'train (s)', 'score (s)', 'peak (MB)')]
+    for result in leaderboard(results):
+        p = result['params']
+        nan = float('nan')
+        score = 'failed' if 'error' in result else '{:.4f}'.format(result['score'])
+        lines.append('{:>4} {:<6} {:>2} {:>5} {:>6} {:>8} {:>6} {:>8} {:>9.1f} {:>9.1f} {:>9.0f}'.format(
+            result['rank'], p['mode'], p['sg'], p['size'], p['window'], p['negative'], p['epochs'], score, result.get('train_s', nan),
+            result.get('score_s', nan), result.get('peak_rss_mb', nan)))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Trains and scores all the combinations of the given hyperparameters.')
+    parser.add_argument('--mode', nargs='+', default=[main.MODE], choices=['cbow', 'senses'], help='training modes (see main.fit)')
+    parser.add_argument('--sg', nargs='+', type=int, default=[0], choices=[0, 1], help='0 for CBOW, 1 for skip-gram (cbow mode only)')
+    parser.add_argument('--size', nargs='+', type=int, default=[main.EMBEDDING_SIZE], help='sizes of the embeddings')
+    parser.add_argument('--window', nargs='+', type=int, default=[main.WINDOW_SIZE], help='window sizes')
+    parser.add_argument('--negative', nargs='+', type=int, default=[main.NEGATIVE_SAMPLING], help='nr. of negative samples')
+    parser.add_argument('--epochs', nargs='+', type=int, default=[main.EPOCHS], help='nr. of epochs')
+    parser.add_argument('--parallel', type=int, default=1, help='nr. of trials trained at the same time')
+    parser.add_argument('--threads', type=int, default=1, help='nr. of threads of each trial')
+    parser.add_argument('--root', default=path_sweep, help='folder of the sweep')
+    parser.add_argument('--force', action='store_true', help='runs again the trials already done')
+    args = parser.parse_args()
+
+    grid = dict((name, getattr(args, name)) for name in ('mode', 'sg', 'size', 'window', 'negative', 'epochs'))
+    results, failed = run_sweep(grid, args.root, args.parallel, args.threads, args.force)
+    print(format_leaderboard(results + failed))
+    print('{} trials in the leaderboard, {} failed in this run'.format(len(results), len(failed)))
+    if failed:
+        sys.exit(1)
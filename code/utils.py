@@ -5,16 +5,26 @@
 #
 # It parses the EuroSense dataset returning the English sentences and annotations with a bi-univocal correspondance, while creating a dictionary of 
 # babelNet-WordNet ids relations as to fulfill this purpose.
-# It contains a method that builds a document containing all lemma_synsets' embeddings in the required format and path.
+# It contains a method that builds a document containing all lemma_synsets' embeddings in the required format and path, and the methods that save
+# only the sense embeddings directly from the model, in word2vec text or binary format or as a memory-mappable .npy matrix with its vocabulary.
 # Additional methods are contained: used to confirm that the scoring file contains words not present in the annotation file; alternative implementations 
 # of the vocabulary building so as to bypass the fact that Gensim automatically discards all the words that appear less than three times by providing
 # the possibility to change this threshold.
 # -----------------------------------------------------------------------------------------------------------------------------------------------------------
 
+import os
+import json
+import functools
+import collections
 from lxml import etree
 import numpy as np
+from gensim.models import KeyedVectors
+from cache_utils import mapping_version, file_signature, shard_key
+from store_utils import EUROSENSE_COLUMNS, link_store
+from profiling import instrument, first_length, result_length
 
 punctuation = ['.', ',', ':', ';', '"', "'", '!', '$', '£', '%', '&', '/', '(', ')', '=', '?', '^', '-', '_', '|', '<', '>', '+', '-', '*']
+PUNCTUATION = frozenset(punctuation)
 
 # --- Function that builds the dictionary of BabelNet-WordNet ids correspondances. ---
 # :param path: path of the bn2wn_mapping file
@@ -33,12 +43,167 @@ def collect_bn2wn(path):
     txt.close()
     return d
 
+POS_TAGS = 'nvars'     # parts of speech of the BabelNet and WordNet ids, the index of each one is its integer code
+
+# --- Function that encodes a BabelNet id as an integer. ---
+# Only the ids in the fixed format 'bn:' + 8 digits + part of speech are well-formed, so that e.g. 'bn:123n' is not read as 'bn:00000123n'.
+# :param bn_id: BabelNet id like 'bn:00000001n'
+# :return key: 8 * numeric part of the id + code of its part of speech, -1 if the id is not well-formed
+
+def encode_bn_id(bn_id):
+
+    if not isinstance(bn_id, str) or len(bn_id) != 12 or not bn_id.startswith('bn:') or bn_id[-1] not in POS_TAGS:
+        return -1
+    digits = bn_id[3:11]
+    if not (digits.isascii() and digits.isdigit()):
+        return -1
+    return int(digits)*8 + POS_TAGS.index(bn_id[-1])
+
+
+# --- Function that builds the binary version of the bn2wn_mapping file. ---
+# It writes a folder with the sorted integer keys of the BabelNet ids, the corr. WordNet offsets and parts of speech and a meta.json file with the
+# signature of the source file and the version of the mapping.
+# :param path: path of the bn2wn_mapping file
+# :param dst: folder of the binary mapping
+
+def build_bn2wn(path, dst):
+
+    d = collect_bn2wn(path)
+    keys = np.fromiter((encode_bn_id(bn_id) for bn_id in d), dtype=np.int64, count=len(d))
+    offsets = np.fromiter((int(wn_id[:-1]) for wn_id in d.values()), dtype=np.int64, count=len(d))
+    pos = np.fromiter((POS_TAGS.index(wn_id[-1]) for wn_id in d.values()), dtype=np.uint8, count=len(d))
+    order = np.argsort(keys, kind='stable')         # sorted keys for the binary search
+    os.makedirs(dst, exist_ok=True)
+    np.save(os.path.join(dst, 'keys.npy'), keys[order])
+    np.save(os.path.join(dst, 'offsets.npy'), offsets[order])
+    np.save(os.path.join(dst, 'pos.npy'), pos[order])
+    with open(os.path.join(dst, 'meta.json'), 'w', encoding='utf-8') as f:    # written last, marks the mapping as complete
+        json.dump({'source': file_signature(path), 'version': mapping_version(d)}, f)
+
+
+# --- Class that exposes a binary mapping as a read-only dictionary from BabelNet ids to WordNet ids. ---
+# The arrays are memory-mapped; single lookups use a binary search (the most recent ones are cached), batch lookups are vectorized.
+
+class Bn2WnMapping(object):
+
+    def __init__(self, path):
+
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            self.version = json.load(f)['version']      # same value of mapping_version of the corr. dictionary
+        self.keys = np.load(os.path.join(path, 'keys.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+        self.pos = np.load(os.path.join(path, 'pos.npy'), mmap_mode='r')
+        self.find = functools.lru_cache(maxsize=1 << 17)(self._find)
+
+    def __getstate__(self):            # sent to the worker processes as its path only, they map the same files
+
+        return self.path
+
+    def __setstate__(self, path):
+
+        self.__init__(path)
+
+    # --- Method that finds the position of a BabelNet id in the sorted arrays. ---
+    # :param bn_id: BabelNet id
+    # :return i: index of the id, -1 if it is not in the mapping
+
+    def _find(self, bn_id):
+
+        key = encode_bn_id(bn_id)
+        i = int(np.searchsorted(self.keys, key))
+        if key < 0 or i == len(self.keys) or self.keys[i] != key:
+            return -1
+        return i
+
+    def __len__(self):
+
+        return len(self.keys)
+
+    def __contains__(self, bn_id):
+
+        return self.find(bn_id) >= 0
+
+    def __getitem__(self, bn_id):
+
+        i = self.find(bn_id)
+        if i < 0:
+            raise KeyError(bn_id)
+        return '%08d%s' % (self.offsets[i], POS_TAGS[self.pos[i]])     # same format of the bn2wn_mapping file
+
+    def __iter__(self):
+
+        for key in self.keys.tolist():
+            yield 'bn:%08d%s' % (key // 8, POS_TAGS[key % 8])
+
+    def get(self, bn_id, default=None):
+
+        return self[bn_id] if bn_id in self else default
+
+    # --- Method that returns the WordNet id of a BabelNet id already split in its parts. ---
+    # :param bn_id: BabelNet id
+    # :return pos, offset: part of speech and integer offset of the corr. WordNet synset
+
+    def wordnet(self, bn_id):
+
+        i = self.find(bn_id)
+        if i < 0:
+            raise KeyError(bn_id)
+        return POS_TAGS[self.pos[i]], int(self.offsets[i])
+
+    # --- Method that looks up many BabelNet ids at once. ---
+    # :param keys: integer array of BabelNet ids encoded with encode_bn_id
+    # :return found: boolean array, True where the id is in the mapping
+    # :return pos: array of the codes of the parts of speech of the WordNet ids (meaningful only where found)
+    # :return offsets: array of the WordNet offsets (meaningful only where found)
+
+    def lookup(self, keys):
+
+        keys = np.asarray(keys, dtype=np.int64)
+        index = np.minimum(np.searchsorted(self.keys, keys), len(self.keys)-1)
+        found = (keys >= 0) & (self.keys[index] == keys)
+        return found, self.pos[index], self.offsets[index]
+
+
+# --- Function that opens the binary BabelNet-WordNet mapping, building it first if it is missing or older than the bn2wn_mapping file. ---
+# :param path: path of the bn2wn_mapping file
+# :param dst: folder of the binary mapping (by default next to the bn2wn_mapping file)
+# :return mapping: Bn2WnMapping usable in place of the dictionary returned by collect_bn2wn
+
+@instrument(result_length)
+def load_bn2wn(path, dst=None):
+
+    if dst is None:
+        dst = os.path.splitext(path)[0] + '_bin'
+    try:
+        with open(os.path.join(dst, 'meta.json'), encoding='utf-8') as f:
+            stale = json.load(f)['source'] != file_signature(path)
+    except (OSError, ValueError, KeyError):
+        stale = True
+    if stale:
+        build_bn2wn(path, dst)
+    return Bn2WnMapping(dst)
+
+
+# --- Function that returns the WordNet id corr. to a BabelNet one, split in its parts. ---
+# :param d: dictionary (or Bn2WnMapping) of the BabelNet-WordNet ids correspondances
+# :param bn_id: BabelNet id
+# :return pos, offset: part of speech and integer offset of the WordNet synset
+
+def wordnet_id(d, bn_id):
+
+    if isinstance(d, Bn2WnMapping):
+        return d.wordnet(bn_id)
+    offset = d[bn_id]
+    return offset[-1], int(offset[:-1])
+
 # --- Function that parse the EuroSense dataset. ---
 # :param path: the path of the EuroSense XML file to parse
 # :param d: dictionary of the BabelNet-WordNet ids correspondances
 # :return sentences: list of English sentences encountered while parsing the XML file
 # :return annotations: list of the same length of sentences whose elements are lists of the corr. annots with elems in the form of triples (anchor, lemma, id_synset)
 
+@instrument(first_length)
 def trim_xml(path, d):
     
     sentences = []
@@ -62,13 +227,32 @@ def trim_xml(path, d):
         element.clear()                                                         # discard the subtree freeing the allocated memory
     return sentences,  annotations          
 
+# --- Function that parse the EuroSense dataset going through the parse cache. ---
+# :param path: the path of the EuroSense XML file to parse
+# :param d: dictionary of the BabelNet-WordNet ids correspondances
+# :param cache: ParseCache, the file is parsed again only if it or the mapping changed since it was cached
+# :param use_hash: if True the file is identified by the hash of its content instead of its size and modification time
+# :param out: folder where the columnar store of the dataset is exposed (without copying the cached one), None to skip it
+# :return sentences, annotations: memory-mapped views of the sentences and the annotations, as returned by trim_xml
+
+@instrument(first_length)
+def parse_eurosense(path, d, cache, use_hash=False, out='euroStore'):
+
+    key = shard_key('eurosense', file_signature(path, use_hash), mapping_version(d))
+    sentences, annotations = cache.get_or_parse(key, lambda: trim_xml(path, d), EUROSENSE_COLUMNS)
+    if out is not None:
+        store = link_store(cache.path(key), out)
+        sentences, annotations = store.sentences, store.annotations
+    return sentences, annotations
+
 # --- Function that filters the embedding.vec file by overriding it with only sense embeddings. ---
 # :param path: path of the embeddings.vec file in the KeyedVector format
+# :param dst_path: path for a temporary file
 # :return None: it writes in the path file the sense embeddings in the KeyedVector format required
 
-def filter_embedding(path):
+@instrument()
+def filter_embedding(path, dst_path='../resources/full_embeddings.vec'):
 
-    dst_path = '../resources/full_embeddings.vec'       # path for a temporary file
     f = open(path, encoding='utf-8')
     dst_file = open(dst_path, 'w', encoding='utf-8')
     embSize = f.readline().split()[1]                   # gets the embedding size from the first row
@@ -91,6 +275,114 @@ def filter_embedding(path):
     file_src.close()
     file_dst.close()
 
+# --- Function that returns the senses of a model and their embeddings, without the word embeddings. ---
+# :param luTable: the look-up table of the embeddings (Gensim KeyedVectors or MappedEmbeddings)
+# :return senses: list of the senses (the keys containing a BabelNet id)
+# :return vectors: 2D float32 array whose rows are the embeddings of the senses
+
+def sense_embeddings(luTable):
+
+    keys = luTable.index_to_key if hasattr(luTable, 'index_to_key') else luTable.index2word    # Gensim 4 or Gensim 3 (and MappedEmbeddings)
+    rows = [i for i, key in enumerate(keys) if '_bn:' in key]
+    return [keys[i] for i in rows], np.asarray(luTable.vectors[rows], dtype=np.float32)
+
+
+# --- Function that builds a look-up table from keys and vectors. ---
+# :param keys: list of the keys
+# :param vectors: 2D array whose rows are the corr. embeddings
+# :return luTable: Gensim KeyedVectors
+
+def keyed_vectors(keys, vectors):
+
+    luTable = KeyedVectors(vectors.shape[1])
+    if hasattr(luTable, 'add_vectors'):                         # Gensim 4
+        luTable.add_vectors(list(keys), vectors)
+    else:                                                       # Gensim 3
+        luTable.add(list(keys), vectors)
+    return luTable
+
+
+# --- Function that saves only the sense embeddings of a model in word2vec format (the text one is the same written by filter_embedding). ---
+# :param luTable: the look-up table of the embeddings (Gensim KeyedVectors or MappedEmbeddings)
+# :param path: path of the file
+# :param binary: whether to use the binary word2vec format instead of the text one
+
+@instrument()
+def save_senses(luTable, path, binary=False):
+
+    senses, vectors = sense_embeddings(luTable)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write('{} {}\n'.format(len(senses), vectors.shape[1]).encode('utf-8'))  # nr. of sense emb. and their emb. size
+        if binary:
+            for sense, row in zip(senses, vectors.astype('<f4')):
+                f.write(sense.encode('utf-8') + b' ' + row.tobytes())
+        else:
+            line = '%s' + ' %.9g'*vectors.shape[1] + '\n'                             # enough digits to read back the same float32 values
+            for sense, row in zip(senses, vectors.tolist()):
+                f.write((line % (sense, *row)).encode('utf-8'))
+    os.replace(tmp, path)
+
+
+# --- Function that returns the path of the vocabulary of embeddings saved in .npy format. ---
+# :param path: path of the .npy file
+# :return path: path of the vocabulary
+
+def vocab_path(path):
+
+    return os.path.splitext(path)[0] + '.vocab'
+
+
+# --- Function that saves only the sense embeddings of a model as a raw .npy matrix and its vocabulary (a sense per line). ---
+# :param luTable: the look-up table of the embeddings (Gensim KeyedVectors or MappedEmbeddings)
+# :param path: path of the .npy file, the vocabulary is saved next to it with the .vocab extension
+
+@instrument()
+def save_senses_npy(luTable, path):
+
+    senses, vectors = sense_embeddings(luTable)
+    with open(vocab_path(path) + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(''.join(sense + '\n' for sense in senses))
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, vectors)
+    os.replace(vocab_path(path) + '.tmp', vocab_path(path))
+    os.replace(path + '.tmp', path)
+
+
+# --- Class that exposes embeddings saved by save_senses_npy as a read-only look-up table, memory-mapping the matrix. ---
+
+class MappedEmbeddings(object):
+
+    def __init__(self, path):
+
+        self.vectors = np.load(path, mmap_mode='r')         # the rows are read from the disk only when used
+        with open(vocab_path(path), encoding='utf-8') as f:
+            self.index2word = f.read().splitlines()
+        self.key_to_index = dict((key, i) for i, key in enumerate(self.index2word))
+        self.vector_size = self.vectors.shape[1]
+
+    def __len__(self):
+
+        return len(self.index2word)
+
+    def __contains__(self, key):
+
+        return key in self.key_to_index
+
+    def __getitem__(self, key):
+
+        return np.asarray(self.vectors[self.key_to_index[key]])
+
+
+# --- Function that loads the embeddings saved by save_senses_npy. ---
+# :param path: path of the .npy file
+# :return luTable: the MappedEmbeddings
+
+def load_embeddings(path):
+
+    return MappedEmbeddings(path)
+
+
 # --------- ADDITIONAL METHODS --------------------------------------------------------------------------------
 
 # --- Function that counts the occurrences of each word in the text. ---
@@ -101,32 +393,31 @@ def filter_embedding(path):
 
 def count_occurrences(dictionary, sentence):
 
-    i = 0                                   # total occurrences counter
-    parts = sentence.split()  
-    for part in parts:                      # for each word of the sentence
-        if part not in punctuation:         # discards the punctuation symbols
-            i += 1
-            if part not in dictionary:
-                dictionary[part] = 1        # if the word is new add to the dict. with freq. 1       
-            else:
-                dictionary[part] = dictionary[part]+1 # ptherwise increment the freq.
-    return dictionary, i
+    parts = [part for part in sentence.split() if part not in PUNCTUATION]    # discards the punctuation symbols
+    if isinstance(dictionary, collections.Counter):
+        dictionary.update(parts)            # counts the whole sentence at once
+    else:
+        for part in parts:
+            dictionary[part] = dictionary.get(part, 0)+1
+    return dictionary, len(parts)
 
 
 # --- Function that creates the vocabulary from the plain text according to a threshold. ---
-# :param sentences: the list of the plain text
+# The sentences are streamed, so they can be any iterable (e.g. the sentences of a columnar store) and are never all kept in memory.
+# :param sentences: iterable of the plain text
 # :param threshold: the threshold for the relative frequences of the words under which the words are discarded
 # :return dictionary: dictionary whose keys are the words and their values are the indices of those words
 
+@instrument(result_length)
 def create_vocabulary(sentences, threshold):
 
     index = 0
-    freq_dict = dict()
+    freq_dict = collections.Counter()
     dictionary = {'<PAD>': 0, '<UNK>': 1}                       # augments the dictionary with the unknown and padding words
 
-    for elem in sentences:                                      # for each word
+    for elem in sentences:                                      # for each sentence
         if elem != None:
-            freq_dict, i = count_occurrences(freq_dict, elem)    # gets the updated dictionary with the frequences and the number of total occ. of that word
+            freq_dict, i = count_occurrences(freq_dict, elem)   # gets the updated counter with the frequences and the number of words of that sentence
             index += i
 
     for word, freq in freq_dict.items():                        
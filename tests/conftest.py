@@ -0,0 +1,41 @@
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+#   Fixtures shared by the tests.
+#
+# @author Giada Simionato <simionato.1822614@studenti.uniroma1.it>
+#
+# The modules of the framework are imported from the code folder, as when the scripts are run from there. The word lists of the validity filter are
+# small synthetic ones written in a temporary folder, which is the working directory of the tests that use them.
+# -----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'code'))
+
+import fix_inconsistencies
+
+STOPWORDS = ['the', 'is', 'of', 'a', 'and', 'in']
+LONG_STOPWORDS = ['near', 'however']
+WORDS1 = ['i']
+WORDS2 = ['tv', 'go']
+
+
+# --- Fixture that writes the word lists of the validity filter in a temporary working directory and resets the state built from them. ---
+# :return path: the working directory
+
+@pytest.fixture
+def resources(tmp_path, monkeypatch):
+
+    for name, words in (('stopwords.json', STOPWORDS), ('long_stopwords.json', LONG_STOPWORDS), ('1words.json', WORDS1), ('2words.json', WORDS2)):
+        with open(os.path.join(str(tmp_path), name), 'w') as handle:
+            json.dump(words, handle)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(fix_inconsistencies, '_filter', None)
+    monkeypatch.setattr(fix_inconsistencies, '_verdicts', dict())
+    monkeypatch.setattr(fix_inconsistencies, 'token2id', {fix_inconsistencies.PAD: 0})
+    monkeypatch.setattr(fix_inconsistencies, 'id2token', np.array([fix_inconsistencies.PAD]*16, dtype=object))
+    monkeypatch.setattr(fix_inconsistencies, '_validity', np.zeros(16, dtype=bool))
+    return tmp_path
@@ -0,0 +1,88 @@
+import os
+import math
+import sqlite3
+import importlib.metadata
+import numpy as np
+import analysis_inconsistencies
+from analysis_inconsistencies import InconsistencyReport
+
+
+# --- Report of a sample whose sentences have the given (annotations, not in sentence) counts. ---
+
+def sampled_report(sentences, population):
+
+    report = InconsistencyReport(population=population)
+    for n, positives in sentences:
+        before = report.snapshot()
+        report.sentences += 1
+        report.totals['all'] += n
+        report.counts['not_in_sentence'] += positives
+        report.add_cluster(before)
+    return report
+
+
+def test_confidence_interval_is_computed_over_the_sentences():
+
+    sentences = [(1, 0), (4, 4), (2, 1), (3, 0), (5, 5), (1, 1), (2, 0), (6, 0)]
+    report = sampled_report(sentences, population=80)
+    n = np.array([s[0] for s in sentences], dtype=float)
+    y = np.array([s[1] for s in sentences], dtype=float)
+    p = y.sum()/n.sum()
+    se = math.sqrt((1-8/80) * np.var(y - p*n, ddof=1) / 8) / n.mean()      # textbook ratio estimator
+    low, high = report.confidence_interval('not_in_sentence')
+    assert math.isclose(report.percentage('not_in_sentence'), 100*p)
+    assert math.isclose(low, 100*(p-1.96*se)) and math.isclose(high, 100*(p+1.96*se))
+
+    independent = sampled_report([(1, int(i < y.sum())) for i in range(int(n.sum()))], population=10*int(n.sum()))
+    low_i, high_i = independent.confidence_interval('not_in_sentence')
+    assert high - low > high_i - low_i             # annotations of the same sentence are correlated: the interval is wider
+
+
+def test_confidence_interval_degenerate_cases():
+
+    assert all(math.isnan(b) for b in sampled_report([(3, 1)], population=10).confidence_interval('not_in_sentence'))
+    assert all(math.isnan(b) for b in sampled_report([(3, 1), (2, 0)], population=10).confidence_interval('in_but_wrong_annot'))
+    report = sampled_report([(3, 1), (2, 0)], population=2)
+    assert report.confidence_interval('not_in_sentence') == (20.0, 20.0)    # the whole corpus was sampled
+    report.population = None
+    assert report.confidence_interval('not_in_sentence') == (20.0, 20.0)
+
+
+def test_language_cache_is_versioned_and_committed_in_batches(tmp_path, monkeypatch):
+
+    path = os.path.join(str(tmp_path), 'languages.sqlite')
+    monkeypatch.setattr(analysis_inconsistencies, 'LANGUAGE_CACHE_PATH', path)
+    monkeypatch.setattr(analysis_inconsistencies, 'LANGUAGE_BATCH', 2)
+    monkeypatch.setattr(analysis_inconsistencies, '_language_db', None)
+    monkeypatch.setattr(analysis_inconsistencies, '_pending_languages', 0)
+    analysis_inconsistencies.which_language.cache_clear()
+    table = analysis_inconsistencies.language_table()
+    assert table == 'languages_{}_seed{}'.format(importlib.metadata.version('langdetect').replace('.', '_'), analysis_inconsistencies.LANGUAGE_SEED)
+
+    def stored():
+
+        return dict(sqlite3.connect(path).execute('SELECT anchor, lang FROM {}'.format(table)))   # what another process would see
+
+    langs = analysis_inconsistencies.detect_languages(['the house', 'la casa', 'das Haus', 'the house'])
+    assert stored() == langs and len(langs) == 3
+    analysis_inconsistencies.which_language('il fiume')
+    assert 'il fiume' not in stored()                   # committed with the next detection
+    analysis_inconsistencies.which_language('the river')
+    assert {'il fiume', 'the river'} <= set(stored())
+
+
+def test_lemma_table_rebuilt_for_another_wordnet(tmp_path, monkeypatch):
+
+    path = os.path.join(str(tmp_path), 'bn2lemma.tsv')
+    mapping = {'bn:00008364n': '09213565n'}
+    built = []
+    monkeypatch.setattr(analysis_inconsistencies, '_lemma_tables', dict())
+    monkeypatch.setattr(analysis_inconsistencies, 'build_lemma_table', lambda d, p: built.append(p) or {'bn:00008364n': 'rebuilt'})
+    monkeypatch.setattr(analysis_inconsistencies, 'wordnet_version', lambda: '3.0')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('# ' + analysis_inconsistencies.lemma_table_key(mapping) + '\nbn:00008364n\tbank\n')
+
+    assert analysis_inconsistencies.lemma_table(mapping, path) == {'bn:00008364n': 'bank'} and not built
+    analysis_inconsistencies._lemma_tables.clear()
+    monkeypatch.setattr(analysis_inconsistencies, 'wordnet_version', lambda: '3.1')
+    assert analysis_inconsistencies.lemma_table(mapping, path) == {'bn:00008364n': 'rebuilt'} and built == [path]
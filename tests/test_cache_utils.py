@@ -0,0 +1,73 @@
+import os
+from cache_utils import ParseCache, shard_key, mapping_version
+from store_utils import EUROSENSE_COLUMNS
+from utils import parse_eurosense
+
+XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<corpus>
+<sentence id="0">
+<text lang="en">{text}</text>
+<text lang="it">la banca del fiume</text>
+<annotations>
+<annotation lang="en" anchor="Bank" lemma="bank">bn:00008364n</annotation>
+<annotation lang="en" anchor="river" lemma="river">bn:00067948n</annotation>
+<annotation lang="it" anchor="banca" lemma="banca">bn:00008364n</annotation>
+</annotations>
+</sentence>
+</corpus>
+'''
+
+BN2WN = {'bn:00008364n': '09213565n', 'bn:00067948n': '09411430n'}
+
+
+def write_xml(path, text):
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(XML.format(text=text))
+
+
+def parse(tmp_path, cache, path, d):
+
+    sentences, annotations = parse_eurosense(path, d, cache, out=os.path.join(str(tmp_path), 'euroStore'))
+    return list(sentences), [[list(a) for a in annotation] for annotation in annotations]
+
+
+def test_parse_cache_hit_and_invalidation(tmp_path):
+
+    path = os.path.join(str(tmp_path), 'eurosense.xml')
+    write_xml(path, 'The Bank of the river')
+    cache = ParseCache(os.path.join(str(tmp_path), 'cache'))
+
+    first = parse(tmp_path, cache, path, BN2WN)
+    assert first == (['The Bank of the river'], [[['Bank', 'bank', 'bn:00008364n'], ['river', 'river', 'bn:00067948n']]])
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert parse(tmp_path, cache, path, BN2WN) == first                 # unchanged file and mapping: loaded from the cache
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    write_xml(path, 'The Bank of the long river')                       # changed file
+    assert parse(tmp_path, cache, path, BN2WN)[0] == ['The Bank of the long river']
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    mapping = {'bn:00008364n': '09213565n'}                            # changed mapping
+    assert parse(tmp_path, cache, path, mapping)[1] == [[['Bank', 'bank', 'bn:00008364n']]]
+    assert (cache.hits, cache.misses) == (1, 3)
+    assert parse(tmp_path, cache, path, BN2WN)[1] == [[['Bank', 'bank', 'bn:00008364n'], ['river', 'river', 'bn:00067948n']]]
+    assert (cache.hits, cache.misses) == (2, 3)
+
+
+def test_get_or_parse_parses_once(tmp_path):
+
+    cache = ParseCache(str(tmp_path))
+    calls = []
+    key = shard_key('test', ['source', 1], mapping_version(BN2WN))
+
+    def parser():
+
+        calls.append(1)
+        return ['a sentence'], [[('a', 'a', 'bn:00000001n')]]
+
+    for _ in range(2):
+        sentences, annotations = cache.get_or_parse(key, parser, EUROSENSE_COLUMNS)
+        assert list(sentences) == ['a sentence']
+    assert len(calls) == 1 and key in cache
+    assert shard_key('test', ['source', 2], mapping_version(BN2WN)) not in cache
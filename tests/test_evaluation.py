@@ -0,0 +1,24 @@
+import os
+import numpy as np
+from evaluation import Evaluation
+from sense_index import build_sense_index
+from utils import keyed_vectors
+
+
+def test_coverage_counts_the_pairs_with_senses(tmp_path):
+
+    keys = ['up_bn:00000001n', 'down_bn:00000002n', 'left_bn:00000003n']
+    vectors = np.array([[1, 0], [-1, 0], [0, 1]], dtype=np.float32)             # up and down have cosine -1.0
+    luTable = keyed_vectors(keys, vectors)
+    word2senses = {'up': ['bn:00000001n'], 'down': ['bn:00000002n'], 'left': ['bn:00000003n'], 'right': ['bn:00000004n']}
+    path = os.path.join(str(tmp_path), 'bench.tab')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('up\tdown\t1\nup\tleft\t5\nleft\tright\t3\nsky\tup\t2\n')
+    evaluation = Evaluation([path], word2senses)
+
+    for model in (luTable, build_sense_index(luTable, word2senses)):
+        cosines, found = evaluation.cosines(model)
+        np.testing.assert_allclose(cosines[0], [-1.0, 0.0, -1.0, -1.0], atol=1e-6)
+        assert found[0].tolist() == [True, True, False, False]
+        result = evaluation.score(model)[0]
+        assert (result['covered'], result['coverage']) == (2, 50.0)
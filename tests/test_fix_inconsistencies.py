@@ -0,0 +1,111 @@
+import random
+import pytest
+from conftest import STOPWORDS, LONG_STOPWORDS, WORDS1, WORDS2
+from fix_inconsistencies import PAD, punctuation, fix_data, fix_row, fix_sentences, build_rows
+
+SENSE = 'bn:00008364n'
+
+
+# --- Function that tells whether a token is a valid context element, as documented in isValid. ---
+
+def valid(token):
+
+    if not token or token in punctuation or token.isdigit() or token in STOPWORDS or token in LONG_STOPWORDS:
+        return False
+    if len(token) == 1:
+        return token in WORDS1
+    if len(token) == 2:
+        return token in WORDS2
+    return True
+
+
+# --- Reference row of an annotation: the sense replaces the first whole-word occurrence of the anchor, the context being the windowSize valid words
+# before and after it in the sentence, padded. ---
+
+def reference_row(sentence, a, windowSize):
+
+    tokens = sentence.lower().split()
+    anchor = a[0].lower().split()
+    start = next(i for i in range(len(tokens)) if tokens[i:i+len(anchor)] == anchor)
+    before = [t for t in tokens[:start] if valid(t)][::-1][:windowSize]
+    after = [t for t in tokens[start+len(anchor):] if valid(t)][:windowSize]
+    before = before + [PAD]*(windowSize-len(before))
+    after = after + [PAD]*(windowSize-len(after))
+    return before[::-1] + [a[1].lower().replace(' ', '_')+'_'+a[2]] + after
+
+
+# --- Row built as fix_row did before the windows were extracted from the tokens: every occurrence of the anchor in the sentence, even inside other
+# words, was replaced by the sense. ---
+
+def replace_row(sentence, a, windowSize):
+
+    sense = a[1].lower().replace(' ', '_')+'_'+a[2]
+    parts = sentence.replace(a[0].lower(), sense).split()
+    index = parts.index(sense)
+    before = [t for t in parts[:index] if valid(t)][::-1][:windowSize]
+    after = [t for t in parts[index+1:] if valid(t)][:windowSize]
+    return (before + [PAD]*(windowSize-len(before)))[::-1] + [sense] + after + [PAD]*(windowSize-len(after))
+
+
+def test_fix_row_documented_rows(resources):
+
+    sentence = 'the bank near the bankside river bank is old .'
+    assert fix_row(sentence, ('Bank', 'Bank', SENSE), 2) == [PAD, PAD, 'bank_'+SENSE, 'bankside', 'river']
+    assert fix_row('i love new york city today', ('New York', 'New York', 'bn:1n'), 2) == ['i', 'love', 'new_york_bn:1n', 'city', 'today']
+    assert fix_row('go see 42 tv at bank of a', ('bank', 'bank', SENSE), 3) == ['go', 'see', 'tv', 'bank_'+SENSE, PAD, PAD, PAD]
+
+
+def test_fix_row_does_not_rewrite_longer_words(resources):
+
+    sentence = 'the bank near the bankside river bank is old .'
+    a = ('Bank', 'Bank', SENSE)
+    assert replace_row(sentence, a, 2) == [PAD, PAD, 'bank_'+SENSE, 'bank_'+SENSE+'side', 'river']     # the bug of sentence.replace
+    assert fix_row(sentence, a, 2) == reference_row(sentence, a, 2)
+
+
+def test_fix_data_skips_invalid_annotations(resources):
+
+    sentences = ['The Bank is near', 'no annotations here', 'a banker smiles']
+    annotations = [[('bank', 'bank', SENSE), ('ban', 'ban', 'bn:2n')], [], [('bank', 'bank', SENSE)]]
+    assert fix_data(sentences, annotations, 1) == [[PAD, 'bank_'+SENSE, PAD]]
+    with pytest.raises(ValueError):
+        fix_row('a banker smiles', ('bank', 'bank', SENSE), 1)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_fix_data_matches_reference(resources, workers):
+
+    rng = random.Random(0)
+    words = ['bank', 'banks', 'river', 'stream', 'rive', 'riverbank', 'money', 'mon', 'tv', 'go', 'i', 'x', '7', ',', '.'] + STOPWORDS + LONG_STOPWORDS
+    sentences, annotations = [], []
+    for _ in range(300):
+        tokens = [rng.choice(words) for _ in range(rng.randint(3, 15))]
+        anchors = [t for t in tokens if valid(t)]
+        sentences.append(' '.join(tokens).capitalize())
+        annotations.append([(anchor, anchor, 'bn:%08dn' % rng.randint(0, 9)) for anchor in rng.sample(anchors, min(2, len(anchors)))])
+    expected, old = [], []
+    for sentence, annotation in zip(sentences, annotations):
+        sentence = sentence.lower()
+        for a in annotation:
+            if ' '+a[0].lower()+' ' in sentence:
+                expected.append(reference_row(sentence, a, 3))
+                old.append(replace_row(sentence, a, 3))
+
+    rows = fix_data(sentences, annotations, 3, chunkSize=32, workers=workers)
+    assert rows == expected
+    changed = [i for i in range(len(rows)) if rows[i] != old[i]]
+    assert 0 < len(changed) < len(rows)             # only the rows where the anchor is inside another word of the window change
+    for i in changed:
+        assert any(rows[i][3] in token for token in old[i][:3] + old[i][4:])
+
+
+def test_build_rows_respects_sentence_bounds(resources):
+
+    sentences = ['river bank money', 'stream bank tv river stream']
+    annotations = [[('bank', 'bank', SENSE)], [('bank', 'bank', SENSE), ('river', 'river', 'bn:3n')]]
+    together = fix_sentences(sentences, annotations, 2)
+    alone = [row for s, a in zip(sentences, annotations) for row in fix_sentences([s], [a], 2)]
+    assert together == alone == [reference_row(s, a, 2) for s, annotation in zip(sentences, annotations) for a in annotation]
+    assert together[0] == [PAD, 'river', 'bank_'+SENSE, 'money', PAD]
+    assert build_rows(['river', 'bank', 'money'], [('x', 3, 3, 0, 3)], 1) == [['money', 'x', PAD]]
+    assert build_rows([], [], 2) == []
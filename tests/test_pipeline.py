@@ -0,0 +1,37 @@
+import os
+import collections
+import cache_utils
+from cache_utils import folder_signature
+from pipeline import Stage, Pipeline
+
+
+def write_tree(root):
+
+    for folder in ('a', 'b'):
+        os.makedirs(os.path.join(root, folder))
+        for name in ('1.xml', '2.xml'):
+            with open(os.path.join(root, folder, name), 'w', encoding='utf-8') as f:
+                f.write(folder + name)
+
+
+def test_parse_stage_reuses_the_folder_signatures(tmp_path, monkeypatch):
+
+    sew = os.path.join(str(tmp_path), 'sew')
+    write_tree(sew)
+    listed = collections.Counter()
+    listdir = os.listdir
+    monkeypatch.setattr(os, 'listdir', lambda path: listed.update([os.path.abspath(path)]) or listdir(path))
+
+    def parse(inputs, params):
+
+        return {'signatures': [folder_signature(os.path.join(sew, folder)) for folder in sorted(os.listdir(sew))]}   # as parse_sew does
+
+    pipeline = Pipeline([Stage('parse', parse, files=[sew])], os.path.join(str(tmp_path), 'pipeline'), isolate=False)
+    pipeline.run(verbose=False)
+    assert listed[os.path.join(sew, 'a')] == listed[os.path.join(sew, 'b')] == 1     # listed for the fingerprint only
+    assert cache_utils._folder_signatures is None                                  # not kept after the stage
+
+    with open(os.path.join(sew, 'b', '3.xml'), 'w', encoding='utf-8') as f:
+        f.write('new')
+    assert [status for _, status, _, _ in pipeline.run(verbose=False)] == ['run']   # a new file in a folder changes the fingerprint
+    assert [status for _, status, _, _ in pipeline.run(verbose=False)] == ['skipped']
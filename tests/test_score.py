@@ -0,0 +1,58 @@
+import numpy as np
+from score import get_cosine, max_cosines, pair_cosines, sense_indexes
+from sense_index import build_sense_index
+from utils import keyed_vectors
+
+
+# --- Brute-force maximum cosine similarity among the senses of a pair, -1.0 when a word has no senses. ---
+
+def brute_force(vectors, senses1, senses2):
+
+    best = -1.0
+    found = False
+    for i in senses1:
+        for j in senses2:
+            u, v = vectors[i], vectors[j]
+            norms = np.linalg.norm(u) * np.linalg.norm(v)
+            cosine = float(np.dot(u, v) / norms) if norms > 0 else 0.0
+            best = cosine if not found else max(best, cosine)
+            found = True
+    return best
+
+
+def test_max_cosines_matches_brute_force():
+
+    rng = np.random.RandomState(0)
+    vectors = rng.randn(40, 8)
+    vectors[5] = 0                                  # a null embedding has null similarities
+    unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    pairs = [(list(rng.choice(40, rng.randint(0, 5), replace=False)), list(rng.choice(40, rng.randint(0, 5), replace=False))) for _ in range(200)]
+    pairs.append(([5], [1, 2]))
+    width = 5
+    indexes1 = np.array([p[0] + [-1]*(width-len(p[0])) for p in pairs])
+    indexes2 = np.array([p[1] + [-1]*(width-len(p[1])) for p in pairs])
+
+    cosines = max_cosines(unit, indexes1, indexes2, batchSize=16)
+    np.testing.assert_allclose(cosines, [brute_force(vectors, s1, s2) for s1, s2 in pairs], atol=1e-9)
+    assert cosines[-1] == 0.0
+    assert all(cosines[i] == -1.0 for i, (s1, s2) in enumerate(pairs) if not s1 or not s2)
+
+
+def test_pair_cosines_same_with_sense_index():
+
+    rng = np.random.RandomState(1)
+    keys = ['bank_bn:1n', 'bank_bn:2n', 'river_bn:3n', 'money_bn:4n', 'money']
+    luTable = keyed_vectors(keys, rng.randn(len(keys), 6).astype(np.float32))
+    word2senses = {'bank': ['bn:1n', 'bn:2n', 'bn:9n'], 'river': ['bn:3n'], 'money': ['bn:4n']}
+    words1, words2 = ['bank', 'bank', 'river', 'lake'], ['river', 'money', 'money', 'bank']
+
+    cosines = pair_cosines(words1, words2, luTable, word2senses)
+    np.testing.assert_allclose(cosines, pair_cosines(words1, words2, build_sense_index(luTable, word2senses), None), atol=1e-6)
+    index = dict((key, i) for i, key in enumerate(keys))
+    vectors = np.array([luTable[key] for key in keys])
+    expected = [brute_force(vectors, [i for i in row if i >= 0], [j for j in other if j >= 0])
+                for row, other in zip(sense_indexes(words1, index, word2senses), sense_indexes(words2, index, word2senses))]
+    np.testing.assert_allclose(cosines, expected, atol=1e-6)
+    assert cosines[-1] == -1.0
+    index = build_sense_index(luTable, word2senses)
+    np.testing.assert_allclose([get_cosine(w1, w2, index) for w1, w2 in zip(words1, words2)], cosines, atol=1e-6)
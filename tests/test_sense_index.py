@@ -0,0 +1,51 @@
+import os
+import numpy as np
+from sense_index import SenseIndex, build_sense_index, load_sense_index, index_path
+from utils import keyed_vectors
+
+KEYS = ['bank_bn:00008364n', 'bank_bn:00008365n', 'river_bn:00067948n', 'river', 'new_york_bn:00041611n', 'null_bn:00000001n']
+
+
+def luTable():
+
+    vectors = np.random.RandomState(0).randn(len(KEYS), 4).astype(np.float32)
+    vectors[-1] = 0
+    return keyed_vectors(KEYS, vectors)
+
+
+def test_sense_index_from_model():
+
+    index = build_sense_index(luTable())
+    assert index.lemmas == ['bank', 'new_york', 'null', 'river']
+    assert index.senses_of('bank') == ['bank_bn:00008364n', 'bank_bn:00008365n']
+    assert index.senses_of('lake') == [] and 'lake' not in index
+    np.testing.assert_allclose(np.linalg.norm(index.vectors[:-2], axis=1), 1, rtol=1e-6)
+    assert not index.vectors[index.rows('null')[0]].any()      # null embeddings stay null
+    assert index.gather(['river', 'lake', 'bank']).tolist() == [[4, -1], [-1, -1], [0, 1]]
+
+
+def test_sense_index_save_load_round_trip(tmp_path):
+
+    index = build_sense_index(luTable(), {'bank': ['bn:00008364n', 'bn:00000009n'], 'river': ['bn:00067948n'], 'lake': ['bn:00000010n']})
+    index.meta = {'source': ['embeddings.vec', 1, 2], 'senses': 'abc'}
+    path = os.path.join(str(tmp_path), 'index.npz')
+    index.save(path)
+    loaded = SenseIndex.load(path)
+
+    assert loaded.lemmas == index.lemmas == ['bank', 'river']
+    assert loaded.senses == index.senses == ['bank_bn:00008364n', 'river_bn:00067948n']
+    assert loaded.indptr.tolist() == index.indptr.tolist()
+    assert loaded.meta == index.meta
+    np.testing.assert_array_equal(loaded.vectors, index.vectors)
+    np.testing.assert_array_equal(loaded.pair_cosines(['bank'], ['river']), index.pair_cosines(['bank'], ['river']))
+
+
+def test_load_sense_index_rebuilt_when_the_senses_change(tmp_path):
+
+    path = os.path.join(str(tmp_path), 'embeddings.vec')
+    luTable().save_word2vec_format(path)
+    first = load_sense_index(path, {'bank': ['bn:00008364n']})
+    assert os.path.exists(index_path(path)) and first.lemmas == ['bank']
+    assert load_sense_index(path, {'bank': ['bn:00008364n']}).meta == first.meta
+    assert load_sense_index(path, {'river': ['bn:00067948n']}).lemmas == ['river']
+    assert load_sense_index(path).lemmas == ['bank', 'new_york', 'null', 'river']
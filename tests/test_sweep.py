@@ -0,0 +1,23 @@
+from sweep import leaderboard, format_leaderboard
+
+PARAMS = {'mode': 'cbow', 'sg': 0, 'size': 20, 'window': 2, 'negative': 5, 'epochs': 1}
+
+
+def trial(score=None, error=None):
+
+    result = {'params': PARAMS, 'peak_rss_mb': 10.0}
+    if error is not None:
+        result['error'] = error
+    else:
+        result.update(score=score, train_s=1.0, score_s=0.5)
+    return result
+
+
+def test_leaderboard_ranks_nan_and_failed_trials_last():
+
+    results = [trial(0.1), trial(error='Traceback'), trial(float('nan')), trial(0.5), trial(-0.2)]
+    ranked = leaderboard(results)
+    assert [r['rank'] for r in ranked] == [1, 2, 3, 4, 5]
+    assert [r.get('score') for r in ranked[:3]] == [0.5, 0.1, -0.2]
+    assert ranked[3]['score'] != ranked[3]['score'] and 'error' in ranked[4]
+    assert format_leaderboard(results).splitlines()[-1].split()[7] == 'failed'
@@ -0,0 +1,60 @@
+import os
+import pickle
+import numpy as np
+import pytest
+from cache_utils import mapping_version
+from utils import collect_bn2wn, load_bn2wn, encode_bn_id, wordnet_id
+
+MAPPING = [('bn:00008364n', '09213565n'), ('bn:00000001v', '00000002v'), ('bn:00067948n', '09411430n'), ('bn:00100000a', '01234567a'),
+           ('bn:00000042r', '00000099r'), ('bn:00000007s', '00000777s')]
+
+
+def write_mapping(path, mapping):
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(''.join(bn_id + '\t' + wn_id + '\n' for bn_id, wn_id in mapping))
+
+
+def test_bn2wn_mapping_lookup(tmp_path):
+
+    path = os.path.join(str(tmp_path), 'bn2wn_mapping.txt')
+    write_mapping(path, MAPPING)
+    d = collect_bn2wn(path)
+    mapping = load_bn2wn(path)
+
+    assert len(mapping) == len(d)
+    assert mapping.version == mapping_version(d)
+    for bn_id, wn_id in MAPPING:
+        assert bn_id in mapping and mapping[bn_id] == wn_id
+        assert wordnet_id(mapping, bn_id) == wordnet_id(d, bn_id) == (wn_id[-1], int(wn_id[:-1]))
+    for missing in ('bn:00008364v', 'bn:99999999n', 'bn:0000x001n', '', '00008364n'):
+        assert missing not in mapping and mapping.get(missing) is None
+        with pytest.raises(KeyError):
+            mapping[missing]
+    assert sorted(mapping) == sorted(d)
+
+    keys = np.array([encode_bn_id(bn_id) for bn_id in ['bn:00067948n', 'bn:00000002n', 'nonsense', 'bn:00000007s']])
+    found, pos, offsets = mapping.lookup(keys)
+    assert found.tolist() == [True, False, False, True]
+    assert offsets[found].tolist() == [9411430, 777]
+
+    assert pickle.loads(pickle.dumps(mapping))['bn:00000042r'] == '00000099r'  # sent to the workers by path
+
+
+def test_bn2wn_mapping_rebuilt_when_source_changes(tmp_path):
+
+    path = os.path.join(str(tmp_path), 'bn2wn_mapping.txt')
+    write_mapping(path, MAPPING[:2])
+    assert 'bn:00067948n' not in load_bn2wn(path)
+    write_mapping(path, MAPPING)
+    mapping = load_bn2wn(path)
+    assert mapping['bn:00067948n'] == '09411430n'
+    assert mapping.version == mapping_version(collect_bn2wn(path))
+
+
+def test_encode_bn_id_only_well_formed_ids():
+
+    assert encode_bn_id('bn:00000123n') == 123*8 and encode_bn_id('bn:00067948s') == 67948*8 + 4
+    for bn_id in (None, 123, b'bn:00000123n', '', 'bn:123n', 'bn:000000123n', 'bn:0000012 n', 'bn:+0000123n', 'bn:0000012٣n', 'xx:00000123n',
+                  'bn:00000123x'):
+        assert encode_bn_id(bn_id) == -1